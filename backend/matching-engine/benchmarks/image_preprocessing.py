@@ -0,0 +1,149 @@
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measure the payload size and latency saved by image preprocessing.
+
+Without input files, the benchmark uses synthetic 12 megapixel photos:
+
+    python -m benchmarks.image_preprocessing --format WEBP
+
+With a project id, it also measures end-to-end embedding latency with and
+without preprocessing, which calls the multimodal embedding model:
+
+    python -m benchmarks.image_preprocessing --input-files photos/*.jpg \\
+        --project-id my-project
+"""
+
+import argparse
+import base64
+import concurrent.futures
+import io
+import os
+import statistics
+import tempfile
+import time
+from typing import List
+
+import numpy as np
+from PIL import Image
+
+from services import image_preprocessing
+
+
+def make_synthetic_photo(seed: int, width: int = 4032, height: int = 3024) -> bytes:
+    """Make a JPEG with smooth gradients and sensor-like noise."""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 1, width, dtype=np.float32)
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    channels = [
+        255 * (0.5 + 0.5 * np.sin(2 * np.pi * (rng.uniform(1, 4) * x + rng.uniform(1, 4) * y)))
+        for _ in range(3)
+    ]
+    pixels = np.stack(channels, axis=-1) + rng.normal(scale=12, size=(height, width, 3))
+
+    output = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(
+        output, format="JPEG", quality=95
+    )
+    return output.getvalue()
+
+
+def time_embeddings(
+    project_id: str, image_paths: List[str], preprocess_images: bool
+) -> float:
+    """Get the median latency of embedding each image."""
+    from services.multimodal_embedding_client import MultimodalEmbeddingPredictionClient
+
+    client = MultimodalEmbeddingPredictionClient(
+        project_id=project_id, preprocess_images=preprocess_images
+    )
+
+    latencies = []
+    for image_path in image_paths:
+        start = time.perf_counter()
+        client.get_embedding(image_file=image_path)
+        latencies.append(time.perf_counter() - start)
+
+    return statistics.median(latencies)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--input-files", nargs="*", default=[])
+    parser.add_argument("--num-images", type=int, default=8)
+    parser.add_argument(
+        "--max-dimension", type=int, default=image_preprocessing.DEFAULT_MAX_DIMENSION
+    )
+    parser.add_argument(
+        "--format", choices=["JPEG", "WEBP"], default=image_preprocessing.DEFAULT_FORMAT
+    )
+    parser.add_argument("--quality", type=int, default=image_preprocessing.DEFAULT_QUALITY)
+    parser.add_argument("--project-id", default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        image_paths = args.input_files
+        if not image_paths:
+            for seed in range(args.num_images):
+                image_path = os.path.join(temp_dir, f"{seed}.jpg")
+                with open(image_path, "wb") as f:
+                    f.write(make_synthetic_photo(seed))
+                image_paths.append(image_path)
+
+        images = [open(image_path, "rb").read() for image_path in image_paths]
+        options = dict(
+            max_dimension=args.max_dimension, format=args.format, quality=args.quality
+        )
+
+        start = time.perf_counter()
+        preprocessed = [
+            image_preprocessing.preprocess_image_bytes(image, **options)
+            for image in images
+        ]
+        serial_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        futures = [
+            image_preprocessing.submit_preprocess_image_bytes(image, **options)
+            for image in images
+        ]
+        concurrent.futures.wait(futures)
+        pool_seconds = time.perf_counter() - start
+
+        original_bytes = sum(len(image) for image in images)
+        preprocessed_bytes = sum(len(image) for image in preprocessed)
+        original_payload = sum(len(base64.b64encode(image)) for image in images)
+        preprocessed_payload = sum(len(base64.b64encode(image)) for image in preprocessed)
+
+        print(f"{len(images)} images, {args.format} at {args.max_dimension}px")
+        print(f"{'':<14}{'bytes':>12}{'base64':>12}")
+        print(f"{'original':<14}{original_bytes:>12}{original_payload:>12}")
+        print(f"{'preprocessed':<14}{preprocessed_bytes:>12}{preprocessed_payload:>12}")
+        print(f"Payload reduced {original_payload / preprocessed_payload:.1f}x")
+        print(
+            f"Preprocessing: {serial_seconds * 1000 / len(images):.1f} ms/image serial, "
+            f"{pool_seconds * 1000 / len(images):.1f} ms/image on the worker pool"
+        )
+
+        if args.project_id:
+            for preprocess_images in (False, True):
+                latency = time_embeddings(
+                    args.project_id, image_paths, preprocess_images=preprocess_images
+                )
+                label = "preprocessed" if preprocess_images else "original"
+                print(f"Embedding latency, {label}: {latency * 1000:.0f} ms median")
+
+
+if __name__ == "__main__":
+    main()
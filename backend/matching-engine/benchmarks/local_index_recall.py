@@ -0,0 +1,159 @@
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measure recall, memory and latency of the local index storage options.
+
+Recall@k is measured against an exact float32 scan. Without input files, the
+benchmark runs on synthetic clustered embeddings:
+
+    python -m benchmarks.local_index_recall --num-items 100000 --dimensions 1408
+
+With input files in the Matching Engine input format, some of the records are
+held out and used as queries:
+
+    python -m benchmarks.local_index_recall --input-files embeddings/*.json
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from typing import List, Tuple
+
+import numpy as np
+
+import build_local_index
+from services import local_index
+
+
+def make_synthetic_embeddings(
+    num_items: int, dimensions: int, num_clusters: int = 100
+) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(num_clusters, dimensions))
+    assignments = rng.integers(num_clusters, size=num_items)
+    embeddings = centers[assignments] + 0.5 * rng.normal(size=(num_items, dimensions))
+    return embeddings.astype(np.float32)
+
+
+def run_configuration(
+    index_dir: str,
+    embeddings: np.ndarray,
+    queries: np.ndarray,
+    expected: np.ndarray,
+    args: argparse.Namespace,
+    storage: str,
+    index_type: str,
+) -> Tuple[float, float, float]:
+    """Build an index and get its recall, bytes per row and mean latency."""
+    index = local_index.build(
+        index_dir,
+        (
+            local_index.Record(id=str(row), embedding=embedding)
+            for row, embedding in enumerate(embeddings)
+        ),
+        dimensions=embeddings.shape[1],
+        distance_measure=args.distance_measure,
+        index_type=index_type,
+        storage=storage,
+        pq_subspaces=args.pq_subspaces,
+    )
+    index.num_probes = args.num_probes
+    index.rescore_factor = args.rescore_factor
+
+    hits = 0
+    start = time.perf_counter()
+    for query, expected_rows in zip(queries, expected):
+        neighbors = index.search(query, num_neighbors=args.k)
+        hits += len({int(neighbor.id) for neighbor in neighbors} & set(expected_rows))
+    latency = (time.perf_counter() - start) / len(queries)
+
+    scanned_bytes = (
+        index.base.codes.nbytes
+        if storage != local_index.STORAGE_FLOAT32
+        else index.base.vectors.nbytes
+    )
+
+    return hits / expected.size, scanned_bytes / len(embeddings), latency
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--input-files", nargs="*", default=[])
+    parser.add_argument("--num-items", type=int, default=20000)
+    parser.add_argument("--dimensions", type=int, default=256)
+    parser.add_argument("--num-queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument(
+        "--distance-measure",
+        choices=local_index.DISTANCE_MEASURES,
+        default=local_index.DOT_PRODUCT_DISTANCE,
+    )
+    parser.add_argument("--pq-subspaces", type=int, default=None)
+    parser.add_argument("--num-probes", type=int, default=local_index.DEFAULT_NUM_PROBES)
+    parser.add_argument(
+        "--rescore-factor", type=int, default=local_index.DEFAULT_RESCORE_FACTOR
+    )
+    args = parser.parse_args()
+
+    if args.input_files:
+        embeddings = np.asarray(
+            [
+                record.embedding
+                for record in build_local_index.read_records(args.input_files)
+            ],
+            dtype=np.float32,
+        )
+    else:
+        embeddings = make_synthetic_embeddings(args.num_items, args.dimensions)
+
+    # Hold out the queries, so they are not exact matches of indexed rows
+    queries, embeddings = embeddings[: args.num_queries], embeddings[args.num_queries :]
+
+    if args.distance_measure == local_index.COSINE_DISTANCE:
+        normalized = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        exact_scores = queries @ normalized.T
+    elif args.distance_measure == local_index.SQUARED_L2_DISTANCE:
+        exact_scores = 2 * queries @ embeddings.T - (embeddings**2).sum(axis=1)
+    else:
+        exact_scores = queries @ embeddings.T
+    expected = np.argsort(-exact_scores, axis=1)[:, : args.k]
+
+    results: List[Tuple[str, str, float, float, float]] = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for index_type in local_index.INDEX_TYPES:
+            for storage in local_index.STORAGES:
+                recall, bytes_per_row, latency = run_configuration(
+                    os.path.join(temp_dir, f"{index_type}-{storage}"),
+                    embeddings,
+                    queries,
+                    expected,
+                    args,
+                    storage=storage,
+                    index_type=index_type,
+                )
+                results.append((index_type, storage, recall, bytes_per_row, latency))
+
+    float32_bytes = embeddings.shape[1] * 4
+    print(f"{len(embeddings)} rows, {embeddings.shape[1]} dimensions, recall@{args.k}")
+    print(f"{'index':<6}{'storage':<9}{'recall':>8}{'bytes/row':>11}{'ratio':>7}{'ms/query':>10}")
+    for index_type, storage, recall, bytes_per_row, latency in results:
+        print(
+            f"{index_type:<6}{storage:<9}{recall:>8.3f}{bytes_per_row:>11.0f}"
+            f"{float32_bytes / bytes_per_row:>6.0f}x{latency * 1000:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
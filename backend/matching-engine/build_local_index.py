@@ -0,0 +1,156 @@
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Build and update local indexes, see services/local_index.py.
+
+Input files are JSON lines in the Matching Engine input format, i.e. one
+`{"id": ..., "embedding": [...]}` object per line. Any other fields, such as
+`restricts`, are kept as the record's metadata. Shards written by
+embedding_pipeline.py (`shard-NNNNN.npy`) can be used as input files too.
+
+    python build_local_index.py build indexes/my_service embeddings/*.json \\
+        --distance-measure DOT_PRODUCT_DISTANCE --index-type ivf --storage pq
+    python build_local_index.py upsert indexes/my_service new_embeddings.json
+    python build_local_index.py delete indexes/my_service deleted_ids.txt
+    python build_local_index.py compact indexes/my_service
+
+A service reads the index from LOCAL_INDEX_DIR/<service id> and picks up every
+new version without a restart.
+"""
+
+import argparse
+import json
+import logging
+from typing import Iterable, Iterator
+
+import embedding_pipeline
+from services import local_index
+
+logger = logging.getLogger(__name__)
+
+
+def read_records(input_files: Iterable[str]) -> Iterator[local_index.Record]:
+    """Stream records from JSON lines files and embedding pipeline shards."""
+    for input_file in input_files:
+        if input_file.endswith(embedding_pipeline.SHARD_SUFFIX):
+            for id, embedding, metadata in embedding_pipeline.read_shard(input_file):
+                yield local_index.Record(id=id, embedding=embedding, metadata=metadata)
+            continue
+
+        with open(input_file, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+
+                entry = json.loads(line)
+                id = entry.pop("id")
+                embedding = entry.pop("embedding")
+
+                yield local_index.Record(
+                    id=str(id), embedding=embedding, metadata=entry or None
+                )
+
+
+def read_ids(input_files: Iterable[str]) -> Iterator[str]:
+    """Stream ids from text files, one id per line."""
+    for input_file in input_files:
+        with open(input_file, "r") as f:
+            for line in f:
+                if line.strip():
+                    yield line.strip()
+
+
+def get_dimensions(input_files: Iterable[str]) -> int:
+    for record in read_records(input_files):
+        return len(record.embedding)
+
+    raise ValueError("No records found in the input files")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Build a new index")
+    build_parser.add_argument("index_dir")
+    build_parser.add_argument("input_files", nargs="+")
+    build_parser.add_argument(
+        "--distance-measure",
+        choices=local_index.DISTANCE_MEASURES,
+        default=local_index.DOT_PRODUCT_DISTANCE,
+    )
+    build_parser.add_argument(
+        "--index-type", choices=local_index.INDEX_TYPES, default=local_index.INDEX_TYPE_FLAT
+    )
+    build_parser.add_argument("--num-lists", type=int, default=None)
+    build_parser.add_argument(
+        "--storage", choices=local_index.STORAGES, default=local_index.STORAGE_FLOAT32
+    )
+    build_parser.add_argument("--pq-subspaces", type=int, default=None)
+    build_parser.add_argument(
+        "--chunk-size", type=int, default=local_index.DEFAULT_CHUNK_SIZE
+    )
+
+    upsert_parser = subparsers.add_parser("upsert", help="Insert or replace records")
+    upsert_parser.add_argument("index_dir")
+    upsert_parser.add_argument("input_files", nargs="+")
+
+    delete_parser = subparsers.add_parser("delete", help="Delete records by id")
+    delete_parser.add_argument("index_dir")
+    delete_parser.add_argument("id_files", nargs="+")
+
+    for subparser in (upsert_parser, delete_parser):
+        subparser.add_argument(
+            "--max-delta-ratio",
+            type=float,
+            default=0.1,
+            help="Compact once the delta segment exceeds this fraction of the base",
+        )
+
+    compact_parser = subparsers.add_parser(
+        "compact", help="Merge the delta segment into the base segment"
+    )
+    compact_parser.add_argument("index_dir")
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        index = local_index.build(
+            index_dir=args.index_dir,
+            records=read_records(args.input_files),
+            dimensions=get_dimensions(args.input_files),
+            distance_measure=args.distance_measure,
+            index_type=args.index_type,
+            num_lists=args.num_lists,
+            chunk_size=args.chunk_size,
+            storage=args.storage,
+            pq_subspaces=args.pq_subspaces,
+        )
+    elif args.command == "upsert":
+        local_index.upsert(args.index_dir, read_records(args.input_files))
+        index = local_index.compact_if_needed(args.index_dir, args.max_delta_ratio)
+    elif args.command == "delete":
+        local_index.delete(args.index_dir, read_ids(args.id_files))
+        index = local_index.compact_if_needed(args.index_dir, args.max_delta_ratio)
+    else:
+        index = local_index.compact(args.index_dir)
+
+    logger.info(
+        f"Index {args.index_dir} is at version {index.version} with {index.count} records"
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -6,6 +6,13 @@ logger = logging.getLogger(__name__)
 GCP_PROJECT_ID = os.environ.get("GCP_PROJECT_ID")
 GCS_BUCKET = os.environ.get("GCS_BUCKET")
 
+# Directory with local indexes, one subdirectory per match service id
+LOCAL_INDEX_DIR = os.environ.get("LOCAL_INDEX_DIR")
+
+# Upper bound on the time spent on remote calls per request. Clients can ask
+# for less with the X-Request-Timeout header.
+REQUEST_TIMEOUT_SECONDS = float(os.environ.get("REQUEST_TIMEOUT_SECONDS", "30"))
+
 if GCP_PROJECT_ID is None or len(GCP_PROJECT_ID) == 0:
     logger.error("GCP_PROJECT_ID not set")
     raise RuntimeError("GCP_PROJECT_ID not set")
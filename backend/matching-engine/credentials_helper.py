@@ -0,0 +1,177 @@
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A process-wide cache of access tokens, refreshed in the background.
+
+Fetching a token is a round trip to the token endpoint, so tokens are cached
+until shortly before they expire. A background thread refreshes the token
+`refresh_margin_seconds` ahead of its expiry, so requests keep getting the
+current token without waiting. Only the very first call in a process (or a
+call made after a refresh kept failing until the token expired) waits for a
+fetch.
+
+The refresh thread is started on first use in each process, so the cache keeps
+working in workers forked by gunicorn.
+"""
+
+import datetime
+import logging
+import os
+import threading
+import time
+from typing import Callable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REFRESH_MARGIN_SECONDS = 300.0
+DEFAULT_FETCH_TIMEOUT_SECONDS = 10.0
+# Waits between failed refreshes, doubling up to the maximum
+MIN_RETRY_SECONDS = 1.0
+MAX_RETRY_SECONDS = 60.0
+
+# Fetches a new token and returns it with its expiry, in UTC
+TokenProvider = Callable[[], Tuple[str, Optional[datetime.datetime]]]
+
+
+def get_default_token() -> Tuple[str, Optional[datetime.datetime]]:
+    """Fetch a token for the application default credentials."""
+    import google.auth
+    import google.auth.transport.requests
+
+    creds, _ = google.auth.default(
+        scopes=["https://www.googleapis.com/auth/cloud-platform"]
+    )
+    # creds.valid is False, and creds.token is None
+    # Need to refresh credentials to populate those
+    creds.refresh(google.auth.transport.requests.Request())
+
+    if not creds.token:
+        raise RuntimeError("No access token found")
+
+    # google.auth reports expiry as a naive UTC datetime
+    expiry = creds.expiry.replace(tzinfo=datetime.timezone.utc) if creds.expiry else None
+
+    return creds.token, expiry
+
+
+class TokenCache:
+    """Caches a token and refreshes it in the background before it expires."""
+
+    def __init__(
+        self,
+        provider: TokenProvider = get_default_token,
+        refresh_margin_seconds: float = DEFAULT_REFRESH_MARGIN_SECONDS,
+        fetch_timeout_seconds: float = DEFAULT_FETCH_TIMEOUT_SECONDS,
+    ) -> None:
+        self.provider = provider
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.fetch_timeout_seconds = fetch_timeout_seconds
+        self._condition = threading.Condition()
+        self._token: Optional[str] = None
+        # Monotonic time at which the token expires, or None if it never does
+        self._expires_at: Optional[float] = None
+        self._error: Optional[Exception] = None
+        self._thread_pid: Optional[int] = None
+
+    def _is_valid(self) -> bool:
+        return self._token is not None and (
+            self._expires_at is None or time.monotonic() < self._expires_at
+        )
+
+    def _fetch(self) -> float:
+        """Fetch a token and get the seconds until the next refresh."""
+        token, expiry = self.provider()
+
+        expires_at = None
+        if expiry is not None:
+            expires_in = (
+                expiry - datetime.datetime.now(datetime.timezone.utc)
+            ).total_seconds()
+            expires_at = time.monotonic() + expires_in
+
+        with self._condition:
+            self._token = token
+            self._expires_at = expires_at
+            self._error = None
+            self._condition.notify_all()
+
+        if expires_at is None:
+            return float("inf")
+
+        # Refresh ahead of expiry, but not in a tight loop for short-lived tokens
+        return max(expires_in - self.refresh_margin_seconds, expires_in / 2, 0.0)
+
+    def _refresh_loop(self) -> None:
+        retry_seconds = MIN_RETRY_SECONDS
+
+        while True:
+            try:
+                wait_seconds = self._fetch()
+                retry_seconds = MIN_RETRY_SECONDS
+            except Exception as ex:
+                logger.error(f"Error refreshing access token: {ex}")
+                with self._condition:
+                    self._error = ex
+                    self._condition.notify_all()
+
+                wait_seconds = retry_seconds
+                retry_seconds = min(retry_seconds * 2, MAX_RETRY_SECONDS)
+
+            if wait_seconds == float("inf"):
+                return
+
+            time.sleep(wait_seconds)
+
+    def start(self) -> None:
+        """Start refreshing in the background, if not already in this process."""
+        with self._condition:
+            if self._thread_pid == os.getpid():
+                return
+
+            self._thread_pid = os.getpid()
+            threading.Thread(
+                target=self._refresh_loop, name="token_refresh", daemon=True
+            ).start()
+
+    def get_token(self) -> str:
+        """Get the current token.
+
+        Raises:
+            RuntimeError: If no valid token could be fetched in time.
+        """
+        with self._condition:
+            if self._is_valid() and self._thread_pid == os.getpid():
+                return self._token
+
+        self.start()
+
+        with self._condition:
+            # Wait for the first fetch, or for a refresh of an expired token
+            self._condition.wait_for(
+                lambda: self._is_valid() or self._error is not None,
+                timeout=self.fetch_timeout_seconds,
+            )
+
+            if not self._is_valid():
+                raise RuntimeError(f"No access token available: {self._error}")
+
+            return self._token
+
+
+_default_token_cache = TokenCache()
+
+
+def get_access_token() -> str:
+    """Get an access token for the application default credentials."""
+    return _default_token_cache.get_token()
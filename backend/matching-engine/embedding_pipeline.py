@@ -0,0 +1,348 @@
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Embed a corpus with a match service's encoder, e.g. to re-index it.
+
+Inputs are JSON lines files, with one `{"id": ..., "text": ...}` or
+`{"id": ..., "image": ...}` object per line (images are local paths or URLs,
+and any other fields are kept as metadata), or directories of image files,
+which are identified by their path relative to the directory.
+
+    python embedding_pipeline.py text_to_image_multimodal output/mercari \\
+        products.jsonl --input-type image --batch-size 32 --max-in-flight 8
+
+Items are streamed through the encoder in batches, with up to --max-in-flight
+batches being embedded at a time. Embeddings are written to shards:
+
+    shard-NNNNN.npy           float32 embeddings, one row per item
+    shard-NNNNN.ids.corpus    the ids of the rows, see corpus_helper.py
+    shard-NNNNN.metadata.corpus
+                              the metadata of the rows, as JSON objects
+
+Shards are written atomically, after which checkpoint.json records how many
+input items they cover. Running the same command again after a crash resumes
+from the last checkpoint. The shards can be passed straight to
+build_local_index.py.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import dataclasses
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+import numpy as np
+
+import corpus_helper
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FILE = "checkpoint.json"
+SHARD_SUFFIX = ".npy"
+IDS_SUFFIX = ".ids" + corpus_helper.CORPUS_SUFFIX
+METADATA_SUFFIX = ".metadata" + corpus_helper.CORPUS_SUFFIX
+
+INPUT_TYPE_TEXT = "text"
+INPUT_TYPE_IMAGE = "image"
+INPUT_TYPES = [INPUT_TYPE_TEXT, INPUT_TYPE_IMAGE]
+
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_MAX_IN_FLIGHT = 4
+DEFAULT_SHARD_SIZE = 100000
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp"}
+
+# Embeds the inputs of a batch, with None for inputs that couldn't be embedded
+EmbedBatch = Callable[[List[str]], List[Optional[List[float]]]]
+
+
+@dataclasses.dataclass
+class PipelineItem:
+    id: str
+    input: str
+    metadata: Optional[Dict[str, Any]] = None
+
+
+@dataclasses.dataclass
+class PipelineStats:
+    items_done: int = 0
+    items_embedded: int = 0
+    items_failed: int = 0
+    seconds: float = 0.0
+
+    @property
+    def items_per_second(self) -> float:
+        return self.items_done / self.seconds if self.seconds > 0 else 0.0
+
+
+def read_items(input_paths: Iterable[str], input_type: str) -> Iterator[PipelineItem]:
+    """Stream items from JSON lines files and directories of images.
+
+    The order is deterministic, which is what makes resuming possible.
+    """
+    for input_path in input_paths:
+        if os.path.isdir(input_path):
+            if input_type != INPUT_TYPE_IMAGE:
+                raise ValueError(f"Directories can only be read as images: {input_path}")
+
+            for directory, subdirectories, file_names in os.walk(input_path):
+                subdirectories.sort()
+                for file_name in sorted(file_names):
+                    if os.path.splitext(file_name)[1].lower() not in IMAGE_EXTENSIONS:
+                        continue
+
+                    image_path = os.path.join(directory, file_name)
+                    yield PipelineItem(
+                        id=os.path.relpath(image_path, input_path), input=image_path
+                    )
+        else:
+            with open(input_path, "r") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+
+                    entry = json.loads(line)
+                    id = entry.pop("id")
+                    input = entry.pop(input_type)
+
+                    yield PipelineItem(id=str(id), input=input, metadata=entry or None)
+
+
+def _chunked(items: Iterator[PipelineItem], size: int) -> Iterator[List[PipelineItem]]:
+    batch: List[PipelineItem] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _write_json(data: Any, path: str) -> None:
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+def _read_checkpoint(output_dir: str) -> Dict[str, Any]:
+    checkpoint_path = os.path.join(output_dir, CHECKPOINT_FILE)
+
+    if not os.path.exists(checkpoint_path):
+        return {"items_done": 0, "items_failed": 0, "shards": []}
+
+    with open(checkpoint_path, "r") as f:
+        return json.load(f)
+
+
+def _write_shard(
+    output_dir: str,
+    shard_index: int,
+    items: List[PipelineItem],
+    embeddings: List[List[float]],
+) -> str:
+    """Write a shard, with its embeddings file moved into place last."""
+    shard_name = f"shard-{shard_index:05d}"
+    shard_path = os.path.join(output_dir, shard_name)
+
+    corpus_helper.write_corpus((item.id for item in items), shard_path + IDS_SUFFIX)
+    corpus_helper.write_corpus(
+        (json.dumps(item.metadata) if item.metadata else "" for item in items),
+        shard_path + METADATA_SUFFIX,
+    )
+
+    fd, temp_path = tempfile.mkstemp(dir=output_dir, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        np.save(f, np.asarray(embeddings, dtype=np.float32))
+    os.replace(temp_path, shard_path + SHARD_SUFFIX)
+
+    return shard_name + SHARD_SUFFIX
+
+
+def run(
+    items: Iterable[PipelineItem],
+    embed_batch: EmbedBatch,
+    output_dir: str,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    shard_size: int = DEFAULT_SHARD_SIZE,
+) -> PipelineStats:
+    """Embed items into shards, resuming from the last checkpoint.
+
+    Args:
+        items (Iterable[PipelineItem]): The items, in the same order on every run.
+        embed_batch (EmbedBatch): Embeds the inputs of a batch.
+        output_dir (str): Where shards and the checkpoint are written.
+        batch_size (int): The number of items passed to embed_batch at once.
+        max_in_flight (int): The number of batches embedded concurrently.
+        shard_size (int): The number of input items per shard.
+
+    Returns:
+        PipelineStats: The progress of this run.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    checkpoint = _read_checkpoint(output_dir)
+    items_skipped = checkpoint["items_done"]
+
+    item_iterator = iter(items)
+    for _ in range(items_skipped):
+        if next(item_iterator, None) is None:
+            break
+    if items_skipped:
+        logger.info(f"Resuming after {items_skipped} items")
+
+    stats = PipelineStats()
+    start = time.perf_counter()
+
+    shard_items: List[PipelineItem] = []
+    shard_embeddings: List[List[float]] = []
+    shard_items_done = 0
+
+    def flush() -> None:
+        nonlocal shard_items, shard_embeddings, shard_items_done
+        if shard_items_done == 0:
+            return
+
+        if shard_items:
+            checkpoint["shards"].append(
+                _write_shard(
+                    output_dir,
+                    len(checkpoint["shards"]),
+                    shard_items,
+                    shard_embeddings,
+                )
+            )
+        checkpoint["items_done"] += shard_items_done
+        checkpoint["items_failed"] += shard_items_done - len(shard_items)
+        _write_json(checkpoint, os.path.join(output_dir, CHECKPOINT_FILE))
+
+        stats.seconds = time.perf_counter() - start
+        logger.info(
+            f"{checkpoint['items_done']} items done, "
+            f"{stats.items_per_second:.1f} items/sec"
+        )
+        shard_items, shard_embeddings, shard_items_done = [], [], 0
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        in_flight: Deque[Any] = collections.deque()
+        batches = _chunked(item_iterator, batch_size)
+
+        while True:
+            # Keep the window full, then take results in input order
+            while len(in_flight) < max_in_flight:
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                in_flight.append(
+                    (batch, executor.submit(embed_batch, [item.input for item in batch]))
+                )
+
+            if not in_flight:
+                break
+
+            batch, future = in_flight.popleft()
+            for item, embedding in zip(batch, future.result()):
+                if embedding is None:
+                    logger.warning(f"Could not embed item {item.id}")
+                    stats.items_failed += 1
+                else:
+                    shard_items.append(item)
+                    shard_embeddings.append(embedding)
+                    stats.items_embedded += 1
+
+            shard_items_done += len(batch)
+            stats.items_done += len(batch)
+
+            if shard_items_done >= shard_size:
+                flush()
+
+        flush()
+
+    stats.seconds = time.perf_counter() - start
+    return stats
+
+
+def read_shard(
+    shard_file: str,
+) -> Iterator[Tuple[str, np.ndarray, Optional[Dict[str, Any]]]]:
+    """Stream (id, embedding, metadata) rows from a shard's .npy file."""
+    shard_path = shard_file[: -len(SHARD_SUFFIX)]
+    embeddings = np.load(shard_file, mmap_mode="r")
+    ids = corpus_helper.CorpusFile(shard_path + IDS_SUFFIX)
+    metadata = corpus_helper.CorpusFile(shard_path + METADATA_SUFFIX)
+
+    for row in range(len(ids)):
+        yield ids[row], embeddings[row], json.loads(metadata[row]) if metadata[row] else None
+
+
+def get_embed_batch(service: Any, input_type: str) -> EmbedBatch:
+    """Get a batch encoder from a match service."""
+    if input_type == INPUT_TYPE_TEXT:
+        return service.convert_texts_to_embeddings_batch
+    else:
+        return service.convert_images_to_embeddings_batch
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("service_id")
+    parser.add_argument("output_dir")
+    parser.add_argument("input_paths", nargs="+")
+    parser.add_argument("--input-type", choices=INPUT_TYPES, default=INPUT_TYPE_TEXT)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--max-in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT)
+    parser.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE)
+    args = parser.parse_args()
+
+    # Registering the services needs the server's environment, see constants.py
+    import register_services
+
+    services = register_services.register_services()
+    if args.service_id not in services:
+        raise ValueError(f"Match service not found: {args.service_id}")
+
+    stats = run(
+        read_items(args.input_paths, args.input_type),
+        embed_batch=get_embed_batch(services[args.service_id], args.input_type),
+        output_dir=args.output_dir,
+        batch_size=args.batch_size,
+        max_in_flight=args.max_in_flight,
+        shard_size=args.shard_size,
+    )
+
+    logger.info(
+        f"Embedded {stats.items_embedded} items ({stats.items_failed} failed) "
+        f"in {stats.seconds:.0f}s, {stats.items_per_second:.1f} items/sec"
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
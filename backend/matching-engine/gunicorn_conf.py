@@ -0,0 +1,62 @@
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Gunicorn config, picked up by the tiangolo/uvicorn-gunicorn image.
+
+It keeps the environment variables of the image's default config and adds a
+preload-then-fork mode: models listed in PRELOAD_MODELS are loaded once in the
+gunicorn master, then shared copy-on-write by all forked workers.
+
+Only model weights are preloaded. The app itself (and its gRPC and Redis
+clients, which are not fork-safe) is still imported in each worker.
+"""
+
+import gc
+import multiprocessing
+import os
+
+import model_helper
+
+workers_per_core = float(os.getenv("WORKERS_PER_CORE", "1"))
+max_workers = os.getenv("MAX_WORKERS")
+web_concurrency = os.getenv("WEB_CONCURRENCY")
+
+if web_concurrency:
+    workers = int(web_concurrency)
+    assert workers > 0
+else:
+    workers = max(int(workers_per_core * multiprocessing.cpu_count()), 2)
+    if max_workers:
+        workers = min(workers, int(max_workers))
+
+bind = os.getenv("BIND") or f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '80')}"
+loglevel = os.getenv("LOG_LEVEL", "info")
+accesslog = os.getenv("ACCESS_LOG", "-") or None
+errorlog = os.getenv("ERROR_LOG", "-") or None
+worker_tmp_dir = "/dev/shm"
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "120"))
+timeout = int(os.getenv("TIMEOUT", "120"))
+keepalive = int(os.getenv("KEEP_ALIVE", "5"))
+
+
+def on_starting(server):
+    """Load shared models in the master, before any worker is forked."""
+    model_specs = os.getenv(model_helper.PRELOAD_MODELS_ENV)
+
+    if model_specs:
+        model_helper.preload_models(model_specs)
+
+        # Move everything allocated so far out of the garbage collector's reach,
+        # so collections in the workers don't write to (and copy) shared pages.
+        gc.freeze()
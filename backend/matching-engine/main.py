@@ -18,14 +18,16 @@ import shutil
 import tempfile
 from typing import Annotated, Any, Dict, List, Optional, Tuple
 
-from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi import FastAPI, File, HTTPException, Request, Response, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
 
+import constants
 import register_services
+import resilience_helper
 import tracer_helper
-from services import match_service
+from services import match_service, multi_match
 
 logger = logging.getLogger(__name__)
 tracer = tracer_helper.get_tracer(__name__)
@@ -47,6 +49,41 @@ app.add_middleware(
 )
 app.add_middleware(GZipMiddleware, minimum_size=1000)
 
+REQUEST_TIMEOUT_HEADER = "X-Request-Timeout"
+
+
+@app.middleware("http")
+async def apply_request_deadline(request: Request, call_next):
+    """Bound the remote calls made for a request by its timeout."""
+    timeout_seconds = constants.REQUEST_TIMEOUT_SECONDS
+    set_by_client = False
+
+    try:
+        client_timeout_seconds = float(request.headers[REQUEST_TIMEOUT_HEADER])
+    except (KeyError, ValueError):
+        pass
+    else:
+        if client_timeout_seconds < timeout_seconds:
+            timeout_seconds = client_timeout_seconds
+            set_by_client = True
+
+    with resilience_helper.deadline(timeout_seconds, set_by_client=set_by_client):
+        return await call_next(request)
+
+
+def get_match_error(ex: Exception) -> HTTPException:
+    """Map an error raised while matching to an HTTP error."""
+    if isinstance(ex, resilience_helper.DeadlineExceeded):
+        return HTTPException(status_code=504, detail=f"Timed out getting matches")
+    elif isinstance(ex, resilience_helper.CircuitOpenError):
+        return HTTPException(
+            status_code=503, detail=f"Matching is temporarily unavailable"
+        )
+    else:
+        return HTTPException(
+            status_code=500, detail=f"There was an error getting matches"
+        )
+
 
 class GetItemsResponse(BaseModel):
     items: List[match_service.Item]
@@ -68,12 +105,15 @@ async def get_match_registry():
     ]
 
 
-@app.get("/items/{match_service_id}")
+@app.get("/items/{match_service_id}", response_model=GetItemsResponse)
 async def get_items(match_service_id: str):
     with tracer.start_as_current_span(f"/items/{match_service_id}"):
         service = match_service_registry.get(match_service_id)
         if service:
-            return GetItemsResponse(items=service.get_suggestions())
+            return Response(
+                content=service.get_serialized_suggestions(),
+                media_type="application/json",
+            )
         else:
             raise HTTPException(
                 status_code=400,
@@ -119,9 +159,7 @@ async def match_by_id(
                 )
             except Exception as ex:
                 logger.error(ex)
-                raise HTTPException(
-                    status_code=500, detail=f"There was an error getting matches"
-                )
+                raise get_match_error(ex)
 
         else:
             raise HTTPException(
@@ -156,9 +194,7 @@ async def match_by_text(
             )
         except Exception as ex:
             logger.error(ex)
-            raise HTTPException(
-                status_code=500, detail=f"There was an error getting matches"
-            )
+            raise get_match_error(ex)
 
 
 @app.post("/match-by-image/{match_service_id}")
@@ -193,9 +229,7 @@ async def match_by_image(
                 )
         except Exception as ex:
             logger.error(ex)
-            raise HTTPException(
-                status_code=500, detail=f"There was an error getting matches"
-            )
+            raise get_match_error(ex)
         finally:
             image.file.close()
 
@@ -231,6 +265,65 @@ async def match_by_image_url(
 
         except Exception as ex:
             logger.error(ex)
+            raise get_match_error(ex)
+
+
+class MatchMultiRequest(BaseModel):
+    matchServiceIds: List[str]
+    text: Optional[str] = None
+    imageUrl: Optional[str] = None
+    numNeighbors: int = 10
+
+
+@dataclasses.dataclass
+class ServiceMatchResponse:
+    matchServiceId: str
+    totalIndexCount: Optional[int]
+    results: Optional[List[match_service.MatchResult]]
+    error: Optional[str]
+
+
+@dataclasses.dataclass
+class MatchMultiResponse:
+    responses: List[ServiceMatchResponse]
+
+
+@app.post("/match-multi")
+async def match_multi(request: MatchMultiRequest) -> MatchMultiResponse:
+    with tracer.start_as_current_span("/match-multi"):
+        if request.text is None and request.imageUrl is None:
             raise HTTPException(
-                status_code=500, detail=f"There was an error getting matches"
+                status_code=400,
+                detail=f"Either text or imageUrl is required",
             )
+
+        services: List[match_service.MatchService] = []
+        for match_service_id in dict.fromkeys(request.matchServiceIds):
+            service = match_service_registry.get(match_service_id)
+
+            if not service:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Match service not found for id: {match_service_id}",
+                )
+
+            services.append(service)
+
+        service_matches = await multi_match.match_multi(
+            services=services,
+            text=request.text,
+            image_url=request.imageUrl,
+            num_neighbors=request.numNeighbors,
+        )
+
+        return MatchMultiResponse(
+            responses=[
+                ServiceMatchResponse(
+                    matchServiceId=matches.service_id,
+                    totalIndexCount=matches.total_index_count,
+                    results=matches.results,
+                    error=matches.error,
+                )
+                for matches in service_matches
+            ]
+        )
@@ -0,0 +1,96 @@
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Process-wide cache of locally loaded models.
+
+Services get their models through these loaders instead of constructing them
+directly, so each model is loaded at most once per process. When the gunicorn
+master preloads models before forking (see gunicorn_conf.py), every worker
+inherits the already loaded weights and shares them copy-on-write.
+
+The model libraries are optional dependencies, so they are imported lazily.
+"""
+
+import functools
+import logging
+from typing import Any, Callable, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Comma separated `kind:model_id` pairs to load in the gunicorn master,
+# e.g. "spacy:en_core_web_md,sentence_transformer:all-MiniLM-L6-v2"
+PRELOAD_MODELS_ENV = "PRELOAD_MODELS"
+
+
+@functools.lru_cache(maxsize=None)
+def get_spacy_model(name: str) -> Any:
+    """Load a spaCy pipeline, e.g. "en_core_web_md"."""
+    import spacy
+
+    return spacy.load(name)
+
+
+@functools.lru_cache(maxsize=None)
+def get_sentence_transformer(model_id_or_path: str) -> Any:
+    """Load a SentenceTransformer in inference mode."""
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_id_or_path, device="cpu")
+    model.eval()
+    return model
+
+
+@functools.lru_cache(maxsize=None)
+def get_clip_model(model_id_or_path: str, device: str = "cpu") -> Tuple[Any, Any]:
+    """Load a CLIP tokenizer and model in inference mode, on the given device.
+
+    Moving a torch module to a device moves it in place, so each device gets
+    its own cached model, and callers must not move the model they get. The
+    CPU model is the one preloaded and shared with workers.
+    """
+    from transformers import CLIPModel, CLIPTokenizerFast
+
+    tokenizer = CLIPTokenizerFast.from_pretrained(model_id_or_path)
+    model = CLIPModel.from_pretrained(model_id_or_path).to(device)
+    model.eval()
+    return tokenizer, model
+
+
+MODEL_LOADERS: Dict[str, Callable[[str], Any]] = {
+    "spacy": get_spacy_model,
+    "sentence_transformer": get_sentence_transformer,
+    "clip": get_clip_model,
+}
+
+
+def preload_models(model_specs: str) -> None:
+    """Load the given models into the process-wide cache.
+
+    Args:
+        model_specs (str): Comma separated `kind:model_id` pairs, where kind is
+            one of the keys of MODEL_LOADERS.
+    """
+    for model_spec in model_specs.split(","):
+        model_spec = model_spec.strip()
+        if not model_spec:
+            continue
+
+        kind, _, model_id = model_spec.partition(":")
+        loader = MODEL_LOADERS.get(kind)
+
+        if loader is None or not model_id:
+            raise ValueError(f"Invalid model spec: {model_spec}")
+
+        logger.info(f"Preloading {kind} model: {model_id}")
+        loader(model_id)
@@ -13,12 +13,14 @@
 # limitations under the License.
 
 import logging
+import os
 import traceback
 from typing import Dict, List
 
 import constants
 import tracer_helper
 from services import (
+    local_index,
     multimodal_text_to_image_match_service,
     match_service,
     palm_text_match_service,
@@ -113,4 +115,26 @@ def register_services() -> Dict[str, match_service.MatchService]:
             traceback.print_exc()
             logging.error(ex)
 
+    if constants.LOCAL_INDEX_DIR:
+        attach_local_indexes(services=services, index_root=constants.LOCAL_INDEX_DIR)
+
     return {service.id: service for service in services}
+
+
+def attach_local_indexes(
+    services: List[match_service.MatchService], index_root: str
+) -> None:
+    """Serve services from local indexes found under `index_root/<service id>`."""
+    for service in services:
+        index_dir = os.path.join(index_root, service.id)
+
+        if not isinstance(
+            service, match_service.VertexAIMatchingEngineMatchService
+        ) or not os.path.exists(os.path.join(index_dir, local_index.MANIFEST_FILE)):
+            continue
+
+        try:
+            service.local_index = local_index.ReloadingLocalIndex(index_dir)
+        except Exception as ex:
+            traceback.print_exc()
+            logging.error(ex)
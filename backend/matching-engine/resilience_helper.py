@@ -0,0 +1,486 @@
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Deadlines, hedged requests and circuit breakers for remote calls.
+
+A deadline is set per HTTP request (see the middleware in main.py) and kept in
+a context variable, so every remote call made while handling the request gets
+the time that is left. Remote calls go through a ResilientBackend, one per
+remote endpoint or model, which:
+
+- runs the call on one of its own worker threads and stops waiting at the
+  deadline, even if the client library has no timeout of its own. Calls that
+  hang keep their thread, so a backend that hangs fails fast once all its
+  threads are busy instead of starving the other backends,
+- sends a duplicate (hedged) request once the first one is slower than the
+  backend's recent p95 latency, and returns whichever finishes first,
+- opens a circuit breaker after consecutive failures, failing fast instead of
+  waiting on a backend that is down,
+- serves the last good result for the same input when the call fails or the
+  circuit is open.
+
+Batch clients that must stay within a quota pace their calls with a
+RateLimiter.
+"""
+
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
+import logging
+import threading
+import time
+from typing import (
+    Callable,
+    Deque,
+    Dict,
+    Generic,
+    Hashable,
+    Iterator,
+    List,
+    Optional,
+    TypeVar,
+)
+
+logger = logging.getLogger(__name__)
+
+R = TypeVar("R")
+
+DEFAULT_TIMEOUT_SECONDS = 30.0
+DEFAULT_MAX_CONCURRENT_CALLS = 16
+HEDGE_PERCENTILE = 95
+# Latency samples needed before requests are hedged
+HEDGE_MIN_SAMPLES = 20
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar(
+    "deadline", default=None
+)
+# Whether the current deadline was set by the client, shorter than our own
+_is_client_deadline: contextvars.ContextVar[bool] = contextvars.ContextVar(
+    "is_client_deadline", default=False
+)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The deadline passed before a remote call completed."""
+
+
+class CircuitOpenError(RuntimeError):
+    """The backend's circuit breaker is open, so the call was not made."""
+
+
+class BackendBusyError(CircuitOpenError):
+    """All of the backend's worker threads are busy, so the call was not made."""
+
+
+@contextlib.contextmanager
+def deadline(timeout_seconds: float, set_by_client: bool = False) -> Iterator[None]:
+    """Limit all remote calls made within the block to a total timeout.
+
+    A nested deadline can only shorten the deadline that is already set.
+
+    Args:
+        timeout_seconds (float): Seconds allowed for the block.
+        set_by_client (bool): Whether the client asked for a timeout shorter
+            than the server's own. Calls that run out of a client's time don't
+            count as failures of the backend.
+    """
+    deadline_at = time.monotonic() + timeout_seconds
+    current = _deadline.get()
+
+    if current is not None and current <= deadline_at:
+        yield
+        return
+
+    deadline_token = _deadline.set(deadline_at)
+    client_token = _is_client_deadline.set(set_by_client)
+    try:
+        yield
+    finally:
+        _is_client_deadline.reset(client_token)
+        _deadline.reset(deadline_token)
+
+
+def get_remaining_seconds(default: Optional[float] = None) -> Optional[float]:
+    """Get the time left until the current deadline.
+
+    Args:
+        default (Optional[float]): Returned when no deadline is set.
+
+    Raises:
+        DeadlineExceeded: If the deadline has already passed.
+    """
+    deadline_at = _deadline.get()
+
+    if deadline_at is None:
+        return default
+
+    remaining = deadline_at - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded("Deadline exceeded")
+
+    return remaining
+
+
+class CircuitBreaker:
+    """Fails fast after repeated failures, then lets a trial call through.
+
+    The circuit opens after `failure_threshold` consecutive failures. After
+    `reset_timeout_seconds` it is half-open: a single trial call is allowed,
+    which closes the circuit if it succeeds and reopens it if it fails.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self, failure_threshold: int = 5, reset_timeout_seconds: float = 30.0
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_seconds = reset_timeout_seconds
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if (
+                self._state == self.OPEN
+                and time.monotonic() - self._opened_at >= self.reset_timeout_seconds
+            ):
+                return self.HALF_OPEN
+            return self._state
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+
+            if time.monotonic() - self._opened_at < self.reset_timeout_seconds:
+                return False
+
+            # Half-open: let one trial call through at a time
+            if self._trial_in_flight:
+                return False
+
+            self._state = self.HALF_OPEN
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def record_inconclusive(self) -> None:
+        """Record a call that says nothing about the backend's health.
+
+        A trial call in flight is released, so another one can be made.
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+
+class LatencyTracker:
+    """Keeps recent latencies of successful calls to estimate percentiles."""
+
+    def __init__(self, window_size: int = 200) -> None:
+        self._latencies: Deque[float] = collections.deque(maxlen=window_size)
+
+    def record(self, latency_seconds: float) -> None:
+        self._latencies.append(latency_seconds)
+
+    def get_percentile(
+        self, percentile: float, min_samples: int = HEDGE_MIN_SAMPLES
+    ) -> Optional[float]:
+        """Get a latency percentile, or None if there are too few samples."""
+        latencies = sorted(self._latencies)
+
+        if len(latencies) < max(min_samples, 1):
+            return None
+
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
+
+
+class _FallbackCache(Generic[R]):
+    """A small LRU of the last good result per call input."""
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries: "collections.OrderedDict[Hashable, R]" = collections.OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[R]:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: Hashable, value: R) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+class RateLimiter:
+    """A token bucket limiting the rate of calls, e.g. to stay within a quota.
+
+    Tokens are added at `rate_per_second` up to `burst`, and each call takes
+    one, waiting for it if the bucket is empty.
+    """
+
+    def __init__(self, rate_per_second: float, burst: int = 1) -> None:
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+
+    def _try_acquire(self) -> float:
+        """Take a token if one is available, else get the seconds until one is."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated_at) * self.rate_per_second
+            )
+            self._updated_at = now
+
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+
+            return (1 - self._tokens) / self.rate_per_second
+
+    def acquire(self, timeout: Optional[float] = None) -> None:
+        """Wait for a token.
+
+        Raises:
+            DeadlineExceeded: If no token is available within the timeout.
+        """
+        deadline_at = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            wait_seconds = self._try_acquire()
+            if wait_seconds == 0:
+                return
+
+            if deadline_at is not None and time.monotonic() + wait_seconds > deadline_at:
+                raise DeadlineExceeded("Deadline exceeded waiting for rate limit")
+
+            time.sleep(wait_seconds)
+
+
+class ResilientBackend:
+    """Deadlines, hedging, a circuit breaker and a fallback cache for a backend."""
+
+    def __init__(
+        self,
+        name: str,
+        default_timeout_seconds: float = DEFAULT_TIMEOUT_SECONDS,
+        failure_threshold: int = 5,
+        reset_timeout_seconds: float = 30.0,
+        fallback_cache_size: int = 256,
+        max_concurrent_calls: int = DEFAULT_MAX_CONCURRENT_CALLS,
+    ) -> None:
+        self.name = name
+        self.default_timeout_seconds = default_timeout_seconds
+        # Every call gets a thread right away, so none wait in the queue
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_concurrent_calls,
+            thread_name_prefix=f"remote_call_{name}",
+        )
+        self._call_slots = threading.BoundedSemaphore(max_concurrent_calls)
+        self.circuit_breaker = CircuitBreaker(
+            failure_threshold=failure_threshold,
+            reset_timeout_seconds=reset_timeout_seconds,
+        )
+        self.latency_tracker = LatencyTracker()
+        self._fallback_cache: _FallbackCache = _FallbackCache(fallback_cache_size)
+
+    def _submit(
+        self, func: Callable[[float], R], timeout: float
+    ) -> "Optional[concurrent.futures.Future[R]]":
+        """Start an attempt, or return None if all worker threads are busy."""
+        if not self._call_slots.acquire(blocking=False):
+            return None
+
+        # Each attempt gets its own copy of the context, e.g. for tracing
+        try:
+            attempt = self._executor.submit(
+                contextvars.copy_context().run, func, timeout
+            )
+        except BaseException:
+            self._call_slots.release()
+            raise
+
+        attempt.add_done_callback(lambda _: self._call_slots.release())
+        return attempt
+
+    def _call_with_deadline(
+        self, func: Callable[[float], R], timeout: float, hedge: bool
+    ) -> R:
+        start = time.monotonic()
+        deadline_at = start + timeout
+        hedge_delay = (
+            self.latency_tracker.get_percentile(HEDGE_PERCENTILE) if hedge else None
+        )
+
+        first_attempt = self._submit(func, timeout)
+        if first_attempt is None:
+            raise BackendBusyError(f"Too many calls in flight to {self.name}")
+
+        attempts = [first_attempt]
+        pending = set(attempts)
+        errors: List[BaseException] = []
+
+        while pending:
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                break
+
+            wait_seconds = remaining
+            if hedge_delay is not None and len(attempts) == 1:
+                wait_seconds = min(remaining, max(0.0, start + hedge_delay - time.monotonic()))
+
+            done, pending = concurrent.futures.wait(
+                pending,
+                timeout=wait_seconds,
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+
+            for attempt in done:
+                error = attempt.exception()
+                if error is None:
+                    self.latency_tracker.record(time.monotonic() - start)
+                    return attempt.result()
+                errors.append(error)
+
+            if (
+                pending
+                and hedge_delay is not None
+                and len(attempts) == 1
+                and time.monotonic() - start >= hedge_delay
+            ):
+                hedged_attempt = self._submit(func, deadline_at - time.monotonic())
+                if hedged_attempt is None:
+                    # Keep waiting on the first attempt
+                    hedge_delay = None
+                else:
+                    logger.info(f"Hedging slow call to {self.name}")
+                    attempts.append(hedged_attempt)
+                    pending.add(hedged_attempt)
+
+        if errors and not pending:
+            raise errors[-1]
+
+        # The attempts keep running in the background until they time out
+        raise DeadlineExceeded(f"Deadline exceeded calling {self.name}")
+
+    def call(
+        self,
+        func: Callable[[float], R],
+        cache_key: Optional[Hashable] = None,
+        hedge: bool = False,
+    ) -> R:
+        """Call the backend within the current deadline.
+
+        Args:
+            func (Callable[[float], R]): Makes the remote call. It gets the
+                seconds left until the deadline, to pass on as the call's own
+                timeout where the client library supports one.
+            cache_key (Optional[Hashable]): Identifies the call's input. If set,
+                the last good result for the same key is returned when the call
+                fails or the circuit is open.
+            hedge (bool): Whether the call is idempotent and may be sent twice.
+
+        Timeouts count as failures of the backend, unless the client set a
+        deadline shorter than the backend's default timeout. A client must not
+        be able to open the circuit for everyone else.
+
+        Raises:
+            DeadlineExceeded: If the deadline passed before the call completed.
+            CircuitOpenError: If the circuit is open and nothing is cached.
+            BackendBusyError: If all worker threads are busy and nothing is
+                cached.
+        """
+        # Fails fast, without counting against the backend, if the deadline
+        # has already passed
+        timeout = get_remaining_seconds(default=self.default_timeout_seconds)
+        is_client_deadline = (
+            _is_client_deadline.get() and timeout < self.default_timeout_seconds
+        )
+
+        if not self.circuit_breaker.allow_request():
+            cached = self._fallback_cache.get(cache_key) if cache_key is not None else None
+            if cached is not None:
+                logger.warning(f"Circuit open for {self.name}, serving cached result")
+                return cached
+            raise CircuitOpenError(f"Circuit open for {self.name}")
+
+        try:
+            result = self._call_with_deadline(func, timeout=timeout, hedge=hedge)
+        except Exception as ex:
+            # The calls holding the threads of a busy backend are counted
+            # when they time out
+            if isinstance(ex, BackendBusyError) or (
+                isinstance(ex, DeadlineExceeded) and is_client_deadline
+            ):
+                self.circuit_breaker.record_inconclusive()
+            else:
+                self.circuit_breaker.record_failure()
+
+            cached = self._fallback_cache.get(cache_key) if cache_key is not None else None
+            if cached is not None:
+                logger.warning(f"Call to {self.name} failed, serving cached result: {ex}")
+                return cached
+            raise
+
+        self.circuit_breaker.record_success()
+        if cache_key is not None:
+            self._fallback_cache.put(cache_key, result)
+
+        return result
+
+
+_backends: Dict[str, ResilientBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(name: str) -> ResilientBackend:
+    """Get the process-wide backend with this name, creating it if needed.
+
+    Services calling the same remote endpoint or model share its backend, and
+    with it the circuit breaker and latency statistics.
+    """
+    with _backends_lock:
+        if name not in _backends:
+            _backends[name] = ResilientBackend(name)
+        return _backends[name]
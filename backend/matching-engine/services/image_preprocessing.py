@@ -0,0 +1,95 @@
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Shrink images before they are sent for embedding.
+
+The embedding model downsamples its input anyway, so uploading a multi-megabyte
+phone photo only makes the request (and its base64 encoding) larger and slower.
+Images are decoded, rotated according to their EXIF orientation, downscaled to
+the model's input resolution and re-encoded without metadata.
+
+Decoding and resizing are CPU bound, so they run on a bounded worker pool that
+Pillow can use in parallel, as it releases the GIL while doing so.
+"""
+
+import concurrent.futures
+import io
+import logging
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Longest side sent to the model, roughly the resolution it embeds at
+DEFAULT_MAX_DIMENSION = 512
+DEFAULT_FORMAT = "JPEG"
+DEFAULT_QUALITY = 90
+
+_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=4, thread_name_prefix="image_preprocessing"
+)
+
+
+def preprocess_image_bytes(
+    image_bytes: bytes,
+    max_dimension: int = DEFAULT_MAX_DIMENSION,
+    format: str = DEFAULT_FORMAT,
+    quality: int = DEFAULT_QUALITY,
+) -> bytes:
+    """Downscale and re-encode an image.
+
+    Args:
+        image_bytes (bytes): The encoded image, in any format Pillow reads.
+        max_dimension (int): The longest side of the result. Smaller images
+            are not upscaled.
+        format (str): The output format, JPEG or WEBP.
+        quality (int): The output quality, from 1 to 100.
+
+    Returns:
+        bytes: The re-encoded image, or the original bytes if they can't be
+            decoded or are already smaller.
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            # JPEGs can be decoded at a fraction of their size, which is much
+            # faster than decoding them in full and then downscaling
+            image.draft("RGB", (max_dimension, max_dimension))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+            if image.mode in ("RGBA", "LA", "P"):
+                # Flatten transparency onto white, as JPEG has no alpha channel
+                rgba_image = image.convert("RGBA")
+                image = Image.new("RGB", rgba_image.size, (255, 255, 255))
+                image.paste(rgba_image, mask=rgba_image.getchannel("A"))
+            elif image.mode != "RGB":
+                image = image.convert("RGB")
+
+            output = io.BytesIO()
+            # No exif or icc_profile is passed, so metadata is dropped
+            image.save(output, format=format, quality=quality, optimize=True)
+    except Exception as ex:
+        logger.warning(f"Could not preprocess image, sending it as is: {ex}")
+        return image_bytes
+
+    preprocessed_bytes = output.getvalue()
+
+    return preprocessed_bytes if len(preprocessed_bytes) < len(image_bytes) else image_bytes
+
+
+def submit_preprocess_image_bytes(
+    image_bytes: bytes, **kwargs
+) -> "concurrent.futures.Future[bytes]":
+    """Preprocess an image on the worker pool, see preprocess_image_bytes."""
+    return _executor.submit(preprocess_image_bytes, image_bytes, **kwargs)
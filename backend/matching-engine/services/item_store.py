@@ -0,0 +1,317 @@
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Item metadata from Redis, with a local cache and a hydration timeout.
+
+Match results are hydrated from Redis hashes. Items are read through a local
+cache bounded by the approximate size of its entries, and the cache misses of a
+match are fetched in a single pipelined round trip. If Redis doesn't answer
+within the hydration timeout, the match goes ahead without those items; the
+fetch still completes in the background and fills the cache for next time.
+At most one fetch per worker runs at a time, counting those left running in the
+background: when Redis is slow and all of them are busy, matches skip hydration
+instead of queueing behind stale fetches.
+
+The cache uses W-TinyLFU admission: new items enter a small LRU window, and an
+item leaving the window only replaces the main cache's least recently used item
+if it has been accessed more often recently. A count-min sketch estimates those
+frequencies. Popular items come back as neighbors of many queries, so they stay
+cached while long tails of one-off items pass through the window.
+"""
+
+import collections
+import concurrent.futures
+import logging
+import sys
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import redis
+
+import resilience_helper
+
+logger = logging.getLogger(__name__)
+
+Item = Dict[str, str]
+
+DEFAULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_HYDRATION_TIMEOUT_SECONDS = 0.25
+
+# Fixed per-entry cost on top of the keys and values, for the dicts and links
+ENTRY_OVERHEAD_BYTES = 200
+
+# Share of the cache used by the admission window
+WINDOW_FRACTION = 0.01
+
+MAX_CONCURRENT_FETCHES = 8
+
+_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=MAX_CONCURRENT_FETCHES, thread_name_prefix="item_store"
+)
+# Held by each fetch until it completes, even after its caller timed out
+_fetch_slots = threading.BoundedSemaphore(MAX_CONCURRENT_FETCHES)
+
+
+def get_item_size(id: str, item: Item) -> int:
+    """Approximate the memory used by a cached item."""
+    return (
+        ENTRY_OVERHEAD_BYTES
+        + sys.getsizeof(id)
+        + sum(sys.getsizeof(key) + sys.getsizeof(value) for key, value in item.items())
+    )
+
+
+class FrequencySketch:
+    """A count-min sketch of recent access counts.
+
+    Counters saturate at 15. Once the number of increments reaches ten times
+    the width, all counters are halved, so old popularity fades out.
+    """
+
+    MAX_COUNT = 15
+    SEEDS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0x27D4EB2F165667C5)
+
+    def __init__(self, width: int = 1 << 16) -> None:
+        # A power of two, so indexes can be masked
+        self.width = 1 << max(width - 1, 1).bit_length()
+        self._mask = self.width - 1
+        self._rows = [np.zeros(self.width, dtype=np.uint8) for _ in self.SEEDS]
+        self._sample_size = 10 * self.width
+        self._additions = 0
+
+    def _indexes(self, key: str) -> List[int]:
+        key_hash = hash(key) & 0xFFFFFFFFFFFFFFFF
+        return [
+            (((key_hash ^ seed) * 0x9E3779B97F4A7C15) >> 32) & self._mask
+            for seed in self.SEEDS
+        ]
+
+    def estimate(self, key: str) -> int:
+        return min(
+            int(row[index]) for row, index in zip(self._rows, self._indexes(key))
+        )
+
+    def increment(self, key: str) -> None:
+        indexes = self._indexes(key)
+        count = min(int(row[index]) for row, index in zip(self._rows, indexes))
+
+        if count < self.MAX_COUNT:
+            # Conservative update: only raise the counters at the minimum
+            for row, index in zip(self._rows, indexes):
+                if row[index] == count:
+                    row[index] = count + 1
+
+        self._additions += 1
+        if self._additions >= self._sample_size:
+            for row in self._rows:
+                row >>= 1
+            self._additions //= 2
+
+
+class SizedLRUCache:
+    """A thread-safe LRU cache bounded by the total size of its entries."""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._lock = threading.Lock()
+        self._entries: "collections.OrderedDict[str, Item]" = collections.OrderedDict()
+        self._sizes: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, id: str) -> bool:
+        return id in self._entries
+
+    def peek_lru_id(self) -> Optional[str]:
+        """Get the id of the least recently used entry."""
+        with self._lock:
+            return next(iter(self._entries), None)
+
+    def get(self, id: str) -> Optional[Item]:
+        with self._lock:
+            item = self._entries.get(id)
+            if item is not None:
+                self._entries.move_to_end(id)
+            return item
+
+    def put(self, id: str, item: Item) -> List[Tuple[str, Item]]:
+        """Add an item, evicting least recently used items to make room.
+
+        Returns:
+            List[Tuple[str, Item]]: The evicted items, or the item itself if it
+                is larger than the whole cache.
+        """
+        size = get_item_size(id, item)
+        if size > self.max_bytes:
+            return [(id, item)]
+
+        evicted: List[Tuple[str, Item]] = []
+        with self._lock:
+            if id in self._entries:
+                self.size_bytes -= self._sizes[id]
+
+            self._entries[id] = item
+            self._entries.move_to_end(id)
+            self._sizes[id] = size
+            self.size_bytes += size
+
+            while self.size_bytes > self.max_bytes:
+                evicted_id, evicted_item = self._entries.popitem(last=False)
+                self.size_bytes -= self._sizes.pop(evicted_id)
+                evicted.append((evicted_id, evicted_item))
+
+        return evicted
+
+
+class TinyLFUCache:
+    """A size-bounded cache with W-TinyLFU admission."""
+
+    def __init__(self, max_bytes: int, window_fraction: float = WINDOW_FRACTION) -> None:
+        window_bytes = max(int(max_bytes * window_fraction), 1)
+        self.max_bytes = max_bytes
+        self._window = SizedLRUCache(window_bytes)
+        self._main = SizedLRUCache(max_bytes - window_bytes)
+        # About one counter per item of a typical size
+        self.sketch = FrequencySketch(width=max(max_bytes // 1024, 4096))
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._window) + len(self._main)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._window.size_bytes + self._main.size_bytes
+
+    def get(self, id: str) -> Optional[Item]:
+        with self._lock:
+            self.sketch.increment(id)
+
+        item = self._window.get(id)
+        return item if item is not None else self._main.get(id)
+
+    def put(self, id: str, item: Item) -> None:
+        with self._lock:
+            if id in self._main:
+                self._main.put(id, item)
+                return
+
+            for candidate_id, candidate in self._window.put(id, item):
+                self._admit(candidate_id, candidate)
+
+    def _admit(self, id: str, item: Item) -> None:
+        """Move an item leaving the window into the main cache, if it earns it."""
+        if self._main.size_bytes + get_item_size(id, item) > self._main.max_bytes:
+            victim_id = self._main.peek_lru_id()
+
+            if victim_id is not None and self.sketch.estimate(
+                id
+            ) <= self.sketch.estimate(victim_id):
+                return
+
+        self._main.put(id, item)
+
+
+class RedisItemStore:
+    """Reads items stored as Redis hashes, through a local cache."""
+
+    def __init__(
+        self,
+        redis_client: redis.Redis,
+        cache_max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+        hydration_timeout_seconds: float = DEFAULT_HYDRATION_TIMEOUT_SECONDS,
+    ) -> None:
+        self.redis_client = redis_client
+        self.cache = TinyLFUCache(cache_max_bytes)
+        self.hydration_timeout_seconds = hydration_timeout_seconds
+
+    def _fetch(self, ids: List[str]) -> Dict[str, Item]:
+        """Fetch items from Redis in one round trip and cache the found ones."""
+        pipeline = self.redis_client.pipeline(transaction=False)
+        for id in ids:
+            pipeline.hgetall(id)
+
+        items: Dict[str, Item] = {}
+        for id, retrieved in zip(ids, pipeline.execute()):
+            # Convert the byte strings to regular strings
+            item = {key.decode(): value.decode() for key, value in retrieved.items()}
+            if item:
+                self.cache.put(id, item)
+            items[id] = item
+
+        return items
+
+    def _submit_fetch(
+        self, ids: List[str]
+    ) -> "Optional[concurrent.futures.Future[Dict[str, Item]]]":
+        """Fetch items on a worker, or return None if all workers are busy."""
+        fetch_slots = _fetch_slots
+        if not fetch_slots.acquire(blocking=False):
+            return None
+
+        try:
+            future = _executor.submit(self._fetch, ids)
+        except BaseException:
+            fetch_slots.release()
+            raise
+
+        future.add_done_callback(lambda _: fetch_slots.release())
+        return future
+
+    def get(self, id: str) -> Item:
+        """Get an item, waiting for Redis on a cache miss.
+
+        Returns:
+            Item: The item, or an empty dict if there is no such item.
+        """
+        id = str(id)
+        item = self.cache.get(id)
+
+        return item if item is not None else self._fetch([id])[id]
+
+    def get_many(self, ids: Iterable[str]) -> List[Optional[Item]]:
+        """Get items within the hydration timeout.
+
+        Returns:
+            List[Optional[Item]]: For each id, the item, an empty dict if there
+                is no such item, or None if it couldn't be fetched in time.
+        """
+        ids = [str(id) for id in ids]
+        items: Dict[str, Optional[Item]] = {id: self.cache.get(id) for id in ids}
+        missing_ids = [id for id, item in items.items() if item is None]
+
+        if missing_ids:
+            try:
+                timeout = min(
+                    self.hydration_timeout_seconds,
+                    resilience_helper.get_remaining_seconds(
+                        default=self.hydration_timeout_seconds
+                    ),
+                )
+                future = self._submit_fetch(missing_ids)
+
+                if future is None:
+                    logger.warning(
+                        f"All item fetches are busy, skipped {len(missing_ids)} items"
+                    )
+                else:
+                    items.update(future.result(timeout))
+            except (concurrent.futures.TimeoutError, resilience_helper.DeadlineExceeded):
+                logger.warning(f"Timed out hydrating {len(missing_ids)} items")
+            except redis.RedisError as ex:
+                logger.error(f"Error hydrating items: {ex}")
+
+        return [items[id] for id in ids]
@@ -0,0 +1,1001 @@
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A local, file-based vector index for nearest neighbor search.
+
+An index is a directory of immutable segments plus a MANIFEST.json that names
+the current ones:
+
+    index_dir/
+        MANIFEST.json       # replaced atomically on every change
+        segment-000001/     # base segment, flat or IVF
+        delta-000002/       # optional delta segment with tombstones
+
+Upserts and deletes never modify the base segment. They write a new delta
+segment that holds the latest version of every upserted record, plus a set of
+tombstoned ids that are hidden in the base segment. Compaction merges both into
+a new base segment. Because segments are immutable and only the manifest is
+swapped, a running service can reopen the index at any time without locking.
+
+Each segment stores:
+
+    segment.json        # segment parameters
+    vectors.f32         # float32 rows, memory-mapped on read
+    sq_norms.f32        # squared L2 norm of each row
+    ids.corpus          # row ids, see corpus_helper
+    metadata.corpus     # JSON encoded metadata of each row
+    centroids.f32       # IVF only: coarse centroids
+    list_offsets.i64    # IVF only: row range of each inverted list
+    codes.bin           # int8/PQ only: compressed rows
+    quantizer.f32       # int8/PQ only: scalar ranges or PQ codebooks
+    tombstones.json     # delta only: ids hidden in the base segment
+
+Distances follow Vertex AI Matching Engine: for DOT_PRODUCT_DISTANCE and
+COSINE_DISTANCE the reported distance is the (cosine) similarity, where larger
+is closer. For SQUARED_L2_DISTANCE it is the squared L2 distance.
+
+Base segments can keep their rows compressed for scanning:
+
+- int8: scalar quantization of each dimension to 256 levels (4x smaller).
+- pq: product quantization into one byte per subspace, 8-32x smaller
+  depending on the number of subspaces.
+
+Compressed segments are scanned with asymmetric distances, i.e. the float
+query is compared against the codes directly, and the best candidates are
+re-scored exactly against the float32 rows. Those stay on disk and only the
+few re-scored rows are paged in, so the resident set is mostly codes. See
+benchmarks/local_index_recall.py for the recall of each option.
+"""
+
+import dataclasses
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import (
+    Any,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+import numpy as np
+
+import corpus_helper
+
+logger = logging.getLogger(__name__)
+
+DOT_PRODUCT_DISTANCE = "DOT_PRODUCT_DISTANCE"
+COSINE_DISTANCE = "COSINE_DISTANCE"
+SQUARED_L2_DISTANCE = "SQUARED_L2_DISTANCE"
+DISTANCE_MEASURES = (DOT_PRODUCT_DISTANCE, COSINE_DISTANCE, SQUARED_L2_DISTANCE)
+
+INDEX_TYPE_FLAT = "flat"
+INDEX_TYPE_IVF = "ivf"
+INDEX_TYPES = (INDEX_TYPE_FLAT, INDEX_TYPE_IVF)
+
+STORAGE_FLOAT32 = "float32"
+STORAGE_INT8 = "int8"
+STORAGE_PQ = "pq"
+STORAGES = (STORAGE_FLOAT32, STORAGE_INT8, STORAGE_PQ)
+
+MANIFEST_FILE = "MANIFEST.json"
+SEGMENT_FILE = "segment.json"
+VECTORS_FILE = "vectors.f32"
+SQ_NORMS_FILE = "sq_norms.f32"
+IDS_FILE = "ids.corpus"
+METADATA_FILE = "metadata.corpus"
+CENTROIDS_FILE = "centroids.f32"
+LIST_OFFSETS_FILE = "list_offsets.i64"
+TOMBSTONES_FILE = "tombstones.json"
+CODES_FILE = "codes.bin"
+QUANTIZER_FILE = "quantizer.f32"
+
+DEFAULT_CHUNK_SIZE = 10000
+DEFAULT_NUM_PROBES = 8
+KMEANS_ITERATIONS = 20
+KMEANS_SAMPLES_PER_LIST = 256
+PQ_CENTROIDS = 256
+DEFAULT_PQ_SUBSPACE_DIMENSIONS = 8
+# Candidates re-scored exactly per requested neighbor, for compressed storage
+DEFAULT_RESCORE_FACTOR = 4
+# Rows decoded at a time when scanning compressed codes
+SCAN_CHUNK_SIZE = 16384
+
+
+@dataclasses.dataclass
+class Record:
+    id: str
+    embedding: Sequence[float]
+    metadata: Optional[Dict[str, Any]] = None
+
+
+class Neighbor(NamedTuple):
+    """A search result, shaped like a Matching Engine MatchNeighbor."""
+
+    id: str
+    distance: float
+    metadata: Optional[Dict[str, Any]] = None
+
+
+def _chunked(records: Iterable[Record], chunk_size: int) -> Iterator[List[Record]]:
+    chunk: List[Record] = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _write_json(data: Any, path: str) -> None:
+    """Write a JSON file atomically."""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(temp_path, path)
+
+
+def _read_json(path: str) -> Any:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _open_vectors(path: str, count: int, dimensions: int) -> np.ndarray:
+    if count == 0:
+        return np.zeros((0, dimensions), dtype=np.float32)
+    return np.memmap(path, dtype=np.float32, mode="r", shape=(count, dimensions))
+
+
+def _nearest_centroids(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Assign each vector to its nearest centroid by L2 distance."""
+    distances = (centroids * centroids).sum(axis=1) - 2 * (vectors @ centroids.T)
+    return distances.argmin(axis=1)
+
+
+def _train_centroids(
+    vectors: np.ndarray, num_lists: int, seed: int = 0
+) -> np.ndarray:
+    """Train IVF centroids with k-means over a sample of the vectors."""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), num_lists * KMEANS_SAMPLES_PER_LIST)
+    sample = np.asarray(
+        vectors[np.sort(rng.choice(len(vectors), size=sample_size, replace=False))]
+    )
+    centroids = sample[rng.choice(len(sample), size=num_lists, replace=False)].copy()
+
+    for _ in range(KMEANS_ITERATIONS):
+        assignments = _nearest_centroids(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=num_lists)
+        non_empty = counts > 0
+        # Empty lists keep their previous centroid
+        centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+
+    return centroids
+
+
+def _train_scalar_quantizer(vectors: np.ndarray, chunk_size: int) -> np.ndarray:
+    """Get the minimum and step of each dimension, as a (2, dimensions) array."""
+    minimums = np.full(vectors.shape[1], np.inf, dtype=np.float32)
+    maximums = np.full(vectors.shape[1], -np.inf, dtype=np.float32)
+
+    for start in range(0, len(vectors), chunk_size):
+        chunk = np.asarray(vectors[start : start + chunk_size])
+        minimums = np.minimum(minimums, chunk.min(axis=0))
+        maximums = np.maximum(maximums, chunk.max(axis=0))
+
+    steps = (maximums - minimums) / 255
+    return np.stack([minimums, np.where(steps > 0, steps, 1)]).astype(np.float32)
+
+
+def _encode_scalar(vectors: np.ndarray, quantizer: np.ndarray) -> np.ndarray:
+    levels = np.rint((vectors - quantizer[0]) / quantizer[1])
+    return (np.clip(levels, 0, 255) - 128).astype(np.int8)
+
+
+def _train_product_quantizer(vectors: np.ndarray, num_subspaces: int) -> np.ndarray:
+    """Train a codebook per subspace, as a (subspaces, centroids, dims) array."""
+    num_centroids = min(PQ_CENTROIDS, len(vectors))
+    subspaces = np.split(np.asarray(vectors), num_subspaces, axis=1)
+
+    return np.stack(
+        [_train_centroids(subspace, num_centroids) for subspace in subspaces]
+    ).astype(np.float32)
+
+
+def _encode_product(vectors: np.ndarray, codebooks: np.ndarray) -> np.ndarray:
+    subspaces = np.split(vectors, len(codebooks), axis=1)
+
+    return np.stack(
+        [
+            _nearest_centroids(subspace, codebook)
+            for subspace, codebook in zip(subspaces, codebooks)
+        ],
+        axis=1,
+    ).astype(np.uint8)
+
+
+def _write_codes(
+    segment_dir: str,
+    vectors: np.ndarray,
+    storage: str,
+    pq_subspaces: int,
+    chunk_size: int,
+) -> None:
+    """Train a quantizer on the segment's rows and write their codes."""
+    if storage == STORAGE_INT8:
+        quantizer = _train_scalar_quantizer(vectors, chunk_size)
+        encode = _encode_scalar
+    else:
+        # Codebooks are trained on a sample, like the IVF centroids
+        rng = np.random.default_rng(0)
+        sample_size = min(len(vectors), PQ_CENTROIDS * KMEANS_SAMPLES_PER_LIST)
+        sample = vectors[
+            np.sort(rng.choice(len(vectors), size=sample_size, replace=False))
+        ]
+        quantizer = _train_product_quantizer(sample, pq_subspaces)
+        encode = _encode_product
+
+    quantizer.tofile(os.path.join(segment_dir, QUANTIZER_FILE))
+
+    with open(os.path.join(segment_dir, CODES_FILE), "wb") as codes_file:
+        for start in range(0, len(vectors), chunk_size):
+            chunk = np.asarray(vectors[start : start + chunk_size])
+            codes_file.write(encode(chunk, quantizer).tobytes())
+
+
+def _write_segment(
+    segment_dir: str,
+    records: Iterable[Record],
+    dimensions: int,
+    distance_measure: str,
+    index_type: str = INDEX_TYPE_FLAT,
+    num_lists: Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    tombstones: Optional[Iterable[str]] = None,
+    storage: str = STORAGE_FLOAT32,
+    pq_subspaces: Optional[int] = None,
+) -> int:
+    """Stream records into a new segment directory.
+
+    Records are consumed in chunks, so the full set of vectors never needs to
+    be held in memory.
+
+    Returns:
+        int: The number of records written.
+    """
+    os.makedirs(segment_dir)
+
+    raw_vectors_path = os.path.join(
+        segment_dir,
+        VECTORS_FILE if index_type == INDEX_TYPE_FLAT else VECTORS_FILE + ".tmp",
+    )
+    ids_path = os.path.join(segment_dir, "ids.jsonl.tmp")
+    metadata_path = os.path.join(segment_dir, "metadata.jsonl.tmp")
+    count = 0
+
+    with open(raw_vectors_path, "wb") as vectors_file, open(
+        ids_path, "w"
+    ) as ids_file, open(metadata_path, "w") as metadata_file:
+        for chunk in _chunked(records, chunk_size):
+            vectors = np.asarray(
+                [record.embedding for record in chunk], dtype=np.float32
+            )
+            if vectors.shape != (len(chunk), dimensions):
+                raise ValueError(
+                    f"Expected embeddings with {dimensions} dimensions, got {vectors.shape[-1]}"
+                )
+
+            if distance_measure == COSINE_DISTANCE:
+                norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+                vectors = vectors / np.where(norms > 0, norms, 1)
+
+            vectors_file.write(vectors.tobytes())
+            for record in chunk:
+                ids_file.write(json.dumps(str(record.id)) + "\n")
+                metadata_file.write(json.dumps(record.metadata) + "\n")
+            count += len(chunk)
+
+    def read_json_lines(path: str) -> Iterator[str]:
+        with open(path, "r") as f:
+            for line in f:
+                value = json.loads(line)
+                yield value if isinstance(value, str) else json.dumps(value)
+
+    segment: Dict[str, Any] = {
+        "count": count,
+        "dimensions": dimensions,
+        "index_type": index_type,
+    }
+
+    if index_type == INDEX_TYPE_IVF and count > 0:
+        raw_vectors = _open_vectors(raw_vectors_path, count, dimensions)
+        num_lists = min(num_lists or max(1, int(np.sqrt(count))), count)
+        centroids = _train_centroids(raw_vectors, num_lists)
+
+        assignments = np.concatenate(
+            [
+                _nearest_centroids(np.asarray(raw_vectors[start : start + chunk_size]), centroids)
+                for start in range(0, count, chunk_size)
+            ]
+        )
+        # Rows are stored grouped by inverted list
+        order = np.argsort(assignments, kind="stable")
+        list_offsets = np.searchsorted(
+            assignments[order], np.arange(num_lists + 1)
+        ).astype(np.int64)
+
+        with open(os.path.join(segment_dir, VECTORS_FILE), "wb") as vectors_file:
+            for start in range(0, count, chunk_size):
+                # Read the rows of each chunk in file order, then permute them
+                chunk_order = order[start : start + chunk_size]
+                ordered = np.asarray(raw_vectors[np.sort(chunk_order)])[
+                    np.argsort(np.argsort(chunk_order))
+                ]
+                vectors_file.write(ordered.tobytes())
+
+        # Reorder ids and metadata through random-access corpora
+        for jsonl_path, corpus_name in (
+            (ids_path, IDS_FILE),
+            (metadata_path, METADATA_FILE),
+        ):
+            temp_corpus_path = jsonl_path + ".corpus"
+            corpus_helper.write_corpus(read_json_lines(jsonl_path), temp_corpus_path)
+            entries = corpus_helper.CorpusFile(temp_corpus_path)
+            corpus_helper.write_corpus(
+                (entries[int(row)] for row in order),
+                os.path.join(segment_dir, corpus_name),
+            )
+            os.unlink(temp_corpus_path)
+
+        centroids.astype(np.float32).tofile(os.path.join(segment_dir, CENTROIDS_FILE))
+        list_offsets.tofile(os.path.join(segment_dir, LIST_OFFSETS_FILE))
+        os.unlink(raw_vectors_path)
+        segment["num_lists"] = num_lists
+    else:
+        if index_type == INDEX_TYPE_IVF:
+            # An empty IVF segment is stored as an empty flat segment
+            os.replace(raw_vectors_path, os.path.join(segment_dir, VECTORS_FILE))
+            segment["index_type"] = INDEX_TYPE_FLAT
+
+        corpus_helper.write_corpus(
+            read_json_lines(ids_path), os.path.join(segment_dir, IDS_FILE)
+        )
+        corpus_helper.write_corpus(
+            read_json_lines(metadata_path), os.path.join(segment_dir, METADATA_FILE)
+        )
+
+    os.unlink(ids_path)
+    os.unlink(metadata_path)
+
+    vectors = _open_vectors(os.path.join(segment_dir, VECTORS_FILE), count, dimensions)
+    with open(os.path.join(segment_dir, SQ_NORMS_FILE), "wb") as sq_norms_file:
+        for start in range(0, count, chunk_size):
+            chunk = np.asarray(vectors[start : start + chunk_size])
+            sq_norms_file.write((chunk * chunk).sum(axis=1).astype(np.float32).tobytes())
+
+    if storage != STORAGE_FLOAT32 and count > 0:
+        if storage == STORAGE_PQ:
+            pq_subspaces = pq_subspaces or dimensions // DEFAULT_PQ_SUBSPACE_DIMENSIONS
+            if pq_subspaces <= 0 or dimensions % pq_subspaces != 0:
+                raise ValueError(
+                    f"{dimensions} dimensions can't be split into {pq_subspaces} PQ subspaces"
+                )
+            segment["pq_subspaces"] = pq_subspaces
+
+        _write_codes(segment_dir, vectors, storage, pq_subspaces or 0, chunk_size)
+        segment["storage"] = storage
+
+    if tombstones is not None:
+        _write_json(sorted(tombstones), os.path.join(segment_dir, TOMBSTONES_FILE))
+
+    _write_json(segment, os.path.join(segment_dir, SEGMENT_FILE))
+
+    return count
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Get the positions of the k largest scores, in no particular order."""
+    if k >= len(scores):
+        return np.arange(len(scores))
+    return np.argpartition(-scores, k - 1)[:k]
+
+
+class _Segment:
+    """A read-only, memory-mapped segment."""
+
+    def __init__(self, segment_dir: str, distance_measure: str) -> None:
+        segment = _read_json(os.path.join(segment_dir, SEGMENT_FILE))
+
+        self.count: int = segment["count"]
+        self.dimensions: int = segment["dimensions"]
+        self.index_type: str = segment["index_type"]
+        self.storage: str = segment.get("storage", STORAGE_FLOAT32)
+        self.distance_measure = distance_measure
+
+        self.vectors = _open_vectors(
+            os.path.join(segment_dir, VECTORS_FILE), self.count, self.dimensions
+        )
+        self.sq_norms = (
+            np.fromfile(os.path.join(segment_dir, SQ_NORMS_FILE), dtype=np.float32)
+            if self.count > 0
+            else np.zeros(0, dtype=np.float32)
+        )
+        self.ids = corpus_helper.CorpusFile(os.path.join(segment_dir, IDS_FILE))
+        self.metadata = corpus_helper.CorpusFile(
+            os.path.join(segment_dir, METADATA_FILE)
+        )
+
+        if self.index_type == INDEX_TYPE_IVF:
+            self.num_lists: int = segment["num_lists"]
+            self.centroids = np.fromfile(
+                os.path.join(segment_dir, CENTROIDS_FILE), dtype=np.float32
+            ).reshape(self.num_lists, self.dimensions)
+            self.list_offsets = np.fromfile(
+                os.path.join(segment_dir, LIST_OFFSETS_FILE), dtype=np.int64
+            )
+
+        if self.storage == STORAGE_INT8:
+            self.codes = np.memmap(
+                os.path.join(segment_dir, CODES_FILE),
+                dtype=np.int8,
+                mode="r",
+                shape=(self.count, self.dimensions),
+            )
+            self.quantizer = np.fromfile(
+                os.path.join(segment_dir, QUANTIZER_FILE), dtype=np.float32
+            ).reshape(2, self.dimensions)
+        elif self.storage == STORAGE_PQ:
+            pq_subspaces: int = segment["pq_subspaces"]
+            self.codes = np.memmap(
+                os.path.join(segment_dir, CODES_FILE),
+                dtype=np.uint8,
+                mode="r",
+                shape=(self.count, pq_subspaces),
+            )
+            self.quantizer = np.fromfile(
+                os.path.join(segment_dir, QUANTIZER_FILE), dtype=np.float32
+            ).reshape(pq_subspaces, -1, self.dimensions // pq_subspaces)
+
+        tombstones_path = os.path.join(segment_dir, TOMBSTONES_FILE)
+        self.tombstones: FrozenSet[str] = (
+            frozenset(_read_json(tombstones_path))
+            if os.path.exists(tombstones_path)
+            else frozenset()
+        )
+
+    def _score(
+        self, vectors: np.ndarray, sq_norms: np.ndarray, query: np.ndarray
+    ) -> np.ndarray:
+        """Score rows against the query, where a larger score is closer."""
+        dot_products = vectors @ query
+        if self.distance_measure == SQUARED_L2_DISTANCE:
+            return 2 * dot_products - sq_norms - query @ query
+        return dot_products
+
+    def _approximate_scores(
+        self, rows: Optional[np.ndarray], query: np.ndarray
+    ) -> np.ndarray:
+        """Score rows by comparing the query against their codes."""
+        if self.storage == STORAGE_INT8:
+            # x ~= minimum + (code + 128) * step, so x.q = code.(step * q) + offset
+            scaled_query = self.quantizer[1] * query
+            offset = (self.quantizer[0] + 128 * self.quantizer[1]) @ query
+        else:
+            subqueries = query.reshape(len(self.quantizer), -1)
+            if self.distance_measure == SQUARED_L2_DISTANCE:
+                tables = -((self.quantizer - subqueries[:, None, :]) ** 2).sum(axis=2)
+            else:
+                tables = np.einsum("mkd,md->mk", self.quantizer, subqueries)
+            subspace_indexes = np.arange(len(tables))
+
+        num_rows = self.count if rows is None else len(rows)
+        scores = np.empty(num_rows, dtype=np.float32)
+
+        for start in range(0, num_rows, SCAN_CHUNK_SIZE):
+            chunk_rows = slice(start, start + SCAN_CHUNK_SIZE)
+            codes = np.asarray(
+                self.codes[chunk_rows] if rows is None else self.codes[rows[chunk_rows]]
+            )
+
+            if self.storage == STORAGE_INT8:
+                dot_products = codes.astype(np.float32) @ scaled_query + offset
+                sq_norms = self.sq_norms[chunk_rows if rows is None else rows[chunk_rows]]
+                scores[chunk_rows] = (
+                    2 * dot_products - sq_norms - query @ query
+                    if self.distance_measure == SQUARED_L2_DISTANCE
+                    else dot_products
+                )
+            else:
+                # Asymmetric distance: sum the query's table entries of each code
+                scores[chunk_rows] = tables[subspace_indexes, codes].sum(axis=1)
+
+        return scores
+
+    def _candidate_rows(self, query: np.ndarray, num_probes: int) -> Optional[np.ndarray]:
+        """Get the rows of the inverted lists closest to the query.
+
+        Returns None if every row is a candidate.
+        """
+        if self.index_type != INDEX_TYPE_IVF or num_probes >= self.num_lists:
+            return None
+
+        centroid_scores = self._score(
+            self.centroids, (self.centroids * self.centroids).sum(axis=1), query
+        )
+        lists = np.argpartition(-centroid_scores, num_probes - 1)[:num_probes]
+
+        return np.concatenate(
+            [
+                np.arange(self.list_offsets[list_id], self.list_offsets[list_id + 1])
+                for list_id in lists
+            ]
+        )
+
+    def search(
+        self,
+        query: np.ndarray,
+        num_neighbors: int,
+        num_probes: int,
+        rescore_factor: int = DEFAULT_RESCORE_FACTOR,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Find the closest rows.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Row numbers and exact scores, best
+                first.
+        """
+        if self.count == 0 or num_neighbors <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        rows = self._candidate_rows(query, num_probes)
+
+        if self.storage != STORAGE_FLOAT32:
+            # Shortlist by approximate score, then re-score exactly
+            scores = self._approximate_scores(rows, query)
+            rows = np.arange(self.count) if rows is None else rows
+            shortlist = _top_k(scores, num_neighbors * rescore_factor)
+            rows = np.sort(rows[shortlist])
+            scores = self._score(np.asarray(self.vectors[rows]), self.sq_norms[rows], query)
+        elif rows is None:
+            scores = self._score(self.vectors, self.sq_norms, query)
+            rows = np.arange(self.count)
+        else:
+            scores = self._score(np.asarray(self.vectors[rows]), self.sq_norms[rows], query)
+
+        top = _top_k(scores, num_neighbors)
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        return rows[top], scores[top]
+
+    def get_metadata(self, row: int) -> Optional[Dict[str, Any]]:
+        metadata = self.metadata[row]
+        return json.loads(metadata) if metadata else None
+
+    def iter_records(self, exclude_ids: FrozenSet[str] = frozenset()) -> Iterator[Record]:
+        for row in range(self.count):
+            id = self.ids[row]
+            if id not in exclude_ids:
+                yield Record(
+                    id=id,
+                    embedding=np.asarray(self.vectors[row]),
+                    metadata=self.get_metadata(row),
+                )
+
+
+class LocalIndex:
+    """A read-only snapshot of a local index, as of when it was opened."""
+
+    def __init__(
+        self,
+        index_dir: str,
+        num_probes: int = DEFAULT_NUM_PROBES,
+        rescore_factor: int = DEFAULT_RESCORE_FACTOR,
+    ) -> None:
+        self.index_dir = index_dir
+        self.num_probes = num_probes
+        self.rescore_factor = rescore_factor
+        self.manifest = _read_json(os.path.join(index_dir, MANIFEST_FILE))
+
+        self.version: int = self.manifest["version"]
+        self.dimensions: int = self.manifest["dimensions"]
+        self.distance_measure: str = self.manifest["distance_measure"]
+
+        self.base = _Segment(
+            os.path.join(index_dir, self.manifest["base"]), self.distance_measure
+        )
+        self.delta = (
+            _Segment(
+                os.path.join(index_dir, self.manifest["delta"]), self.distance_measure
+            )
+            if self.manifest.get("delta")
+            else None
+        )
+
+    @property
+    def count(self) -> int:
+        return self.manifest["count"]
+
+    def _search(
+        self, query: Sequence[float], num_neighbors: int
+    ) -> Tuple[List[Tuple[_Segment, int]], np.ndarray]:
+        """Find the nearest rows across both segments.
+
+        Returns:
+            Tuple[List[Tuple[_Segment, int]], np.ndarray]: The segment and row
+                of each neighbor, and the reported distances, best first.
+        """
+        query_vector = np.asarray(query, dtype=np.float32)
+
+        if query_vector.shape != (self.dimensions,):
+            raise ValueError(
+                f"Expected a query with {self.dimensions} dimensions, got {query_vector.shape}"
+            )
+
+        if self.distance_measure == COSINE_DISTANCE:
+            norm = np.linalg.norm(query_vector)
+            query_vector = query_vector / norm if norm > 0 else query_vector
+
+        tombstones = self.delta.tombstones if self.delta else frozenset()
+        rows, scores = self.base.search(
+            query_vector,
+            num_neighbors + len(tombstones),
+            self.num_probes,
+            self.rescore_factor,
+        )
+        if tombstones:
+            live = np.array(
+                [self.base.ids[row] not in tombstones for row in rows], dtype=bool
+            )
+            rows, scores = rows[live], scores[live]
+
+        sources = [(self.base, int(row)) for row in rows]
+        all_scores = [scores]
+
+        if self.delta is not None:
+            rows, scores = self.delta.search(
+                query_vector, num_neighbors, self.num_probes
+            )
+            sources.extend((self.delta, int(row)) for row in rows)
+            all_scores.append(scores)
+
+        merged_scores = np.concatenate(all_scores)
+        order = np.argsort(-merged_scores, kind="stable")[:num_neighbors]
+        distances = (
+            -merged_scores[order]
+            if self.distance_measure == SQUARED_L2_DISTANCE
+            else merged_scores[order]
+        )
+
+        return [sources[position] for position in order], distances
+
+    def search_arrays(
+        self, query: Sequence[float], num_neighbors: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Find the nearest neighbors of a query embedding.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The neighbor ids, as an object array,
+                and their distances, best first.
+        """
+        sources, distances = self._search(query=query, num_neighbors=num_neighbors)
+        ids = np.array([segment.ids[row] for segment, row in sources], dtype=object)
+
+        return ids, distances
+
+    def search(self, query: Sequence[float], num_neighbors: int) -> List[Neighbor]:
+        """Find the nearest neighbors of a query embedding, with their metadata."""
+        sources, distances = self._search(query=query, num_neighbors=num_neighbors)
+
+        return [
+            Neighbor(
+                id=segment.ids[row],
+                distance=distance,
+                metadata=segment.get_metadata(row),
+            )
+            for (segment, row), distance in zip(sources, distances.tolist())
+        ]
+
+
+class ReloadingLocalIndex:
+    """A local index that picks up new versions without a restart.
+
+    The manifest is checked at most once per check interval. When it changed,
+    the new version is opened and swapped in; searches already running keep
+    using the snapshot they started with.
+    """
+
+    def __init__(
+        self,
+        index_dir: str,
+        check_interval_seconds: float = 5.0,
+        num_probes: int = DEFAULT_NUM_PROBES,
+        rescore_factor: int = DEFAULT_RESCORE_FACTOR,
+    ) -> None:
+        self.index_dir = index_dir
+        self.check_interval_seconds = check_interval_seconds
+        self.num_probes = num_probes
+        self.rescore_factor = rescore_factor
+        self._lock = threading.Lock()
+        self._next_check = 0.0
+        self._manifest_stat: Tuple[int, int] = (0, 0)
+        self._index = self.reload()
+
+    def _stat_manifest(self) -> Tuple[int, int]:
+        # The manifest is replaced rather than rewritten, so its inode changes
+        stat = os.stat(os.path.join(self.index_dir, MANIFEST_FILE))
+        return stat.st_ino, stat.st_mtime_ns
+
+    def reload(self) -> LocalIndex:
+        """Open the current version of the index and swap it in."""
+        with self._lock:
+            self._manifest_stat = self._stat_manifest()
+            self._next_check = time.monotonic() + self.check_interval_seconds
+            self._index = LocalIndex(
+                self.index_dir,
+                num_probes=self.num_probes,
+                rescore_factor=self.rescore_factor,
+            )
+            logger.info(
+                f"Loaded local index {self.index_dir} version {self._index.version}"
+            )
+            return self._index
+
+    @property
+    def current(self) -> LocalIndex:
+        if time.monotonic() >= self._next_check:
+            self._next_check = time.monotonic() + self.check_interval_seconds
+            try:
+                if self._stat_manifest() != self._manifest_stat:
+                    self.reload()
+            except Exception as ex:
+                # Keep serving the previous version
+                logger.error(f"Failed to reload local index {self.index_dir}: {ex}")
+
+        return self._index
+
+    @property
+    def count(self) -> int:
+        return self.current.count
+
+    def search(self, query: Sequence[float], num_neighbors: int) -> List[Neighbor]:
+        return self.current.search(query=query, num_neighbors=num_neighbors)
+
+    def search_arrays(
+        self, query: Sequence[float], num_neighbors: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        return self.current.search_arrays(query=query, num_neighbors=num_neighbors)
+
+
+def _write_manifest(index_dir: str, manifest: Dict[str, Any]) -> None:
+    _write_json(manifest, os.path.join(index_dir, MANIFEST_FILE))
+
+
+def _remove_segments(index_dir: str, segment_names: Iterable[Optional[str]]) -> None:
+    """Remove segments that are no longer referenced by the manifest.
+
+    Readers that still have them open keep working, as the mapped files stay
+    valid until they are unmapped.
+    """
+    for segment_name in segment_names:
+        if segment_name:
+            shutil.rmtree(os.path.join(index_dir, segment_name), ignore_errors=True)
+
+
+def build(
+    index_dir: str,
+    records: Iterable[Record],
+    dimensions: int,
+    distance_measure: str = DOT_PRODUCT_DISTANCE,
+    index_type: str = INDEX_TYPE_FLAT,
+    num_lists: Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    storage: str = STORAGE_FLOAT32,
+    pq_subspaces: Optional[int] = None,
+) -> LocalIndex:
+    """Build a new index from a stream of records.
+
+    If the index directory already contains an index, it is replaced with a
+    new version, which running services pick up on their next check.
+
+    Args:
+        index_dir (str): The index directory.
+        records (Iterable[Record]): The records to index.
+        dimensions (int): The number of embedding dimensions.
+        distance_measure (str): One of DISTANCE_MEASURES.
+        index_type (str): One of INDEX_TYPES.
+        num_lists (Optional[int]): The number of IVF lists. Defaults to the
+            square root of the number of records.
+        chunk_size (int): The number of records processed at a time.
+        storage (str): One of STORAGES, the row encoding used for scanning.
+        pq_subspaces (Optional[int]): The number of PQ subspaces, which must
+            divide the dimensions. Defaults to one per 8 dimensions.
+
+    Returns:
+        LocalIndex: The new index.
+    """
+    if distance_measure not in DISTANCE_MEASURES:
+        raise ValueError(f"Unknown distance measure: {distance_measure}")
+
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {index_type}")
+
+    if storage not in STORAGES:
+        raise ValueError(f"Unknown storage: {storage}")
+
+    os.makedirs(index_dir, exist_ok=True)
+
+    manifest_path = os.path.join(index_dir, MANIFEST_FILE)
+    previous = _read_json(manifest_path) if os.path.exists(manifest_path) else None
+    version = previous["version"] + 1 if previous else 1
+
+    base = f"segment-{version:06d}"
+    count = _write_segment(
+        os.path.join(index_dir, base),
+        records,
+        dimensions=dimensions,
+        distance_measure=distance_measure,
+        index_type=index_type,
+        num_lists=num_lists,
+        chunk_size=chunk_size,
+        storage=storage,
+        pq_subspaces=pq_subspaces,
+    )
+
+    _write_manifest(
+        index_dir,
+        {
+            "version": version,
+            "dimensions": dimensions,
+            "distance_measure": distance_measure,
+            "index_type": index_type,
+            "num_lists": num_lists,
+            "chunk_size": chunk_size,
+            "storage": storage,
+            "pq_subspaces": pq_subspaces,
+            "base": base,
+            "delta": None,
+            "count": count,
+        },
+    )
+
+    if previous:
+        _remove_segments(index_dir, [previous["base"], previous.get("delta")])
+
+    return LocalIndex(index_dir)
+
+
+def _write_delta(
+    index: LocalIndex, delta_records: Dict[str, Record], tombstones: Set[str]
+) -> LocalIndex:
+    """Write a new delta segment and point the manifest to it."""
+    manifest = dict(index.manifest)
+    version = manifest["version"] + 1
+    delta = f"delta-{version:06d}"
+
+    _write_segment(
+        os.path.join(index.index_dir, delta),
+        delta_records.values(),
+        dimensions=index.dimensions,
+        distance_measure=index.distance_measure,
+        chunk_size=manifest["chunk_size"],
+        tombstones=tombstones,
+    )
+
+    base_ids = set(index.base.ids)
+    manifest.update(
+        version=version,
+        delta=delta,
+        count=len(base_ids - tombstones) + len(delta_records),
+    )
+    _write_manifest(index.index_dir, manifest)
+    _remove_segments(index.index_dir, [index.manifest.get("delta")])
+
+    return LocalIndex(index.index_dir)
+
+
+def _get_delta_state(index: LocalIndex) -> Tuple[Dict[str, Record], Set[str]]:
+    if index.delta is None:
+        return {}, set()
+
+    return (
+        {record.id: record for record in index.delta.iter_records()},
+        set(index.delta.tombstones),
+    )
+
+
+def upsert(index_dir: str, records: Iterable[Record]) -> LocalIndex:
+    """Insert or replace records through the delta segment."""
+    index = LocalIndex(index_dir)
+    delta_records, tombstones = _get_delta_state(index)
+
+    for record in records:
+        delta_records[str(record.id)] = record
+        tombstones.add(str(record.id))
+
+    return _write_delta(index, delta_records, tombstones)
+
+
+def delete(index_dir: str, ids: Iterable[str]) -> LocalIndex:
+    """Delete records by id through the delta segment."""
+    index = LocalIndex(index_dir)
+    delta_records, tombstones = _get_delta_state(index)
+
+    for id in ids:
+        delta_records.pop(str(id), None)
+        tombstones.add(str(id))
+
+    return _write_delta(index, delta_records, tombstones)
+
+
+def compact(index_dir: str) -> LocalIndex:
+    """Merge the delta segment into a new base segment."""
+    index = LocalIndex(index_dir)
+
+    if index.delta is None:
+        return index
+
+    def merged_records() -> Iterator[Record]:
+        yield from index.base.iter_records(exclude_ids=index.delta.tombstones)
+        yield from index.delta.iter_records()
+
+    manifest = dict(index.manifest)
+    version = manifest["version"] + 1
+    base = f"segment-{version:06d}"
+
+    count = _write_segment(
+        os.path.join(index_dir, base),
+        merged_records(),
+        dimensions=index.dimensions,
+        distance_measure=index.distance_measure,
+        index_type=manifest["index_type"],
+        num_lists=manifest["num_lists"],
+        chunk_size=manifest["chunk_size"],
+        storage=manifest["storage"],
+        pq_subspaces=manifest["pq_subspaces"],
+    )
+
+    manifest.update(version=version, base=base, delta=None, count=count)
+    _write_manifest(index_dir, manifest)
+    _remove_segments(index_dir, [index.manifest["base"], index.manifest["delta"]])
+
+    return LocalIndex(index_dir)
+
+
+def compact_if_needed(index_dir: str, max_delta_ratio: float = 0.1) -> LocalIndex:
+    """Compact the index once the delta segment outgrows a fraction of the base."""
+    index = LocalIndex(index_dir)
+
+    if index.delta is None:
+        return index
+
+    delta_size = index.delta.count + len(index.delta.tombstones)
+    if delta_size > max_delta_ratio * max(index.base.count, 1):
+        logger.info(f"Compacting local index {index_dir}")
+        return compact(index_dir)
+
+    return index
@@ -16,14 +16,18 @@ import abc
 import dataclasses
 import functools
 import logging
-from typing import Generic, List, Optional, TypeVar
+from typing import Any, Generic, List, Optional, Tuple, TypeVar
 
+import numpy as np
 from google.cloud.aiplatform.matching_engine import (
     matching_engine_index,
     matching_engine_index_endpoint,
 )
 
+import resilience_helper
 import tracer_helper
+from services.local_index import ReloadingLocalIndex
+from services.suggestion_pool import SuggestionPool
 
 T = TypeVar("T")
 
@@ -38,9 +42,10 @@ class MatchResult:
     description: Optional[str] = None
     url: Optional[str] = None
     image: Optional[str] = None
+    id: Optional[str] = None
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(frozen=True)
 class Item:
     text: str
     id: Optional[str]
@@ -54,6 +59,8 @@ class CodeInfo:
 
 
 class MatchService(abc.ABC, Generic[T]):
+    suggestion_pool: SuggestionPool[Item]
+
     @abc.abstractproperty
     def id(self) -> str:
         """Unique identifier for this service."""
@@ -84,6 +91,20 @@ class MatchService(abc.ABC, Generic[T]):
         """Info about code used to generate index."""
         return None
 
+    @property
+    def embedding_model_id(self) -> Optional[str]:
+        """Id of the model that embeds queries.
+
+        Services with the same model id share the embeddings of a query when
+        they are matched together. None means the embeddings are not shared.
+        """
+        return None
+
+    @property
+    def embedding_backend(self) -> resilience_helper.ResilientBackend:
+        """Backend for remote embedding calls, shared by services of a model."""
+        return resilience_helper.get_backend(self.embedding_model_id or self.id)
+
     def convert_image_to_embeddings(
         self, image_file_local_path: str
     ) -> Optional[List[float]]:
@@ -106,10 +127,15 @@ class MatchService(abc.ABC, Generic[T]):
     ) -> List[MatchResult]:
         raise NotImplementedError()
 
-    @abc.abstractmethod
+    @tracer.start_as_current_span("get_suggestions")
     def get_suggestions(self, num_items: int = 60) -> List[Item]:
         """Get suggestions for search queries."""
-        pass
+        return self.suggestion_pool.sample(num_items)
+
+    @tracer.start_as_current_span("get_serialized_suggestions")
+    def get_serialized_suggestions(self, num_items: int = 60) -> bytes:
+        """Get suggestions as a pre-serialized JSON response body."""
+        return self.suggestion_pool.get_serialized_sample(num_items)
 
     @abc.abstractmethod
     def get_by_id(self, id: str) -> Optional[T]:
@@ -126,10 +152,39 @@ class MatchService(abc.ABC, Generic[T]):
         """Convert a given item to an embedding representation."""
         pass
 
+    def convert_texts_to_embeddings_batch(
+        self, targets: List[str]
+    ) -> List[Optional[List[float]]]:
+        """Convert many texts to embeddings, e.g. to embed a whole corpus.
+
+        Services whose model takes batches override this to embed them in fewer
+        calls.
+        """
+        return [self.convert_text_to_embeddings(target=target) for target in targets]
+
+    def convert_images_to_embeddings_batch(
+        self, image_files: List[str]
+    ) -> List[Optional[List[float]]]:
+        """Convert many local or remote images to embeddings."""
+        return [
+            self.convert_image_to_embeddings_remote(image_file_remote_path=image_file)
+            for image_file in image_files
+        ]
+
+    def transform_distances(self, distances: np.ndarray) -> np.ndarray:
+        """Convert the distances returned by the index to result distances."""
+        return distances
+
     @abc.abstractmethod
     def convert_match_neighbors_to_result(
-        self, matches: List[matching_engine_index_endpoint.MatchNeighbor]
-    ) -> List[Optional[MatchResult]]:
+        self, ids: np.ndarray, distances: np.ndarray
+    ) -> List[MatchResult]:
+        """Build results for neighbors, leaving out those without an item.
+
+        Args:
+            ids (np.ndarray): Neighbor ids, as an object array.
+            distances (np.ndarray): Neighbor distances, already transformed.
+        """
         pass
 
     @abc.abstractmethod
@@ -137,48 +192,94 @@ class MatchService(abc.ABC, Generic[T]):
         pass
 
 
+def get_neighbor_arrays(
+    response: List[List[matching_engine_index_endpoint.MatchNeighbor]],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Flatten the neighbors of all queries into id and distance arrays."""
+    neighbors = [neighbor for neighbors in response for neighbor in neighbors]
+
+    ids = np.array([neighbor.id for neighbor in neighbors], dtype=object)
+    distances = np.fromiter(
+        (neighbor.distance for neighbor in neighbors),
+        dtype=np.float64,
+        count=len(neighbors),
+    )
+
+    return ids, distances
+
+
+def get_item_rows(items: List[Any], missing: Any = None) -> np.ndarray:
+    """Get the rows whose item isn't the missing marker, in one pass."""
+    return np.flatnonzero(
+        np.fromiter((item != missing for item in items), dtype=bool, count=len(items))
+    )
+
+
 class VertexAIMatchingEngineMatchService(MatchService[T]):
     index_endpoint: matching_engine_index_endpoint.MatchingEngineIndexEndpoint
     deployed_index_id: str
     is_public_index_endpoint: bool = True
 
-    @tracer.start_as_current_span("match_by_embeddings")
-    def match_by_embeddings(
-        self, embeddings: List[float], num_neighbors: int
-    ) -> List[MatchResult]:
-        if embeddings is None:
-            raise ValueError("Embeddings could not be generated for: {target}")
+    # When set, queries are served from this local index instead of the endpoint
+    local_index: Optional[ReloadingLocalIndex] = None
 
-        logger.info(f"len(embeddings) = {len(embeddings)}")
+    @property
+    def index_backend(self) -> resilience_helper.ResilientBackend:
+        """Backend for calls to the deployed index."""
+        return resilience_helper.get_backend(
+            f"{self.index_endpoint.resource_name}/{self.deployed_index_id}"
+        )
 
+    def _find_neighbors(
+        self, embeddings: List[float], num_neighbors: int
+    ) -> List[List[matching_engine_index_endpoint.MatchNeighbor]]:
         if self.is_public_index_endpoint:
-            response = self.index_endpoint.find_neighbors(
+            return self.index_endpoint.find_neighbors(
                 deployed_index_id=self.deployed_index_id,
                 queries=[embeddings],
                 num_neighbors=num_neighbors,
             )
         else:
-            response = self.index_endpoint.match(
+            return self.index_endpoint.match(
                 deployed_index_id=self.deployed_index_id,
                 queries=[embeddings],
                 num_neighbors=num_neighbors,
             )
 
+    @tracer.start_as_current_span("match_by_embeddings")
+    def match_by_embeddings(
+        self, embeddings: List[float], num_neighbors: int
+    ) -> List[MatchResult]:
+        if embeddings is None:
+            raise ValueError("Embeddings could not be generated for: {target}")
+
+        logger.info(f"len(embeddings) = {len(embeddings)}")
+
+        if self.local_index is not None:
+            ids, distances = self.local_index.search_arrays(
+                query=embeddings, num_neighbors=num_neighbors
+            )
+        else:
+            # The SDK calls take no timeout, so the deadline only bounds the wait and
+            # a hung call holds one of the backend's threads
+            response = self.index_backend.call(
+                lambda timeout: self._find_neighbors(
+                    embeddings=embeddings, num_neighbors=num_neighbors
+                ),
+                cache_key=(tuple(embeddings), num_neighbors),
+                hedge=True,
+            )
+            ids, distances = get_neighbor_arrays(response)
+
         logger.info(f"index_endpoint.match completed")
 
-        matches_all = self.convert_match_neighbors_to_result(
-            matches=[match for matches in response for match in matches]
+        results = self.convert_match_neighbors_to_result(
+            ids=ids, distances=self.transform_distances(distances)
         )
 
         logger.info(f"matches converted")
 
-        matches_all_nonoptional: List[MatchResult] = [
-            match for match in matches_all if match is not None
-        ]
-
-        logger.info(f"matches none filtered")
-
-        return matches_all_nonoptional
+        return results
 
     @tracer.start_as_current_span("match_by_text")
     def match_by_text(self, target: str, num_neighbors: int) -> List[MatchResult]:
@@ -235,9 +336,15 @@ class VertexAIMatchingEngineMatchService(MatchService[T]):
             embeddings=embeddings, num_neighbors=num_neighbors
         )
 
-    @functools.lru_cache
     @tracer.start_as_current_span("get_total_index_count")
     def get_total_index_count(self) -> int:
+        if self.local_index is not None:
+            return self.local_index.count
+
+        return self._get_deployed_index_count()
+
+    @functools.lru_cache
+    def _get_deployed_index_count(self) -> int:
         return sum(
             [
                 matching_engine_index.MatchingEngineIndex(
@@ -0,0 +1,184 @@
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Match a query against several services at once.
+
+Services run concurrently on worker threads, so the request takes as long as
+the slowest service rather than the sum of all of them. Services that embed
+queries with the same model share a single embedding call.
+"""
+
+import asyncio
+import contextvars
+import dataclasses
+import functools
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+import resilience_helper
+from services.match_service import (
+    MatchResult,
+    MatchService,
+    VertexAIMatchingEngineMatchService,
+)
+
+logger = logging.getLogger(__name__)
+
+R = TypeVar("R")
+
+INPUT_TYPE_TEXT = "text"
+INPUT_TYPE_IMAGE_URL = "image_url"
+
+
+@dataclasses.dataclass
+class ServiceMatches:
+    service_id: str
+    total_index_count: Optional[int] = None
+    results: Optional[List[MatchResult]] = None
+    error: Optional[str] = None
+
+
+async def _run_in_thread(func: Callable[..., R], *args: Any, **kwargs: Any) -> R:
+    """Run a blocking call on the default executor, keeping context variables."""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        None, functools.partial(context.run, func, *args, **kwargs)
+    )
+
+
+class _EmbeddingsCache:
+    """Shares in-flight embedding calls between services of one request."""
+
+    def __init__(self) -> None:
+        self._futures: Dict[Tuple[str, str, str], Awaitable[Optional[List[float]]]] = {}
+
+    def get(
+        self, service: MatchService, input_type: str, target: str
+    ) -> Awaitable[Optional[List[float]]]:
+        # Services without a model id are keyed by their own id, so never share
+        key = (service.embedding_model_id or f"service:{service.id}", input_type, target)
+
+        if key not in self._futures:
+            if input_type == INPUT_TYPE_TEXT:
+                call = _run_in_thread(service.convert_text_to_embeddings, target=target)
+            else:
+                call = _run_in_thread(
+                    service.convert_image_to_embeddings_remote,
+                    image_file_remote_path=target,
+                )
+            self._futures[key] = asyncio.ensure_future(call)
+
+        return self._futures[key]
+
+
+def _get_input(
+    service: MatchService, text: Optional[str], image_url: Optional[str]
+) -> Tuple[str, str]:
+    """Pick the input a service accepts, preferring text."""
+    if text is not None and service.allows_text_input:
+        return INPUT_TYPE_TEXT, text
+    elif image_url is not None and service.allows_image_input:
+        return INPUT_TYPE_IMAGE_URL, image_url
+    else:
+        raise ValueError(f"Match service {service.id} does not accept this input")
+
+
+async def _match_service(
+    service: MatchService,
+    text: Optional[str],
+    image_url: Optional[str],
+    num_neighbors: int,
+    embeddings_cache: _EmbeddingsCache,
+) -> ServiceMatches:
+    try:
+        input_type, target = _get_input(service, text=text, image_url=image_url)
+
+        if isinstance(service, VertexAIMatchingEngineMatchService):
+            embeddings = await embeddings_cache.get(service, input_type, target)
+
+            if embeddings is None:
+                raise ValueError(f"Embeddings could not be generated for: {target}")
+
+            results = await _run_in_thread(
+                service.match_by_embeddings,
+                embeddings=embeddings,
+                num_neighbors=num_neighbors,
+            )
+        elif input_type == INPUT_TYPE_TEXT:
+            results = await _run_in_thread(
+                service.match_by_text, target=target, num_neighbors=num_neighbors
+            )
+        else:
+            results = await _run_in_thread(
+                service.match_by_image_remote,
+                image_file_remote_path=target,
+                num_neighbors=num_neighbors,
+            )
+
+        total_index_count = await _run_in_thread(service.get_total_index_count)
+
+        return ServiceMatches(
+            service_id=service.id,
+            total_index_count=total_index_count,
+            results=results,
+        )
+    except ValueError as ex:
+        return ServiceMatches(service_id=service.id, error=str(ex))
+    except resilience_helper.DeadlineExceeded:
+        return ServiceMatches(service_id=service.id, error="Timed out getting matches")
+    except resilience_helper.CircuitOpenError:
+        return ServiceMatches(
+            service_id=service.id, error="Matching is temporarily unavailable"
+        )
+    except Exception as ex:
+        logger.error(f"Match service {service.id} failed: {ex}")
+        return ServiceMatches(
+            service_id=service.id, error="There was an error getting matches"
+        )
+
+
+async def match_multi(
+    services: List[MatchService],
+    text: Optional[str],
+    image_url: Optional[str],
+    num_neighbors: int,
+) -> List[ServiceMatches]:
+    """Match a text or image url query against several services concurrently.
+
+    Args:
+        services (List[MatchService]): The services to match against.
+        text (Optional[str]): Query text, used by services that accept text.
+        image_url (Optional[str]): Query image url, used by services that
+            accept images but not text.
+        num_neighbors (int): The number of matches per service.
+
+    Returns:
+        List[ServiceMatches]: The matches of each service, in the order given.
+            A failed service has an error instead of results, and doesn't fail
+            the others.
+    """
+    embeddings_cache = _EmbeddingsCache()
+
+    return await asyncio.gather(
+        *[
+            _match_service(
+                service,
+                text=text,
+                image_url=image_url,
+                num_neighbors=num_neighbors,
+                embeddings_cache=embeddings_cache,
+            )
+            for service in services
+        ]
+    )
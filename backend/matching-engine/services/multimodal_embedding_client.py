@@ -1,11 +1,28 @@
 # from absl import app
 # from absl import flags
 import base64
+import concurrent.futures
+import time
+
 import requests
 
 from google.cloud import aiplatform
 from google.protobuf import struct_pb2
-from typing import NamedTuple, Sequence, Optional
+from typing import Callable, List, NamedTuple, Optional, Sequence, Tuple
+
+import resilience_helper
+from services import image_preprocessing
+
+MODEL_ID = "multimodalembedding@001"
+
+# multimodalembedding@001 accepts a single instance per request
+DEFAULT_MAX_INSTANCES_PER_REQUEST = 1
+DEFAULT_MAX_CONCURRENT_REQUESTS = 8
+# The default online prediction quota of the model
+DEFAULT_REQUESTS_PER_MINUTE = 120
+
+# A (text, image_file) pair
+EmbeddingInput = Tuple[Optional[str], Optional[str]]
 
 
 class EmbeddingResponse(NamedTuple):
@@ -13,10 +30,10 @@ class EmbeddingResponse(NamedTuple):
     image_embedding: Optional[Sequence[float]]
 
 
-def load_image_bytes(image_uri: str) -> bytes:
+def load_image_bytes(image_uri: str, timeout: Optional[float] = None) -> bytes:
     """Load image bytes from a remote or local URI."""
     if image_uri.startswith("http://") or image_uri.startswith("https://"):
-        response = requests.get(image_uri, stream=True)
+        response = requests.get(image_uri, stream=True, timeout=timeout)
         if response.status_code == 200:
             image_bytes = response.content
     else:
@@ -24,6 +41,18 @@ def load_image_bytes(image_uri: str) -> bytes:
     return image_bytes
 
 
+def _get_remaining_seconds_function(
+    timeout: Optional[float],
+) -> Callable[[], Optional[float]]:
+    """Get a function returning the seconds left out of a timeout."""
+    deadline_at = None if timeout is None else time.monotonic() + timeout
+
+    def get_remaining_seconds() -> Optional[float]:
+        return None if deadline_at is None else max(deadline_at - time.monotonic(), 0)
+
+    return get_remaining_seconds
+
+
 class MultimodalEmbeddingPredictionClient:
     """Wrapper around Prediction Service Client."""
 
@@ -32,6 +61,10 @@ class MultimodalEmbeddingPredictionClient:
         project_id: str,
         location: str = "us-central1",
         api_regional_endpoint: str = "us-central1-aiplatform.googleapis.com",
+        preprocess_images: bool = True,
+        max_instances_per_request: int = DEFAULT_MAX_INSTANCES_PER_REQUEST,
+        max_concurrent_requests: int = DEFAULT_MAX_CONCURRENT_REQUESTS,
+        requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE,
     ):
         client_options = {"api_endpoint": api_regional_endpoint}
         # Initialize client that will be used to create and send requests.
@@ -41,17 +74,76 @@ class MultimodalEmbeddingPredictionClient:
         )
         self.location = location
         self.project_id = project_id
+        # Downscale and re-encode images before sending them
+        self.preprocess_images = preprocess_images
+        # Batches are split into requests of this many instances
+        self.max_instances_per_request = max_instances_per_request
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_concurrent_requests,
+            thread_name_prefix="multimodal_embedding",
+        )
+        self.rate_limiter = resilience_helper.RateLimiter(
+            rate_per_second=requests_per_minute / 60, burst=max_concurrent_requests
+        )
 
-    def get_embedding(
-        self, text: Optional[str] = None, image_file: Optional[str] = None
-    ):
-        if not text and not image_file:
-            raise ValueError("At least one of text or image_file must be specified.")
+    def _load_image(
+        self, image_file: str, timeout: Optional[float]
+    ) -> "concurrent.futures.Future[bytes]":
+        """Load an image, and start preprocessing it on the preprocessing pool."""
+        image_bytes = load_image_bytes(image_file, timeout=timeout)
+
+        if self.preprocess_images:
+            return image_preprocessing.submit_preprocess_image_bytes(image_bytes)
 
-        # Load image file
+        future: "concurrent.futures.Future[bytes]" = concurrent.futures.Future()
+        future.set_result(image_bytes)
+        return future
+
+    def _make_instances(
+        self,
+        inputs: Sequence[EmbeddingInput],
+        get_remaining_seconds: Callable[[], Optional[float]],
+    ) -> List[struct_pb2.Struct]:
+        for text, image_file in inputs:
+            if not text and not image_file:
+                raise ValueError(
+                    "At least one of text or image_file must be specified."
+                )
+
+        # Later images are loaded while the earlier ones are preprocessed
+        image_futures = [
+            self._load_image(image_file, timeout=get_remaining_seconds())
+            if image_file
+            else None
+            for _, image_file in inputs
+        ]
+
+        try:
+            return [
+                self._make_instance(
+                    text, image_future, timeout=get_remaining_seconds()
+                )
+                for (text, _), image_future in zip(inputs, image_futures)
+            ]
+        finally:
+            for image_future in image_futures:
+                if image_future is not None:
+                    image_future.cancel()
+
+    def _make_instance(
+        self,
+        text: Optional[str],
+        image_future: "Optional[concurrent.futures.Future[bytes]]",
+        timeout: Optional[float],
+    ) -> struct_pb2.Struct:
         image_bytes = None
-        if image_file:
-            image_bytes = load_image_bytes(image_file)
+        if image_future is not None:
+            try:
+                image_bytes = image_future.result(timeout=timeout)
+            except concurrent.futures.TimeoutError:
+                raise resilience_helper.DeadlineExceeded(
+                    "Deadline exceeded preprocessing image"
+                )
 
         instance = struct_pb2.Struct()
         if text:
@@ -62,23 +154,97 @@ class MultimodalEmbeddingPredictionClient:
             image_struct = instance.fields["image"].struct_value
             image_struct.fields["bytesBase64Encoded"].string_value = encoded_content
 
-        instances = [instance]
+        return instance
+
+    def _predict(
+        self, instances: List[struct_pb2.Struct], timeout: Optional[float]
+    ) -> List[EmbeddingResponse]:
         endpoint = (
             f"projects/{self.project_id}/locations/{self.location}"
-            "/publishers/google/models/multimodalembedding@001"
+            f"/publishers/google/models/{MODEL_ID}"
+        )
+        response = self.client.predict(
+            endpoint=endpoint, instances=instances, timeout=timeout
         )
-        response = self.client.predict(endpoint=endpoint, instances=instances)
 
-        text_embedding = None
-        if text:
-            text_emb_value: Sequence[float] = response.predictions[0]["textEmbedding"]
-            text_embedding = [v for v in text_emb_value]
+        embedding_responses = []
+        for instance, prediction in zip(instances, response.predictions):
+            text_embedding = None
+            if "text" in instance.fields:
+                text_emb_value: Sequence[float] = prediction["textEmbedding"]
+                text_embedding = [v for v in text_emb_value]
 
-        image_embedding = None
-        if image_bytes:
-            image_emb_value: Sequence[float] = response.predictions[0]["imageEmbedding"]
-            image_embedding = [v for v in image_emb_value]
+            image_embedding = None
+            if "image" in instance.fields:
+                image_emb_value: Sequence[float] = prediction["imageEmbedding"]
+                image_embedding = [v for v in image_emb_value]
 
-        return EmbeddingResponse(
-            text_embedding=text_embedding, image_embedding=image_embedding
-        )
+            embedding_responses.append(
+                EmbeddingResponse(
+                    text_embedding=text_embedding, image_embedding=image_embedding
+                )
+            )
+
+        return embedding_responses
+
+    def get_embedding(
+        self,
+        text: Optional[str] = None,
+        image_file: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> EmbeddingResponse:
+        get_remaining_seconds = _get_remaining_seconds_function(timeout)
+
+        instances = self._make_instances([(text, image_file)], get_remaining_seconds)
+        return self._predict(instances, timeout=get_remaining_seconds())[0]
+
+    def _get_batch_embeddings(
+        self, inputs: Sequence[EmbeddingInput], timeout: Optional[float]
+    ) -> List[EmbeddingResponse]:
+        get_remaining_seconds = _get_remaining_seconds_function(timeout)
+
+        instances = self._make_instances(inputs, get_remaining_seconds)
+        # Wait for the rate limit only once the request is ready to be sent
+        self.rate_limiter.acquire(timeout=get_remaining_seconds())
+
+        return self._predict(instances, timeout=get_remaining_seconds())
+
+    def get_embeddings_batch(
+        self,
+        inputs: Sequence[EmbeddingInput],
+        timeout: Optional[float] = None,
+    ) -> List[EmbeddingResponse]:
+        """Get the embeddings of many text and image pairs.
+
+        Inputs are packed into requests of up to max_instances_per_request
+        instances, which are sent concurrently on the client's worker pool and
+        paced by its rate limiter.
+
+        Args:
+            inputs (Sequence[EmbeddingInput]): (text, image_file) pairs, each
+                with at least one of them set.
+            timeout (Optional[float]): Seconds allowed for each request,
+                including loading its images and waiting for the rate limit.
+
+        Returns:
+            List[EmbeddingResponse]: The embeddings, in the order of the inputs.
+        """
+        futures = [
+            self._executor.submit(
+                self._get_batch_embeddings,
+                inputs[start : start + self.max_instances_per_request],
+                timeout,
+            )
+            for start in range(0, len(inputs), self.max_instances_per_request)
+        ]
+
+        try:
+            return [
+                embedding_response
+                for future in futures
+                for embedding_response in future.result()
+            ]
+        finally:
+            # Don't send the remaining requests if one of them failed
+            for future in futures:
+                future.cancel()
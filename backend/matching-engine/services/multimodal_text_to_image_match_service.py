@@ -12,43 +12,45 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import random
-from typing import Dict, List, Optional, TypeVar
+import hashlib
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, TypeVar
 
-import google.auth
-import google.auth.transport.requests
+import numpy as np
 import redis
 import requests
 from google.cloud.aiplatform.matching_engine import matching_engine_index_endpoint
-from services.multimodal_embedding_client import MultimodalEmbeddingPredictionClient
+from services.multimodal_embedding_client import (
+    EmbeddingInput,
+    EmbeddingResponse,
+    MultimodalEmbeddingPredictionClient,
+)
 
+import corpus_helper
+import credentials_helper
+import resilience_helper
 import storage_helper
 import tracer_helper
+from services.item_store import RedisItemStore
 from services.match_service import (
     CodeInfo,
     Item,
     MatchResult,
     VertexAIMatchingEngineMatchService,
+    get_item_rows,
 )
+from services.suggestion_pool import SuggestionPool
 
+logger = logging.getLogger(__name__)
 tracer = tracer_helper.get_tracer(__name__)
 
 DESTINATION_BLOB_NAME = "multimodal_text_to_image"
 
 
 def get_access_token() -> str:
-    # Get default access token
-    creds, _ = google.auth.default()
-    # creds.valid is False, and creds.token is None
-    # Need to refresh credentials to populate those
-    auth_req = google.auth.transport.requests.Request()
-    creds.refresh(auth_req)
-    access_token = creds.token
-
-    if access_token is None or len(access_token) == 0:
-        raise RuntimeError("No access token found")
-
-    return access_token
+    # Served from the process-wide cache, which refreshes it in the background
+    return credentials_helper.get_access_token()
 
 
 T = TypeVar("T")
@@ -84,6 +86,10 @@ class MultimodalTextToImageMatchService(VertexAIMatchingEngineMatchService[T]):
         """Info about code used to generate index."""
         return self._code_info
 
+    @property
+    def embedding_model_id(self) -> Optional[str]:
+        return "multimodalembedding@001"
+
     def __init__(
         self,
         id: str,
@@ -99,6 +105,7 @@ class MultimodalTextToImageMatchService(VertexAIMatchingEngineMatchService[T]):
         prompts_texts_file: Optional[str] = None,
         prompt_images_file: Optional[str] = None,
         code_info: Optional[CodeInfo] = None,
+        storage_backend: Optional[storage_helper.StorageBackend] = None,
     ) -> None:
         self._id = id
         self._name = name
@@ -108,20 +115,29 @@ class MultimodalTextToImageMatchService(VertexAIMatchingEngineMatchService[T]):
         self._allows_text_input = allows_text_input
         self._allows_image_input = allows_image_input
         self.gcs_bucket = gcs_bucket
+        # Uploaded images are copied here, by default the GCS bucket
+        self.storage_backend = storage_backend or storage_helper.GCSStorageBackend(
+            gcs_bucket
+        )
+
+        suggestion_sources = []
+        if prompts_texts_file and allows_text_input:
+            suggestion_sources.append(
+                (
+                    corpus_helper.load_corpus(prompts_texts_file),
+                    lambda text: Item(id=text, text=text, image=None),
+                )
+            )
 
-        if prompts_texts_file:
-            with open(prompts_texts_file, "r") as f:
-                prompts = f.readlines()
-                self.prompt_texts = [prompt.strip() for prompt in prompts]
-        else:
-            self.prompt_texts = []
+        if prompt_images_file and allows_image_input:
+            suggestion_sources.append(
+                (
+                    corpus_helper.load_corpus(prompt_images_file),
+                    lambda image_url: Item(id=image_url, text="", image=image_url),
+                )
+            )
 
-        if prompt_images_file:
-            with open(prompt_images_file, "r") as f:
-                prompt_images = f.readlines()
-                self.prompt_images = [prompt.strip() for prompt in prompt_images]
-        else:
-            self.prompt_images = []
+        self.suggestion_pool = SuggestionPool(*suggestion_sources)
 
         self.index_endpoint = (
             matching_engine_index_endpoint.MatchingEngineIndexEndpoint(
@@ -132,44 +148,85 @@ class MultimodalTextToImageMatchService(VertexAIMatchingEngineMatchService[T]):
         self.client = MultimodalEmbeddingPredictionClient(project_id=self.project_id)
         self.is_public_index_endpoint = is_public_index_endpoint
 
-    @tracer.start_as_current_span("get_suggestions")
-    def get_suggestions(self, num_items: int = 60) -> List[Item]:
-        """Get suggestions for search queries."""
-        text_prompts = (
-            [Item(id=word, text=word, image=None) for word in self.prompt_texts]
-            if self.allows_text_input
-            else []
-        )
-        image_prompts = (
-            [
-                Item(id=image_url, text="", image=image_url)
-                for image_url in self.prompt_images
-            ]
-            if self.allows_image_input
-            else []
-        )
-
-        prompts = text_prompts + image_prompts
-
-        return random.sample(
-            prompts,
-            min(num_items, len(prompts)),
-        )
-
-    def encode_image_to_embeddings(self, image_uri: str) -> List[float]:
+    def encode_image_to_embeddings(
+        self, image_uri: str, cache_key: Optional[Tuple[str, str]] = None
+    ) -> List[float]:
         try:
-            return self.client.get_embedding(
-                text=None, image_file=image_uri
-            ).image_embedding
+            return self.embedding_backend.call(
+                lambda timeout: self.client.get_embedding(
+                    text=None, image_file=image_uri, timeout=timeout
+                ).image_embedding,
+                cache_key=cache_key or ("image", image_uri),
+                hedge=True,
+            )
+        except (
+            resilience_helper.DeadlineExceeded,
+            resilience_helper.CircuitOpenError,
+        ):
+            raise
         except Exception as ex:
             raise RuntimeError("Error getting embedding.")
 
     def encode_text_to_embeddings(self, text: str) -> List[float]:
         try:
-            return self.client.get_embedding(text=text, image_file=None).text_embedding
+            return self.embedding_backend.call(
+                lambda timeout: self.client.get_embedding(
+                    text=text, image_file=None, timeout=timeout
+                ).text_embedding,
+                cache_key=("text", text),
+                hedge=True,
+            )
+        except (
+            resilience_helper.DeadlineExceeded,
+            resilience_helper.CircuitOpenError,
+        ):
+            raise
         except Exception as ex:
             raise RuntimeError("Error getting embedding.")
 
+    def _get_embeddings_batch(
+        self, inputs: List[EmbeddingInput]
+    ) -> List[Optional[EmbeddingResponse]]:
+        try:
+            return self.client.get_embeddings_batch(inputs)
+        except Exception as ex:
+            logger.warning(f"Batch embedding failed, retrying items one by one: {ex}")
+
+        embedding_responses: List[Optional[EmbeddingResponse]] = []
+        for text, image_file in inputs:
+            try:
+                embedding_responses.append(
+                    self.client.get_embedding(text=text, image_file=image_file)
+                )
+            except Exception as ex:
+                logger.error(f"Error getting embedding: {ex}")
+                embedding_responses.append(None)
+
+        return embedding_responses
+
+    def convert_texts_to_embeddings_batch(
+        self, targets: List[str]
+    ) -> List[Optional[List[float]]]:
+        return [
+            embedding_response.text_embedding if embedding_response else None
+            for embedding_response in self._get_embeddings_batch(
+                [(target, None) for target in targets]
+            )
+        ]
+
+    def convert_images_to_embeddings_batch(
+        self, image_files: List[str]
+    ) -> List[Optional[List[float]]]:
+        return [
+            embedding_response.image_embedding if embedding_response else None
+            for embedding_response in self._get_embeddings_batch(
+                [(None, image_file) for image_file in image_files]
+            )
+        ]
+
+    def transform_distances(self, distances: np.ndarray) -> np.ndarray:
+        return np.maximum(0, 1 - distances)
+
     @tracer.start_as_current_span("convert_text_to_embeddings")
     def convert_text_to_embeddings(self, target: str) -> Optional[List[float]]:
         return self.encode_text_to_embeddings(text=target)
@@ -179,17 +236,20 @@ class MultimodalTextToImageMatchService(VertexAIMatchingEngineMatchService[T]):
         self, image_file_local_path: str
     ) -> Optional[List[float]]:
         """Convert a given item to an embedding representation."""
-        # Upload image file
-        image_uri = storage_helper.upload_blob(
+        # Keep a copy of the image in the bucket, without waiting for it
+        self.storage_backend.upload_async(
             source_file_name=image_file_local_path,
-            bucket_name=self.gcs_bucket,
-            destination_blob_name=DESTINATION_BLOB_NAME,
+            destination_name=f"{DESTINATION_BLOB_NAME}/{Path(image_file_local_path).stem}",
         )
 
-        # Convert GCS path to HTTP path
-        image_uri_http = f"https://storage.googleapis.com/{image_uri[5:]}"
+        # Embed the local file directly, rather than having it downloaded back.
+        # Temporary file names are reused, so the image is cached by content.
+        with open(image_file_local_path, "rb") as f:
+            content_hash = hashlib.sha256(f.read()).hexdigest()
 
-        return self.encode_image_to_embeddings(image_uri=image_uri_http)
+        return self.encode_image_to_embeddings(
+            image_uri=image_file_local_path, cache_key=("image_sha256", content_hash)
+        )
 
     @tracer.start_as_current_span("convert_image_to_embeddings_remote")
     def convert_image_to_embeddings_remote(
@@ -219,6 +279,7 @@ class MercariTextToImageMatchService(MultimodalTextToImageMatchService[Dict[str,
         prompts_texts_file: Optional[str] = None,
         prompt_images_file: Optional[str] = None,
         code_info: Optional[CodeInfo] = None,
+        storage_backend: Optional[storage_helper.StorageBackend] = None,
     ) -> None:
         super().__init__(
             id=id,
@@ -234,36 +295,37 @@ class MercariTextToImageMatchService(MultimodalTextToImageMatchService[Dict[str,
             index_endpoint_name=index_endpoint_name,
             deployed_index_id=deployed_index_id,
             is_public_index_endpoint=is_public_index_endpoint,
+            storage_backend=storage_backend,
         )
         self.redis_client = redis.StrictRedis(host=redis_host, port=redis_port)
+        self.item_store = RedisItemStore(self.redis_client)
 
     @tracer.start_as_current_span("get_by_id")
     def get_by_id(self, id: str) -> Optional[Dict[str, str]]:
         """Get an item by id."""
-        retrieved = self.redis_client.hgetall(str(id))
-
-        if retrieved is not None:
-            # Convert the byte strings to regular strings
-            return {key.decode(): value.decode() for key, value in retrieved.items()}
-        else:
-            return None
+        return self.item_store.get(id)
 
     @tracer.start_as_current_span("convert_match_neighbors_to_result")
     def convert_match_neighbors_to_result(
-        self, matches: List[matching_engine_index_endpoint.MatchNeighbor]
-    ) -> List[Optional[MatchResult]]:
-        items = [self.get_by_id(match.id) for match in matches]
+        self, ids: np.ndarray, distances: np.ndarray
+    ) -> List[MatchResult]:
+        items = self.item_store.get_many(ids.tolist())
+        distance_values = distances.tolist()
+
+        # Unknown ids have an empty item, and are left out
         return [
             MatchResult(
-                title=item["name"],
-                description=item["description"],
-                distance=max(0, 1 - match.distance),
-                url=item["url"],
-                image=item["img_url"],
+                id=ids[row],
+                title=items[row]["name"],
+                description=items[row]["description"],
+                distance=distance_values[row],
+                url=items[row]["url"],
+                image=items[row]["img_url"],
             )
-            if item is not None
-            else None
-            for item, match in zip(items, matches)
+            if items[row] is not None
+            # Not hydrated in time, so return the id only
+            else MatchResult(id=ids[row], distance=distance_values[row])
+            for row in get_item_rows(items, missing={})
         ]
 
 
@@ -276,18 +338,18 @@ class RoomsTextToImageMatchService(MultimodalTextToImageMatchService[str]):
 
     @tracer.start_as_current_span("convert_match_neighbors_to_result")
     def convert_match_neighbors_to_result(
-        self, matches: List[matching_engine_index_endpoint.MatchNeighbor]
-    ) -> List[Optional[MatchResult]]:
-        items = [self.get_by_id(match.id) for match in matches]
+        self, ids: np.ndarray, distances: np.ndarray
+    ) -> List[MatchResult]:
+        items = [self.get_by_id(id) for id in ids.tolist()]
+        distance_values = distances.tolist()
+
         return [
             MatchResult(
                 title=None,
                 description=None,
-                distance=max(0, 1 - match.distance),
+                distance=distance_values[row],
                 url=None,
-                image=f"https://storage.googleapis.com/ai-demos-us-central1/interior_images/mit_indoor/{item}",
+                image=f"https://storage.googleapis.com/ai-demos-us-central1/interior_images/mit_indoor/{items[row]}",
             )
-            if item is not None
-            else None
-            for item, match in zip(items, matches)
+            for row in get_item_rows(items)
         ]
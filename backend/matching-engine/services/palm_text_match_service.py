@@ -13,22 +13,26 @@
 # limitations under the License.
 
 import logging
-import random
 from typing import Dict, List, Optional
 
 import google.auth
 import google.auth.transport.requests
+import numpy as np
 import redis
 import requests
 from google.cloud.aiplatform.matching_engine import matching_engine_index_endpoint
 
+import corpus_helper
 import tracer_helper
+from services.item_store import RedisItemStore
 from services.match_service import (
     CodeInfo,
     Item,
     MatchResult,
     VertexAIMatchingEngineMatchService,
+    get_item_rows,
 )
+from services.suggestion_pool import SuggestionPool
 
 # Load the "Vertex AI Embeddings for Text" model
 from vertexai.preview.language_models import TextEmbeddingModel
@@ -36,6 +40,9 @@ from vertexai.preview.language_models import TextEmbeddingModel
 logger = logging.getLogger(__name__)
 tracer = tracer_helper.get_tracer(__name__)
 
+# The number of texts textembedding-gecko@001 takes per request
+MAX_INSTANCES_PER_REQUEST = 5
+
 
 class PalmTextMatchService(VertexAIMatchingEngineMatchService[Dict[str, str]]):
     @property
@@ -67,6 +74,10 @@ class PalmTextMatchService(VertexAIMatchingEngineMatchService[Dict[str, str]]):
         """Info about code used to generate index."""
         return self._code_info
 
+    @property
+    def embedding_model_id(self) -> Optional[str]:
+        return "textembedding-gecko@001"
+
     def __init__(
         self,
         id: str,
@@ -84,9 +95,12 @@ class PalmTextMatchService(VertexAIMatchingEngineMatchService[Dict[str, str]]):
         self._description = description
         self._code_info = code_info
 
-        with open(words_file, "r") as f:
-            prompts = f.readlines()
-            self.prompts = [prompt.strip() for prompt in prompts]
+        self.suggestion_pool = SuggestionPool(
+            (
+                corpus_helper.load_corpus(words_file),
+                lambda word: Item(id=word, text=word, image=None),
+            )
+        )
 
         self.index_endpoint = (
             matching_engine_index_endpoint.MatchingEngineIndexEndpoint(
@@ -95,52 +109,69 @@ class PalmTextMatchService(VertexAIMatchingEngineMatchService[Dict[str, str]]):
         )
         self.deployed_index_id = deployed_index_id
         self.redis_client = redis.StrictRedis(host=redis_host, port=redis_port)
+        self.item_store = RedisItemStore(self.redis_client)
         self.model: TextEmbeddingModel = TextEmbeddingModel.from_pretrained(
-            "textembedding-gecko@001"
-        )
-
-    @tracer.start_as_current_span("get_suggestions")
-    def get_suggestions(self, num_items: int = 60) -> List[Item]:
-        """Get suggestions for search queries."""
-        return random.sample(
-            [Item(id=word, text=word, image=None) for word in self.prompts],
-            min(num_items, len(self.prompts)),
+            self.embedding_model_id
         )
 
     @tracer.start_as_current_span("get_by_id")
     def get_by_id(self, id: str) -> Optional[Dict[str, str]]:
         """Get an item by id."""
-        retrieved = self.redis_client.hgetall(str(id))
-
-        if retrieved is not None:
-            # Convert the byte strings to regular strings
-            return {key.decode(): value.decode() for key, value in retrieved.items()}
-        else:
-            return None
+        return self.item_store.get(id)
 
     def encode_texts_to_embeddings(self, sentences: List[str]) -> List[List[float]]:
-        embeddings = self.model.get_embeddings(sentences)
+        # The SDK call takes no timeout, so the deadline only bounds the wait and
+        # a hung call holds one of the backend's threads
+        embeddings = self.embedding_backend.call(
+            lambda timeout: self.model.get_embeddings(sentences),
+            cache_key=tuple(sentences),
+            hedge=True,
+        )
         return [embedding.values for embedding in embeddings]
 
     @tracer.start_as_current_span("convert_text_to_embeddings")
     def convert_text_to_embeddings(self, target: str) -> Optional[List[float]]:
         return self.encode_texts_to_embeddings(sentences=[target])[0]
 
+    def convert_texts_to_embeddings_batch(
+        self, targets: List[str]
+    ) -> List[Optional[List[float]]]:
+        # Offline batches skip the embedding backend, so they don't push the
+        # cached results of live queries out of its fallback cache
+        return [
+            embedding.values
+            for start in range(0, len(targets), MAX_INSTANCES_PER_REQUEST)
+            for embedding in self.model.get_embeddings(
+                targets[start : start + MAX_INSTANCES_PER_REQUEST]
+            )
+        ]
+
+    def transform_distances(self, distances: np.ndarray) -> np.ndarray:
+        # There is a bug in matching engine where the negative of DOT_PRODUCT_DISTANCE is returned, instead of the distance itself.
+        return np.maximum(0, 1 - distances)
+
     @tracer.start_as_current_span("convert_match_neighbors_to_result")
     def convert_match_neighbors_to_result(
-        self, matches: List[matching_engine_index_endpoint.MatchNeighbor]
-    ) -> List[Optional[MatchResult]]:
-        items = [self.get_by_id(match.id) for match in matches]
+        self, ids: np.ndarray, distances: np.ndarray
+    ) -> List[MatchResult]:
+        items = self.item_store.get_many(ids.tolist())
+        distance_values = distances.tolist()
 
+        # Unknown ids have an empty item, and are left out
         return [
             MatchResult(
-                title=item["title"],
-                # There is a bug in matching engine where the negative of DOT_PRODUCT_DISTANCE is returned, instead of the distance itself.
-                distance=max(0, 1 - match.distance),
-                description=item["body"] + "...",
-                url=f"https://stackoverflow.com/questions/{match.id}",
+                id=ids[row],
+                title=items[row]["title"],
+                distance=distance_values[row],
+                description=items[row]["body"] + "...",
+                url=f"https://stackoverflow.com/questions/{ids[row]}",
+            )
+            if items[row] is not None
+            # Not hydrated in time, so only what the id tells
+            else MatchResult(
+                id=ids[row],
+                distance=distance_values[row],
+                url=f"https://stackoverflow.com/questions/{ids[row]}",
             )
-            if item is not None and len(item.items()) > 0
-            else None
-            for item, match in zip(items, matches)
+            for row in get_item_rows(items, missing={})
         ]
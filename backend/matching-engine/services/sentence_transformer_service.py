@@ -13,14 +13,14 @@
 # limitations under the License.
 
 import logging
-import random
 from typing import List, Optional
 
 import numpy as np
 import redis
 from google.cloud.aiplatform.matching_engine import matching_engine_index_endpoint
-from sentence_transformers import SentenceTransformer
 
+import corpus_helper
+import model_helper
 import tracer_helper
 from services.match_service import (
     CodeInfo,
@@ -28,6 +28,7 @@ from services.match_service import (
     MatchResult,
     VertexAIMatchingEngineMatchService,
 )
+from services.suggestion_pool import SuggestionPool
 
 logger = logging.getLogger(__name__)
 tracer = tracer_helper.get_tracer(__name__)
@@ -76,11 +77,16 @@ class SentenceTransformerMatchService(VertexAIMatchingEngineMatchService[str]):
         self._description = description
         self._code_info = code_info
 
-        with open(words_file, "r") as f:
-            questions = f.readlines()
-            self.questions = [question.strip() for question in questions]
+        self.suggestion_pool = SuggestionPool(
+            (
+                corpus_helper.load_corpus(words_file),
+                lambda question: Item(id=None, text=question, image=None),
+            )
+        )
 
-        self.encoder = SentenceTransformer(sentence_transformer_id_or_path)
+        self.encoder = model_helper.get_sentence_transformer(
+            sentence_transformer_id_or_path
+        )
 
         self.index_endpoint = (
             matching_engine_index_endpoint.MatchingEngineIndexEndpoint(
@@ -90,14 +96,6 @@ class SentenceTransformerMatchService(VertexAIMatchingEngineMatchService[str]):
         self.deployed_index_id = deployed_index_id
         self.redis_client = redis.StrictRedis(host=redis_host, port=redis_port)
 
-    @tracer.start_as_current_span("get_suggestions")
-    def get_suggestions(self, num_items: int = 60) -> List[Item]:
-        """Get suggestions for search queries."""
-        return random.sample(
-            [Item(id=None, text=word, image=None) for word in self.questions],
-            min(num_items, len(self.questions)),
-        )
-
     @tracer.start_as_current_span("get_by_id")
     def get_by_id(self, id: str) -> Optional[str]:
         """Get an item by id."""
@@ -121,18 +119,21 @@ class SentenceTransformerMatchService(VertexAIMatchingEngineMatchService[str]):
         else:
             return None
 
+    def transform_distances(self, distances: np.ndarray) -> np.ndarray:
+        # There is a bug in matching engine where the negative of DOT_PRODUCT_DISTANCE is returned, instead of the distance itself.
+        return np.maximum(0, 1 - distances)
+
     @tracer.start_as_current_span("convert_match_neighbors_to_result")
     def convert_match_neighbors_to_result(
-        self, matches: List[matching_engine_index_endpoint.MatchNeighbor]
-    ) -> List[Optional[MatchResult]]:
-        items = self.get_by_ids(ids=[match.id for match in matches])
+        self, ids: np.ndarray, distances: np.ndarray
+    ) -> List[MatchResult]:
+        items = self.get_by_ids(ids=ids.tolist())
 
         return [
             MatchResult(
                 title=item,
-                # There is a bug in matching engine where the negative of DOT_PRODUCT_DISTANCE is returned, instead of the distance itself.
-                distance=max(0, 1 - match.distance),
-                url=f"https://stackoverflow.com/questions/{match.id}",
+                distance=distance,
+                url=f"https://stackoverflow.com/questions/{id}",
             )
-            for item, match in zip(items, matches)
+            for item, id, distance in zip(items, ids.tolist(), distances.tolist())
         ]
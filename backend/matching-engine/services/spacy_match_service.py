@@ -12,20 +12,22 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import random
 from typing import List, Optional
 
 import numpy as np
-import spacy
 from google.cloud.aiplatform.matching_engine import matching_engine_index_endpoint
 
+import corpus_helper
+import model_helper
 import tracer_helper
 from services.match_service import (
     CodeInfo,
     Item,
     MatchResult,
     VertexAIMatchingEngineMatchService,
+    get_item_rows,
 )
+from services.suggestion_pool import SuggestionPool
 
 tracer = tracer_helper.get_tracer(__name__)
 
@@ -70,11 +72,14 @@ class SpacyTextMatchService(VertexAIMatchingEngineMatchService[str]):
         self._description = description
         self._code_info = code_info
 
-        with open(words_file, "r") as f:
-            words = f.readlines()
-            self.words = [word.strip() for word in words]
+        self.suggestion_pool = SuggestionPool(
+            (
+                corpus_helper.load_corpus(words_file),
+                lambda word: Item(id=word, text=word, image=None),
+            )
+        )
 
-        self.nlp = spacy.load("en_core_web_md")
+        self.nlp = model_helper.get_spacy_model("en_core_web_md")
 
         self.index_endpoint = (
             matching_engine_index_endpoint.MatchingEngineIndexEndpoint(
@@ -83,14 +88,6 @@ class SpacyTextMatchService(VertexAIMatchingEngineMatchService[str]):
         )
         self.deployed_index_id = deployed_index_id
 
-    @tracer.start_as_current_span("get_suggestions")
-    def get_suggestions(self, num_items: int = 60) -> List[Item]:
-        """Get suggestions for search queries."""
-        return random.sample(
-            [Item(id=word, text=word, image=None) for word in self.words],
-            min(num_items, len(self.words)),
-        )
-
     @tracer.start_as_current_span("get_by_id")
     def get_by_id(self, id: str) -> Optional[str]:
         """Get an item by id."""
@@ -107,12 +104,12 @@ class SpacyTextMatchService(VertexAIMatchingEngineMatchService[str]):
 
     @tracer.start_as_current_span("convert_match_neighbors_to_result")
     def convert_match_neighbors_to_result(
-        self, matches: List[matching_engine_index_endpoint.MatchNeighbor]
-    ) -> List[Optional[MatchResult]]:
-        items = [self.get_by_id(match.id) for match in matches]
+        self, ids: np.ndarray, distances: np.ndarray
+    ) -> List[MatchResult]:
+        items = [self.get_by_id(id) for id in ids.tolist()]
+        distance_values = distances.tolist()
+
         return [
-            MatchResult(title=item, distance=match.distance)
-            if item is not None
-            else None
-            for item, match in zip(items, matches)
+            MatchResult(title=items[row], distance=distance_values[row])
+            for row in get_item_rows(items)
         ]
@@ -0,0 +1,92 @@
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bisect
+import dataclasses
+import json
+import random
+import time
+from typing import Callable, Dict, Generic, List, Sequence, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# How long a serialized sample is served before a new one is drawn.
+DEFAULT_ROTATION_INTERVAL_SECONDS = 10.0
+
+
+class SuggestionPool(Generic[T]):
+    """An immutable pool of suggestion items.
+
+    The pool is made of one or more sources, each a sequence of entries (such
+    as a memory-mapped corpus) and a factory that turns an entry into an item.
+    Sampling draws k indices and only builds items for those, and serialized
+    responses are cached per sample size until the rotation interval elapses.
+    """
+
+    def __init__(
+        self,
+        *sources: Tuple[Sequence[str], Callable[[str], T]],
+        rotation_interval_seconds: float = DEFAULT_ROTATION_INTERVAL_SECONDS,
+    ) -> None:
+        self._sources = tuple(sources)
+        self._rotation_interval_seconds = rotation_interval_seconds
+
+        # Cumulative end index of each source, used to map a pool index to a source
+        self._source_ends: List[int] = []
+        total = 0
+        for entries, _ in self._sources:
+            total += len(entries)
+            self._source_ends.append(total)
+
+        # Maps the sample size to (expiry time, serialized response)
+        self._serialized_samples: Dict[int, Tuple[float, bytes]] = {}
+
+    def __len__(self) -> int:
+        return self._source_ends[-1] if self._source_ends else 0
+
+    def _get_item(self, index: int) -> T:
+        source_index = bisect.bisect_right(self._source_ends, index)
+        source_start = self._source_ends[source_index - 1] if source_index > 0 else 0
+        entries, item_factory = self._sources[source_index]
+
+        return item_factory(entries[index - source_start])
+
+    def sample(self, num_items: int) -> List[T]:
+        """Sample up to num_items distinct items from the pool."""
+        indices = random.sample(range(len(self)), min(num_items, len(self)))
+        return [self._get_item(index) for index in indices]
+
+    def get_serialized_sample(self, num_items: int) -> bytes:
+        """Get a JSON encoded `{"items": [...]}` response body for a sample.
+
+        The same body is returned until the rotation interval elapses, after
+        which a new sample is drawn and serialized.
+        """
+        now = time.monotonic()
+        cached = self._serialized_samples.get(num_items)
+
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        body = json.dumps(
+            {"items": [dataclasses.asdict(item) for item in self.sample(num_items)]}
+        ).encode("utf-8")
+
+        # A single assignment, so concurrent readers see either sample
+        self._serialized_samples[num_items] = (
+            now + self._rotation_interval_seconds,
+            body,
+        )
+
+        return body
@@ -12,21 +12,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import random
 from typing import List, Optional
 
 import numpy as np
 import torch
 from google.cloud.aiplatform.matching_engine import matching_engine_index_endpoint
-from transformers import CLIPModel, CLIPTokenizerFast
 
+import corpus_helper
+import model_helper
 import tracer_helper
 from services.match_service import (
     CodeInfo,
     Item,
     MatchResult,
     VertexAIMatchingEngineMatchService,
+    get_item_rows,
 )
+from services.suggestion_pool import SuggestionPool
 
 tracer = tracer_helper.get_tracer(__name__)
 
@@ -74,9 +76,12 @@ class TextToImageMatchService(VertexAIMatchingEngineMatchService[str]):
         self.image_directory_uri = image_directory_uri
         self._code_info = code_info
 
-        with open(prompts_file, "r") as f:
-            prompts = f.readlines()
-            self.prompts = [prompt.strip() for prompt in prompts]
+        self.suggestion_pool = SuggestionPool(
+            (
+                corpus_helper.load_corpus(prompts_file),
+                lambda prompt: Item(id=prompt, text=prompt, image=None),
+            )
+        )
 
         self.index_endpoint = (
             matching_engine_index_endpoint.MatchingEngineIndexEndpoint(
@@ -93,17 +98,13 @@ class TextToImageMatchService(VertexAIMatchingEngineMatchService[str]):
         )
 
         # we initialize a tokenizer, image processor, and the model itself
-        self.tokenizer = CLIPTokenizerFast.from_pretrained(model_id_or_path)
-        # self.processor = CLIPProcessor.from_pretrained(model_id)
-        self.model = CLIPModel.from_pretrained(model_id_or_path).to(self.device)
-
-    @tracer.start_as_current_span("get_suggestions")
-    def get_suggestions(self, num_items: int = 60) -> List[Item]:
-        """Get suggestions for search queries."""
-        return random.sample(
-            [Item(id=word, text=word, image=None) for word in self.prompts],
-            min(num_items, len(self.prompts)),
+        # The CPU model is shared with other workers if preloaded
+        tokenizer, model = model_helper.get_clip_model(
+            model_id_or_path, device=self.device
         )
+        self.tokenizer = tokenizer
+        # self.processor = CLIPProcessor.from_pretrained(model_id)
+        self.model = model
 
     @tracer.start_as_current_span("get_by_id")
     def get_by_id(self, id: str) -> Optional[str]:
@@ -126,12 +127,12 @@ class TextToImageMatchService(VertexAIMatchingEngineMatchService[str]):
 
     @tracer.start_as_current_span("convert_match_neighbors_to_result")
     def convert_match_neighbors_to_result(
-        self, matches: List[matching_engine_index_endpoint.MatchNeighbor]
-    ) -> List[Optional[MatchResult]]:
-        items = [self.get_by_id(match.id) for match in matches]
+        self, ids: np.ndarray, distances: np.ndarray
+    ) -> List[MatchResult]:
+        items = [self.get_by_id(id) for id in ids.tolist()]
+        distance_values = distances.tolist()
+
         return [
-            MatchResult(title=None, distance=match.distance, image=item)
-            if item is not None
-            else None
-            for item, match in zip(items, matches)
+            MatchResult(title=None, distance=distance_values[row], image=items[row])
+            for row in get_item_rows(items)
         ]
@@ -1,8 +1,36 @@
+"""Uploads to Cloud Storage, through a long-lived pooled client.
+
+Creating a storage client means new credentials, a new HTTP session and new
+connections, so every process shares one client. Large files are uploaded in
+parallel chunks. Uploads can run in the background, so a request that only
+needs a copy of a file in the bucket doesn't wait for it.
+
+LocalStorageBackend writes to a directory instead of a bucket, for tests and
+local development.
+"""
+
+import abc
+import concurrent.futures
+import functools
+import logging
+import os
+import shutil
+import uuid
 from pathlib import Path
 from typing import Optional, Tuple
 
 from google.cloud import storage
-import os
+
+logger = logging.getLogger(__name__)
+
+# Files from this size are uploaded in parallel chunks
+PARALLEL_UPLOAD_THRESHOLD_BYTES = 32 * 1024 * 1024
+PARALLEL_UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+PARALLEL_UPLOAD_WORKERS = 8
+
+_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=4, thread_name_prefix="storage_upload"
+)
 
 
 def extract_bucket_and_prefix_from_gcs_path(gcs_path: str) -> Tuple[str, Optional[str]]:
@@ -39,19 +67,98 @@ def extract_bucket_and_prefix_from_gcs_path(gcs_path: str) -> Tuple[str, Optiona
     return (gcs_bucket, gcs_blob_prefix)
 
 
-def upload_blob(source_file_name: str, bucket_name: str, destination_blob_name: str):
-    """Uploads a file to the bucket."""
+@functools.lru_cache(maxsize=None)
+def get_storage_client() -> storage.Client:
+    """Get the storage client shared by the process.
+
+    The client is created on first use, so gunicorn workers each create their
+    own after being forked.
+    """
+    return storage.Client()
+
+
+class StorageBackend(abc.ABC):
+    """Stores files under a destination name, e.g. a bucket."""
+
+    @abc.abstractmethod
+    def upload(self, source_file_name: str, destination_name: str) -> str:
+        """Upload a file and get its uri."""
+        pass
+
+    def upload_async(
+        self, source_file_name: str, destination_name: str
+    ) -> "concurrent.futures.Future[str]":
+        """Upload a file in the background.
+
+        The file may be deleted as soon as this returns, e.g. when it is a
+        temporary file of the request: the upload reads from a hard link to it,
+        which is removed once the upload is done.
+
+        Returns:
+            concurrent.futures.Future[str]: The uri of the uploaded file.
+        """
+        link_path = f"{source_file_name}.{uuid.uuid4().hex}.upload"
+        try:
+            os.link(source_file_name, link_path)
+        except OSError:
+            # Hard links are not supported everywhere, so fall back to a copy
+            shutil.copyfile(source_file_name, link_path)
+
+        def upload() -> str:
+            try:
+                return self.upload(link_path, destination_name)
+            except Exception as ex:
+                logger.error(f"Error uploading {destination_name}: {ex}")
+                raise
+            finally:
+                os.unlink(link_path)
+
+        return _executor.submit(upload)
+
+
+class GCSStorageBackend(StorageBackend):
+    def __init__(self, bucket_name: str) -> None:
+        self.bucket_name = bucket_name
+
+    def upload(self, source_file_name: str, destination_name: str) -> str:
+        bucket_name, blob_name = extract_bucket_and_prefix_from_gcs_path(
+            f"{self.bucket_name}/{destination_name}"
+        )
+        blob = get_storage_client().bucket(bucket_name).blob(blob_name)
+
+        if os.path.getsize(source_file_name) >= PARALLEL_UPLOAD_THRESHOLD_BYTES:
+            from google.cloud.storage import transfer_manager
+
+            transfer_manager.upload_chunks_concurrently(
+                source_file_name,
+                blob,
+                chunk_size=PARALLEL_UPLOAD_CHUNK_BYTES,
+                max_workers=PARALLEL_UPLOAD_WORKERS,
+            )
+        else:
+            # Files over 8 MB are sent as resumable uploads by the client
+            blob.upload_from_filename(source_file_name)
+
+        return os.path.join("gs://", bucket_name, blob_name or "")
 
-    bucket_name, blob_name = extract_bucket_and_prefix_from_gcs_path(
-        f"{bucket_name}/{destination_blob_name}/{Path(source_file_name).stem}"
-    )
 
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(blob_name)
+class LocalStorageBackend(StorageBackend):
+    """Stores files in a local directory, as a stand-in for a bucket."""
 
-    blob.upload_from_filename(source_file_name)
+    def __init__(self, root_dir: str) -> None:
+        self.root_dir = root_dir
 
-    destination_file_name = os.path.join("gs://", bucket_name, blob_name or "")
+    def upload(self, source_file_name: str, destination_name: str) -> str:
+        destination_path = os.path.join(self.root_dir, destination_name)
+        os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+        shutil.copyfile(source_file_name, destination_path)
 
-    return destination_file_name
+        return Path(os.path.abspath(destination_path)).as_uri()
+
+
+def upload_blob(source_file_name: str, bucket_name: str, destination_blob_name: str):
+    """Uploads a file to the bucket."""
+    return GCSStorageBackend(bucket_name).upload(
+        source_file_name,
+        destination_name=f"{destination_blob_name}/{Path(source_file_name).stem}",
+    )
@@ -0,0 +1,41 @@
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+import corpus_helper
+
+
+def test_load_corpus_matches_text_file(tmp_path):
+    text_file = tmp_path / "words.txt"
+    text_file.write_text("hello\n  wörld  \n\nlast line\n", encoding="utf-8")
+
+    corpus = corpus_helper.load_corpus(str(text_file))
+
+    assert len(corpus) == 4, "Unexpected number of entries"
+    assert list(corpus) == ["hello", "wörld", "", "last line"]
+    assert corpus[-1] == "last line", "Negative indexing failed"
+    assert corpus[1:3] == ["wörld", ""], "Slicing failed"
+
+
+def test_load_corpus_recompiles_stale_file(tmp_path):
+    text_file = tmp_path / "words.txt"
+    text_file.write_text("old\n", encoding="utf-8")
+    corpus_helper.load_corpus(str(text_file))
+
+    text_file.write_text("new\nentries\n", encoding="utf-8")
+    # Make the compiled corpus older than the text file
+    os.utime(corpus_helper.get_corpus_path(str(text_file)), (0, 0))
+
+    assert list(corpus_helper.load_corpus(str(text_file))) == ["new", "entries"]
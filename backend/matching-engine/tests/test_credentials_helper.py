@@ -0,0 +1,76 @@
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import concurrent.futures
+import datetime
+import threading
+import time
+
+import pytest
+
+import credentials_helper
+
+
+class FakeTokenProvider:
+    def __init__(self, lifetime_seconds, fetch_seconds=0.0):
+        self.lifetime_seconds = lifetime_seconds
+        self.fetch_seconds = fetch_seconds
+        self.fetches = 0
+        self.fail = False
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        time.sleep(self.fetch_seconds)
+        if self.fail:
+            raise RuntimeError("Token endpoint down")
+
+        with self._lock:
+            self.fetches += 1
+            expiry = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
+                seconds=self.lifetime_seconds
+            )
+            return f"token-{self.fetches}", expiry
+
+
+def test_concurrent_callers_share_one_fetch():
+    provider = FakeTokenProvider(lifetime_seconds=3600, fetch_seconds=0.05)
+    token_cache = credentials_helper.TokenCache(provider)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
+        tokens = list(executor.map(lambda _: token_cache.get_token(), range(64)))
+
+    assert set(tokens) == {"token-1"}
+    assert provider.fetches == 1
+
+
+def test_token_is_refreshed_in_background_before_expiry():
+    provider = FakeTokenProvider(lifetime_seconds=0.4, fetch_seconds=0.05)
+    token_cache = credentials_helper.TokenCache(provider, refresh_margin_seconds=0.3)
+    assert token_cache.get_token() == "token-1"
+
+    time.sleep(0.3)
+    start = time.monotonic()
+    token = token_cache.get_token()
+
+    assert token == "token-2"
+    assert time.monotonic() - start < 0.01, "Request waited for the refresh"
+
+
+def test_failing_provider_raises_once_token_expired():
+    provider = FakeTokenProvider(lifetime_seconds=0.1)
+    provider.fail = True
+    token_cache = credentials_helper.TokenCache(provider, fetch_timeout_seconds=1)
+
+    with pytest.raises(RuntimeError):
+        token_cache.get_token()
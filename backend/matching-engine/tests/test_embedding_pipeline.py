@@ -0,0 +1,82 @@
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import glob
+import json
+import os
+
+import numpy as np
+import pytest
+
+import build_local_index
+import embedding_pipeline
+from services import local_index
+
+
+def embed(texts):
+    # Fails to embed the items ending in 7
+    return [
+        None if text.endswith("7") else [float(len(text)), float(text[-1])]
+        for text in texts
+    ]
+
+
+def test_pipeline_resumes_after_crash(tmp_path):
+    input_file = tmp_path / "items.jsonl"
+    input_file.write_text(
+        "".join(
+            json.dumps({"id": i, "text": f"text {i}", "category": i % 3}) + "\n"
+            for i in range(100)
+        )
+    )
+    output_dir = str(tmp_path / "output")
+
+    def crash_after_50(texts):
+        if texts[0] == "text 50":
+            raise RuntimeError("Crashed")
+        return embed(texts)
+
+    with pytest.raises(RuntimeError):
+        embedding_pipeline.run(
+            embedding_pipeline.read_items([str(input_file)], "text"),
+            embed_batch=crash_after_50,
+            output_dir=output_dir,
+            batch_size=5,
+            shard_size=20,
+        )
+
+    stats = embedding_pipeline.run(
+        embedding_pipeline.read_items([str(input_file)], "text"),
+        embed_batch=embed,
+        output_dir=output_dir,
+        batch_size=5,
+        shard_size=20,
+    )
+
+    # The first two shards were checkpointed before the crash
+    assert stats.items_done == 60
+    assert stats.items_failed == 6
+
+    shard_files = sorted(glob.glob(os.path.join(output_dir, "shard-*.npy")))
+    assert len(shard_files) == 5
+    records = list(build_local_index.read_records(shard_files))
+
+    assert [record.id for record in records] == [
+        str(i) for i in range(100) if i % 10 != 7
+    ]
+    assert records[1].metadata == {"category": 1}
+    assert np.load(shard_files[0]).dtype == np.float32
+
+    index = local_index.build(str(tmp_path / "index"), iter(records), dimensions=2)
+    assert index.count == 90
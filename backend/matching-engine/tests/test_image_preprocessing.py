@@ -0,0 +1,43 @@
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+
+import numpy as np
+from PIL import Image
+
+from services import image_preprocessing
+
+
+def test_image_is_downscaled_rotated_and_stripped():
+    pixels = np.random.default_rng(0).integers(256, size=(1200, 1600, 3), dtype=np.uint8)
+    exif = Image.Exif()
+    # Rotated 90 degrees, as phone cameras store portrait photos
+    exif[0x0112] = 6
+    output = io.BytesIO()
+    Image.fromarray(pixels).save(output, format="JPEG", quality=95, exif=exif)
+
+    preprocessed = image_preprocessing.submit_preprocess_image_bytes(
+        output.getvalue()
+    ).result()
+
+    assert len(preprocessed) < len(output.getvalue())
+    with Image.open(io.BytesIO(preprocessed)) as image:
+        assert image.size == (384, 512)
+        assert image.mode == "RGB"
+        assert 0x0112 not in image.getexif()
+
+
+def test_undecodable_image_is_sent_as_is():
+    assert image_preprocessing.preprocess_image_bytes(b"not an image") == b"not an image"
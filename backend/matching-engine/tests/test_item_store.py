@@ -0,0 +1,116 @@
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+from services import item_store
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.ids = []
+
+    def hgetall(self, id):
+        self.ids.append(id)
+
+    def execute(self):
+        time.sleep(self.client.delay_seconds)
+        self.client.round_trips += 1
+        return [
+            {key.encode(): value.encode() for key, value in self.client.data.get(id, {}).items()}
+            for id in self.ids
+        ]
+
+
+class FakeRedis:
+    def __init__(self, data, delay_seconds=0.0):
+        self.data = data
+        self.delay_seconds = delay_seconds
+        self.round_trips = 0
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+def test_get_many_reads_through_cache():
+    client = FakeRedis({"1": {"title": "one"}, "2": {"title": "two"}})
+    store = item_store.RedisItemStore(client)
+
+    assert store.get_many(["1", "2", "3"]) == [{"title": "one"}, {"title": "two"}, {}]
+    assert store.get_many(["1", "2"]) == [{"title": "one"}, {"title": "two"}]
+    assert client.round_trips == 1, "Cached items were fetched again"
+
+
+def test_get_many_returns_none_for_slow_items():
+    client = FakeRedis({"1": {"title": "one"}}, delay_seconds=0.5)
+    store = item_store.RedisItemStore(client, hydration_timeout_seconds=0.05)
+
+    assert store.get_many(["1"]) == [None]
+
+    # The late response still fills the cache
+    time.sleep(0.6)
+    assert store.get_many(["1"]) == [{"title": "one"}]
+
+
+def test_get_many_skips_fetches_once_workers_are_busy(monkeypatch):
+    monkeypatch.setattr(item_store, "_fetch_slots", threading.BoundedSemaphore(2))
+    client = FakeRedis({"1": {"title": "one"}}, delay_seconds=0.3)
+    store = item_store.RedisItemStore(client, hydration_timeout_seconds=0.05)
+
+    # Both fetches time out, but keep running in the background
+    assert store.get_many(["1"]) == [None]
+    assert store.get_many(["1"]) == [None]
+
+    start = time.monotonic()
+    assert store.get_many(["2"]) == [None]
+    assert time.monotonic() - start < 0.05, "Waited for a busy fetch slot"
+
+    time.sleep(0.4)
+    assert client.round_trips == 2, "A fetch was queued behind busy workers"
+    assert store.get_many(["1"]) == [{"title": "one"}]
+
+    # Completed fetches free their slots
+    store.get_many(["2"])
+    time.sleep(0.4)
+    assert client.round_trips == 3
+
+
+def test_cache_is_bounded_by_size():
+    cache = item_store.SizedLRUCache(max_bytes=2000)
+
+    for i in range(100):
+        cache.put(str(i), {"title": "x" * 100})
+
+    assert cache.size_bytes <= 2000
+    assert cache.get("99") is not None and cache.get("0") is None
+
+
+def test_popular_items_survive_a_scan():
+    cache = item_store.TinyLFUCache(max_bytes=50000)
+    item = {"title": "x" * 100}
+
+    for _ in range(5):
+        for i in range(20):
+            if cache.get(f"popular{i}") is None:
+                cache.put(f"popular{i}", item)
+
+    # Many items that are only seen once
+    for i in range(1000):
+        cache.get(f"once{i}")
+        cache.put(f"once{i}", item)
+
+    assert all(cache.get(f"popular{i}") is not None for i in range(20))
+    assert cache.size_bytes <= 50000
@@ -0,0 +1,103 @@
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+from services import local_index
+
+
+def make_records(vectors, prefix="item"):
+    return [
+        local_index.Record(id=f"{prefix}{i}", embedding=vector, metadata={"row": i})
+        for i, vector in enumerate(vectors)
+    ]
+
+
+@pytest.mark.parametrize(
+    "index_type", [local_index.INDEX_TYPE_FLAT, local_index.INDEX_TYPE_IVF]
+)
+@pytest.mark.parametrize(
+    "distance_measure",
+    [local_index.DOT_PRODUCT_DISTANCE, local_index.SQUARED_L2_DISTANCE],
+)
+def test_search_matches_brute_force(tmp_path, index_type, distance_measure):
+    vectors = np.random.default_rng(0).normal(size=(500, 16)).astype(np.float32)
+    index = local_index.build(
+        str(tmp_path),
+        make_records(vectors),
+        dimensions=16,
+        distance_measure=distance_measure,
+        index_type=index_type,
+        num_lists=4,
+        chunk_size=64,
+    )
+    # Probe every list, so IVF results are exact too
+    index.num_probes = 4
+
+    query = vectors[7] + 0.01
+    if distance_measure == local_index.DOT_PRODUCT_DISTANCE:
+        expected = np.argsort(-(vectors @ query))[:5]
+    else:
+        expected = np.argsort(((vectors - query) ** 2).sum(axis=1))[:5]
+
+    neighbors = index.search(query, num_neighbors=5)
+
+    assert [neighbor.id for neighbor in neighbors] == [f"item{i}" for i in expected]
+    assert neighbors[0].metadata == {"row": int(expected[0])}
+
+
+def test_upsert_delete_and_compact(tmp_path):
+    vectors = np.eye(8, dtype=np.float32)
+    local_index.build(str(tmp_path), make_records(vectors), dimensions=8)
+    reloading_index = local_index.ReloadingLocalIndex(
+        str(tmp_path), check_interval_seconds=0
+    )
+
+    local_index.upsert(
+        str(tmp_path), [local_index.Record(id="item0", embedding=vectors[1] * 2)]
+    )
+    index = local_index.delete(str(tmp_path), ["item1"])
+
+    assert index.count == 7
+    assert reloading_index.count == 7, "Index was not reloaded"
+    neighbor_ids = [neighbor.id for neighbor in reloading_index.search(vectors[1], 3)]
+    assert neighbor_ids[0] == "item0", "Upserted record not found"
+    assert "item1" not in neighbor_ids, "Deleted record found"
+
+    compacted = local_index.compact(str(tmp_path))
+
+    assert compacted.delta is None
+    assert compacted.count == 7
+    assert compacted.search(vectors[1], 1)[0].id == "item0"
+
+
+@pytest.mark.parametrize("storage", [local_index.STORAGE_INT8, local_index.STORAGE_PQ])
+def test_compressed_storage_rescores_exactly(tmp_path, storage):
+    vectors = np.random.default_rng(0).normal(size=(1000, 32)).astype(np.float32)
+    index = local_index.build(
+        str(tmp_path),
+        make_records(vectors),
+        dimensions=32,
+        distance_measure=local_index.SQUARED_L2_DISTANCE,
+        storage=storage,
+        pq_subspaces=8,
+    )
+    query = vectors[42] + 0.01
+
+    neighbors = index.search(query, num_neighbors=3)
+
+    assert neighbors[0].id == "item42"
+    # Distances are re-scored against the float32 rows
+    assert neighbors[0].distance == pytest.approx(32 * 0.01**2, rel=1e-3)
@@ -0,0 +1,98 @@
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import importlib
+import sys
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import constants
+import register_services
+import resilience_helper
+
+
+class HungService:
+    """Matches through a backend whose calls never complete in time."""
+
+    id = "hung"
+
+    def __init__(self) -> None:
+        self.backend = resilience_helper.ResilientBackend(
+            "hung",
+            default_timeout_seconds=constants.REQUEST_TIMEOUT_SECONDS,
+            failure_threshold=2,
+        )
+
+    def match_by_text(self, target: str, num_neighbors: int):
+        return self.backend.call(lambda timeout: time.sleep(1))
+
+    def get_total_index_count(self) -> int:
+        return 0
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(constants, "REQUEST_TIMEOUT_SECONDS", 0.1)
+    # Don't register the services calling live endpoints
+    monkeypatch.setattr(register_services, "register_services", lambda: {})
+    monkeypatch.delitem(sys.modules, "main", raising=False)
+    main = importlib.import_module("main")
+
+    service = HungService()
+    main.match_service_registry[service.id] = service
+
+    yield service, TestClient(main.app)
+
+    # Later imports get the app with the real services
+    sys.modules.pop("main", None)
+
+
+def test_server_timeouts_open_circuit(service):
+    service, client = service
+
+    for _ in range(2):
+        response = client.post("/match-by-text/hung", json={"text": "cat"})
+        assert response.status_code == 504
+
+    response = client.post("/match-by-text/hung", json={"text": "cat"})
+    assert response.status_code == 503
+
+
+def test_client_timeouts_do_not_open_circuit(service):
+    service, client = service
+
+    for _ in range(3):
+        response = client.post(
+            "/match-by-text/hung",
+            json={"text": "cat"},
+            headers={"X-Request-Timeout": "0.05"},
+        )
+        assert response.status_code == 504
+
+    assert (
+        service.backend.circuit_breaker.state
+        == resilience_helper.CircuitBreaker.CLOSED
+    )
+    # A header longer than the server's timeout is not a client deadline
+    for _ in range(2):
+        client.post(
+            "/match-by-text/hung",
+            json={"text": "cat"},
+            headers={"X-Request-Timeout": "60"},
+        )
+    assert (
+        service.backend.circuit_breaker.state == resilience_helper.CircuitBreaker.OPEN
+    )
@@ -0,0 +1,199 @@
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import threading
+from typing import List, Optional
+
+import resilience_helper
+from services import multi_match
+from services.match_service import MatchResult, VertexAIMatchingEngineMatchService
+
+
+class FakeEmbeddingService(VertexAIMatchingEngineMatchService):
+    """Counts embedding calls and matches without a remote index."""
+
+    def __init__(
+        self,
+        id: str,
+        embedding_model_id: Optional[str],
+        allows_text_input: bool = True,
+        allows_image_input: bool = True,
+    ) -> None:
+        self._id = id
+        self._embedding_model_id = embedding_model_id
+        self._allows_text_input = allows_text_input
+        self._allows_image_input = allows_image_input
+        self.embedding_calls: List[str] = []
+        self._lock = threading.Lock()
+
+    @property
+    def id(self) -> str:
+        return self._id
+
+    @property
+    def name(self) -> str:
+        return self._id
+
+    @property
+    def description(self) -> str:
+        return ""
+
+    @property
+    def allows_text_input(self) -> bool:
+        return self._allows_text_input
+
+    @property
+    def allows_image_input(self) -> bool:
+        return self._allows_image_input
+
+    @property
+    def embedding_model_id(self) -> Optional[str]:
+        return self._embedding_model_id
+
+    def get_suggestions(self, num_items: int = 60):
+        return []
+
+    def get_by_id(self, id: str):
+        return None
+
+    def convert_match_neighbors_to_result(self, ids, distances):
+        return []
+
+    def convert_text_to_embeddings(self, target: str) -> Optional[List[float]]:
+        with self._lock:
+            self.embedding_calls.append(f"text:{target}")
+        return [float(len(target))]
+
+    def convert_image_to_embeddings_remote(
+        self, image_file_remote_path: str
+    ) -> Optional[List[float]]:
+        with self._lock:
+            self.embedding_calls.append(f"image:{image_file_remote_path}")
+        return [0.0]
+
+    def match_by_embeddings(
+        self, embeddings: List[float], num_neighbors: int
+    ) -> List[MatchResult]:
+        return [
+            MatchResult(title=f"{self.id}:{embeddings[0]}", distance=0.0)
+            for _ in range(num_neighbors)
+        ]
+
+    def get_total_index_count(self) -> int:
+        return 10
+
+
+def get_embeddings(embeddings_cache, requests):
+    async def run():
+        return await asyncio.gather(
+            *[
+                embeddings_cache.get(service, input_type, target)
+                for service, input_type, target in requests
+            ]
+        )
+
+    return asyncio.run(run())
+
+
+def test_embeddings_cache_shares_calls_of_the_same_model_and_input():
+    first = FakeEmbeddingService("first", embedding_model_id="model")
+    second = FakeEmbeddingService("second", embedding_model_id="model")
+    embeddings_cache = multi_match._EmbeddingsCache()
+
+    embeddings = get_embeddings(
+        embeddings_cache,
+        [
+            (first, multi_match.INPUT_TYPE_TEXT, "cat"),
+            (second, multi_match.INPUT_TYPE_TEXT, "cat"),
+        ],
+    )
+
+    assert embeddings == [[3.0], [3.0]]
+    assert first.embedding_calls + second.embedding_calls == ["text:cat"]
+
+
+def test_embeddings_cache_keys_on_model_input_type_and_target():
+    first = FakeEmbeddingService("first", embedding_model_id="model")
+    other_model = FakeEmbeddingService("other_model", embedding_model_id="other")
+    embeddings_cache = multi_match._EmbeddingsCache()
+
+    get_embeddings(
+        embeddings_cache,
+        [
+            (first, multi_match.INPUT_TYPE_TEXT, "cat"),
+            (first, multi_match.INPUT_TYPE_TEXT, "dog"),
+            (first, multi_match.INPUT_TYPE_IMAGE_URL, "cat"),
+            (other_model, multi_match.INPUT_TYPE_TEXT, "cat"),
+        ],
+    )
+
+    assert first.embedding_calls == ["text:cat", "text:dog", "image:cat"]
+    assert other_model.embedding_calls == ["text:cat"]
+
+
+def test_embeddings_cache_never_shares_services_without_model_id():
+    first = FakeEmbeddingService("first", embedding_model_id=None)
+    second = FakeEmbeddingService("second", embedding_model_id=None)
+    embeddings_cache = multi_match._EmbeddingsCache()
+
+    get_embeddings(
+        embeddings_cache,
+        [
+            (first, multi_match.INPUT_TYPE_TEXT, "cat"),
+            (second, multi_match.INPUT_TYPE_TEXT, "cat"),
+            (first, multi_match.INPUT_TYPE_TEXT, "cat"),
+        ],
+    )
+
+    assert first.embedding_calls == ["text:cat"]
+    assert second.embedding_calls == ["text:cat"]
+
+
+def test_match_multi_embeds_once_and_isolates_failures():
+    first = FakeEmbeddingService("first", embedding_model_id="model")
+    second = FakeEmbeddingService("second", embedding_model_id="model")
+    image_only = FakeEmbeddingService(
+        "image_only", embedding_model_id="model", allows_text_input=False
+    )
+    timed_out = FakeEmbeddingService("timed_out", embedding_model_id="slow")
+
+    def time_out(target):
+        raise resilience_helper.DeadlineExceeded("Deadline exceeded")
+
+    timed_out.convert_text_to_embeddings = time_out
+
+    service_matches = asyncio.run(
+        multi_match.match_multi(
+            [first, second, image_only, timed_out],
+            text="cat",
+            image_url=None,
+            num_neighbors=2,
+        )
+    )
+
+    assert [matches.service_id for matches in service_matches] == [
+        "first",
+        "second",
+        "image_only",
+        "timed_out",
+    ]
+    assert [result.title for result in service_matches[0].results] == [
+        "first:3.0",
+        "first:3.0",
+    ]
+    assert service_matches[1].total_index_count == 10
+    assert first.embedding_calls + second.embedding_calls == ["text:cat"]
+    assert "does not accept" in service_matches[2].error
+    assert service_matches[3].error == "Timed out getting matches"
@@ -0,0 +1,120 @@
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import concurrent.futures
+import time
+
+import pytest
+
+import resilience_helper
+from services import image_preprocessing, multimodal_embedding_client
+
+
+class FakePredictResponse:
+    def __init__(self, predictions):
+        self.predictions = predictions
+
+
+class FakePredictionServiceClient:
+    def __init__(self, client_options=None):
+        self.calls = []
+
+    def predict(self, endpoint, instances, timeout=None):
+        self.calls.append((time.monotonic(), len(instances)))
+
+        return FakePredictResponse(
+            [
+                {"textEmbedding": [float(instance.fields["text"].string_value)]}
+                for instance in instances
+            ]
+        )
+
+
+@pytest.fixture(autouse=True)
+def fake_prediction_service(monkeypatch):
+    monkeypatch.setattr(
+        multimodal_embedding_client.aiplatform.gapic,
+        "PredictionServiceClient",
+        FakePredictionServiceClient,
+    )
+
+
+def test_image_preprocessing_stops_at_timeout(monkeypatch, tmp_path):
+    image_file = tmp_path / "image.jpg"
+    image_file.write_bytes(b"image")
+    # Preprocessing never completes
+    monkeypatch.setattr(
+        image_preprocessing,
+        "submit_preprocess_image_bytes",
+        lambda image_bytes: concurrent.futures.Future(),
+    )
+    client = multimodal_embedding_client.MultimodalEmbeddingPredictionClient(
+        project_id="project"
+    )
+
+    start = time.monotonic()
+    with pytest.raises(resilience_helper.DeadlineExceeded):
+        client.get_embedding(image_file=str(image_file), timeout=0.1)
+
+    assert time.monotonic() - start < 0.5
+    assert client.client.calls == []
+
+
+def test_batch_is_split_into_requests_in_input_order():
+    client = multimodal_embedding_client.MultimodalEmbeddingPredictionClient(
+        project_id="project",
+        max_instances_per_request=3,
+        max_concurrent_requests=4,
+        requests_per_minute=60 * 1000,
+    )
+    predict = client.client.predict
+
+    def later_requests_finish_first(endpoint, instances, timeout=None):
+        first_value = float(instances[0].fields["text"].string_value)
+        time.sleep(0.05 * (1 - first_value / 10))
+        return predict(endpoint, instances, timeout)
+
+    client.client.predict = later_requests_finish_first
+
+    embedding_responses = client.get_embeddings_batch(
+        [(str(i), None) for i in range(10)]
+    )
+
+    assert sorted(size for _, size in client.client.calls) == [1, 3, 3, 3]
+    assert [
+        embedding_response.text_embedding
+        for embedding_response in embedding_responses
+    ] == [[float(i)] for i in range(10)]
+    assert all(
+        embedding_response.image_embedding is None
+        for embedding_response in embedding_responses
+    )
+
+
+def test_batch_requests_are_rate_limited():
+    client = multimodal_embedding_client.MultimodalEmbeddingPredictionClient(
+        project_id="project",
+        max_instances_per_request=1,
+        max_concurrent_requests=2,
+        requests_per_minute=60 * 20,
+    )
+
+    start = time.monotonic()
+    client.get_embeddings_batch([(str(i), None) for i in range(6)])
+
+    # A burst of 2 requests, then 4 more at 20 per second
+    assert time.monotonic() - start >= 0.15
+    call_times = sorted(call_time for call_time, _ in client.client.calls)
+    assert call_times[1] - call_times[0] < 0.05
+    assert call_times[-1] - call_times[0] >= 0.15
@@ -0,0 +1,133 @@
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+import threading
+import time
+
+import pytest
+
+import resilience_helper
+
+
+def test_call_stops_waiting_at_deadline():
+    backend = resilience_helper.ResilientBackend("slow")
+
+    start = time.monotonic()
+    with resilience_helper.deadline(0.1):
+        with pytest.raises(resilience_helper.DeadlineExceeded):
+            backend.call(lambda timeout: time.sleep(1))
+
+    assert time.monotonic() - start < 0.5, "Call was not abandoned at the deadline"
+
+
+def test_open_circuit_fails_fast_or_serves_cache():
+    backend = resilience_helper.ResilientBackend("flaky", failure_threshold=2)
+
+    def fail(timeout):
+        raise RuntimeError("Backend down")
+
+    assert backend.call(lambda timeout: "cached", cache_key="query") == "cached"
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            backend.call(fail, cache_key="other query")
+
+    assert backend.circuit_breaker.state == resilience_helper.CircuitBreaker.OPEN
+    assert backend.call(fail, cache_key="query") == "cached"
+    with pytest.raises(resilience_helper.CircuitOpenError):
+        backend.call(fail, cache_key="other query")
+
+
+def test_client_deadlines_do_not_open_circuit():
+    backend = resilience_helper.ResilientBackend("shared", failure_threshold=2)
+
+    for _ in range(5):
+        with resilience_helper.deadline(0.001, set_by_client=True):
+            with pytest.raises(resilience_helper.DeadlineExceeded):
+                backend.call(lambda timeout: time.sleep(0.1))
+
+    # An expired deadline fails before the call is made
+    with resilience_helper.deadline(0.001):
+        time.sleep(0.01)
+        with pytest.raises(resilience_helper.DeadlineExceeded):
+            backend.call(lambda timeout: pytest.fail("Call made after deadline"))
+
+    assert backend.circuit_breaker.state == resilience_helper.CircuitBreaker.CLOSED
+    assert backend.call(lambda timeout: "healthy") == "healthy"
+
+
+def test_server_deadlines_open_circuit():
+    backend = resilience_helper.ResilientBackend(
+        "hung", default_timeout_seconds=0.2, failure_threshold=2
+    )
+
+    for _ in range(2):
+        with resilience_helper.deadline(0.05):
+            with pytest.raises(resilience_helper.DeadlineExceeded):
+                backend.call(lambda timeout: time.sleep(0.1))
+
+    assert backend.circuit_breaker.state == resilience_helper.CircuitBreaker.OPEN
+
+
+def test_hung_calls_only_hold_their_backends_threads():
+    hung = resilience_helper.ResilientBackend(
+        "hung", default_timeout_seconds=0.05, max_concurrent_calls=2
+    )
+    healthy = resilience_helper.ResilientBackend("healthy", max_concurrent_calls=2)
+    release = threading.Event()
+
+    for _ in range(2):
+        with pytest.raises(resilience_helper.DeadlineExceeded):
+            hung.call(lambda timeout: release.wait(5))
+
+    start = time.monotonic()
+    with pytest.raises(resilience_helper.BackendBusyError):
+        hung.call(lambda timeout: "not called")
+    assert time.monotonic() - start < 0.05
+    assert healthy.call(lambda timeout: "healthy") == "healthy"
+
+    release.set()
+    time.sleep(0.05)
+    assert hung.call(lambda timeout: "recovered") == "recovered"
+
+
+def test_slow_call_is_hedged():
+    backend = resilience_helper.ResilientBackend("hedged")
+    for _ in range(resilience_helper.HEDGE_MIN_SAMPLES):
+        backend.latency_tracker.record(0.01)
+
+    calls = itertools.count()
+
+    def first_call_hangs(timeout):
+        if next(calls) == 0:
+            time.sleep(1)
+            return "slow"
+        return "fast"
+
+    start = time.monotonic()
+    assert backend.call(first_call_hangs, hedge=True) == "fast"
+    assert time.monotonic() - start < 0.5
+
+
+def test_rate_limiter_paces_calls_after_burst():
+    rate_limiter = resilience_helper.RateLimiter(rate_per_second=20, burst=2)
+
+    start = time.monotonic()
+    for _ in range(4):
+        rate_limiter.acquire()
+
+    # The burst is free, then calls are spaced 50 ms apart
+    assert 0.08 < time.monotonic() - start < 0.3
+    with pytest.raises(resilience_helper.DeadlineExceeded):
+        rate_limiter.acquire(timeout=0.01)
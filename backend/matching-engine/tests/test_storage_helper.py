@@ -0,0 +1,35 @@
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+
+import storage_helper
+
+
+def test_async_upload_outlives_temporary_file(tmp_path):
+    storage_backend = storage_helper.LocalStorageBackend(str(tmp_path / "bucket"))
+
+    with tempfile.NamedTemporaryFile(dir=tmp_path) as f:
+        f.write(b"image bytes")
+        f.flush()
+        upload = storage_backend.upload_async(f.name, "uploads/image")
+
+    uri = upload.result(timeout=5)
+
+    assert uri == (tmp_path / "bucket" / "uploads" / "image").as_uri()
+    assert (tmp_path / "bucket" / "uploads" / "image").read_bytes() == b"image bytes"
+    # Only the uploaded copy is left behind
+    assert os.listdir(tmp_path) == ["bucket"]
+
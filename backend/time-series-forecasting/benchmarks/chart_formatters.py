@@ -0,0 +1,140 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compare format_for_rechart with the previous per-series dict implementation.
+
+Each case is checked for identical output. Without a CSV file, the benchmark
+uses synthetic data the size of the Iowa liquor sales sample (12 series over a
+year, with several sales per series and day), and larger numbers of series:
+
+    python -m benchmarks.chart_formatters
+    python -m benchmarks.chart_formatters --csv sample_data/iowa_liquor_sales.csv \\
+        --time-series-identifier-column county_and_city --target-column sale_dollars
+"""
+
+import argparse
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+import chart_formatters
+
+
+def format_for_rechart_legacy(
+    time_series_identifier_column: str,
+    time_column: str,
+    target_column: str,
+    data: pd.DataFrame,
+):
+    data_grouped = data.groupby(time_series_identifier_column)
+
+    group_time_value_map = {
+        k: dict(zip(v[time_column].tolist(), v[target_column].tolist()))
+        for k, v in data_grouped
+    }
+
+    unique_times = sorted(list(set(data[time_column].tolist())))
+
+    data = [
+        {
+            "name": time.isoformat(),
+            **{
+                group: time_values_map.get(time)
+                for group, time_values_map in group_time_value_map.items()
+            },
+        }
+        for time in unique_times
+    ]
+
+    return (
+        data,
+        unique_times[0].isoformat() if len(unique_times) > 0 else None,
+        unique_times[-1].isoformat() if len(unique_times) > 0 else None,
+    )
+
+
+def make_dataset(num_series: int, num_days: int, rows_per_day: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    num_rows = num_series * num_days * rows_per_day
+    df = pd.DataFrame(
+        {
+            "date": pd.Timestamp("2020-01-01", tz="UTC")
+            + pd.to_timedelta(rng.integers(num_days, size=num_rows), unit="D"),
+            "series": [f"series {i}" for i in rng.integers(num_series, size=num_rows)],
+            "sales": rng.gamma(2, 500, size=num_rows).round(2),
+        }
+    )
+    return df.sort_values("date")
+
+
+def time_call(func: Callable[[], Any], repeat: int = 3) -> Tuple[Any, float]:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--csv", default=None)
+    parser.add_argument("--time-column", default="date")
+    parser.add_argument("--time-series-identifier-column", default="series")
+    parser.add_argument("--target-column", default="sales")
+    args = parser.parse_args()
+
+    cases: List[Tuple[str, pd.DataFrame]] = []
+    if args.csv:
+        df = pd.read_csv(args.csv)
+        df[args.time_column] = pd.to_datetime(df[args.time_column], utc=True)
+        cases.append((args.csv, df.sort_values(args.time_column)))
+    else:
+        for num_series, num_days, rows_per_day in [
+            (12, 366, 20),
+            (1000, 366, 1),
+            (5000, 366, 1),
+        ]:
+            cases.append(
+                (
+                    f"{num_series} series x {num_days} days",
+                    make_dataset(num_series, num_days, rows_per_day),
+                )
+            )
+
+    print(f"{'dataset':<28}{'rows':>10}{'legacy ms':>12}{'pivot ms':>12}{'speedup':>9}")
+    for name, df in cases:
+        kwargs: Dict[str, Any] = dict(
+            time_series_identifier_column=args.time_series_identifier_column,
+            time_column=args.time_column,
+            target_column=args.target_column,
+            data=df,
+        )
+        expected, legacy_seconds = time_call(lambda: format_for_rechart_legacy(**kwargs))
+        result, seconds = time_call(lambda: chart_formatters.format_for_rechart(**kwargs))
+
+        # Compared as text, so NaN values compare equal
+        if repr(result) != repr(expected):
+            raise AssertionError(f"Output differs from the legacy output for {name}")
+
+        print(
+            f"{name:<28}{len(df):>10}{legacy_seconds * 1000:>12.1f}"
+            f"{seconds * 1000:>12.1f}{legacy_seconds / seconds:>8.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measure how local forecasting scales with the number of worker processes.
+
+Synthetic daily series with a weekly season are forecast with each model and
+number of workers:
+
+    python -m benchmarks.local_forecasting --series 2000 --max-workers 1 2 4 8
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import local_forecasting
+
+
+def make_series(series: int, length: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    times = pd.date_range("2020-01-01", periods=length, freq="D", tz="UTC")
+    season = 10 * np.sin(np.arange(length) * 2 * np.pi / 7)
+    values = 100 + season + np.cumsum(rng.normal(size=(series, length)), axis=1)
+
+    return pd.DataFrame(
+        {
+            "series": np.repeat([f"series_{i}" for i in range(series)], length),
+            "time": np.tile(times, series),
+            "value": values.ravel(),
+        }
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--series", type=int, default=2000)
+    parser.add_argument("--length", type=int, default=200)
+    parser.add_argument("--horizon", type=int, default=30)
+    parser.add_argument(
+        "--models",
+        nargs="+",
+        default=[local_forecasting.MODEL_SEASONAL_NAIVE, local_forecasting.MODEL_ETS],
+        choices=list(local_forecasting.FORECASTERS),
+    )
+    parser.add_argument("--max-workers", nargs="+", type=int, default=[1, 2, 4])
+    args = parser.parse_args()
+
+    df = make_series(args.series, args.length)
+
+    for model in args.models:
+        for max_workers in args.max_workers:
+            start = time.perf_counter()
+            result = local_forecasting.forecast(
+                df,
+                time_series_identifier_column="series",
+                time_column="time",
+                target_column="value",
+                data_frequency="DAILY",
+                horizon=args.horizon,
+                model=model,
+                max_workers=max_workers,
+            )
+            seconds = time.perf_counter() - start
+
+            print(
+                f"{model:>15} {max_workers:>3} workers: {seconds:7.2f}s, "
+                f"{args.series / seconds:8.1f} series/sec, "
+                f"{result.prediction.num_rows} rows"
+            )
+
+
+if __name__ == "__main__":
+    main()
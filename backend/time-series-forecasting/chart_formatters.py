@@ -0,0 +1,261 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import constants
+from models import forecast_job_request
+from training_methods import training_method
+
+OUTPUT_TYPE_DATAGRID = "datagrid"
+OUTPUT_TYPE_CHARTJS = "chartjs"
+OUTPUT_TYPE_RECHARTS = "recharts"
+OUTPUT_TYPE_PLOTLY = "plotly"
+OUTPUT_TYPES = [
+    OUTPUT_TYPE_DATAGRID,
+    OUTPUT_TYPE_CHARTJS,
+    OUTPUT_TYPE_RECHARTS,
+    OUTPUT_TYPE_PLOTLY,
+]
+
+
+def format_for_plotly(
+    time_series_identifier_column: str,
+    time_column: str,
+    target_column: str,
+    data: pd.DataFrame,
+) -> List[Dict[str, Any]]:
+    data_grouped = data.sort_values([time_column]).groupby(
+        time_series_identifier_column
+    )
+
+    return [
+        {
+            "name": group,
+            "mode": "lines",
+            "x": data_for_group[time_column].tolist(),
+            "y": data_for_group[target_column].tolist(),
+        }
+        for (group, data_for_group) in data_grouped
+    ]
+
+
+def format_for_rechart(
+    time_series_identifier_column: str,
+    time_column: str,
+    target_column: str,
+    data: pd.DataFrame,
+) -> Tuple[
+    List[Dict[str, Any]], Optional[datetime.datetime], Optional[datetime.datetime]
+]:
+    """Format time series as one row per time, with a column per series.
+
+    The long frame is pivoted to a wide time x series matrix in one pass, which
+    is then converted to records at once.
+
+    Args:
+        time_series_identifier_column (str): The column identifying the series.
+        time_column (str): The time column.
+        target_column (str): The value column.
+        data (pd.DataFrame): The time series in long format.
+
+    Returns:
+        Tuple[List[Dict[str, Any]], Optional[datetime.datetime], Optional[datetime.datetime]]:
+            The rows, sorted by time, as {"name": time, series: value, ...}
+            with None for series without a value at that time. Then the first
+            and last times, as ISO strings.
+    """
+    # Sorted codes of every time, including those of rows without a series.
+    # Missing times and series get the code -1.
+    time_codes, unique_times = pd.factorize(data[time_column], sort=True)
+    group_codes, groups = pd.factorize(data[time_series_identifier_column], sort=True)
+
+    # Rows without a time or a series are left out, and the last value of a
+    # series at a given time wins
+    is_complete = (time_codes >= 0) & (group_codes >= 0)
+    time_codes = time_codes[is_complete]
+    group_codes = group_codes[is_complete]
+    values = data[target_column].to_numpy(dtype=object)[is_complete]
+
+    # Object values keep the Python types of the target column, and None marks
+    # missing values, rather than upcasting to float and NaN
+    wide = np.full((len(unique_times), len(groups)), None, dtype=object)
+    wide[time_codes, group_codes] = values
+
+    names = [time.isoformat() for time in unique_times]
+    df_wide = pd.DataFrame(wide, columns=groups.tolist())
+    df_wide.insert(0, "name", names)
+
+    return (
+        df_wide.to_dict(orient="records"),
+        names[0] if len(names) > 0 else None,
+        names[-1] if len(names) > 0 else None,
+    )
+
+
+def format_evaluation(evaluation: pd.DataFrame) -> Dict[str, Any]:
+    """Format an evaluation table for a data grid."""
+    evaluation = evaluation.fillna("")
+    evaluation["id"] = evaluation.index
+
+    columns = evaluation.columns.tolist()
+    for column in columns:
+        evaluation[column] = evaluation[column].apply(
+            lambda x: x.tolist() if isinstance(x, np.ndarray) else x
+        )
+
+    return {
+        "columns": columns,
+        "rows": evaluation.astype(str).to_dict(orient="records"),
+    }
+
+
+def format_prediction(
+    output_type: str,
+    job_request: forecast_job_request.ForecastJobRequest,
+    training_method: training_method.TrainingMethod,
+    df_history: pd.DataFrame,
+    df_prediction: pd.DataFrame,
+) -> Dict[str, Any]:
+    """Format a prediction, along with the history it follows, for a chart.
+
+    Args:
+        output_type (str): One of OUTPUT_TYPES.
+        job_request (forecast_job_request.ForecastJobRequest): The job request.
+        training_method (training_method.TrainingMethod): The job's training method.
+        df_history (pd.DataFrame): The full dataset.
+        df_prediction (pd.DataFrame): The prediction table.
+
+    Raises:
+        ValueError: If the output type is not supported.
+
+    Returns:
+        Dict[str, Any]: The payload for the output type.
+    """
+    # Format historical dataframe to match prediction dataframes, according to training method
+    history_time_series_identifier_column = (
+        training_method.dataset_time_series_identifier_column(job_request=job_request)
+    )
+    history_time_column = training_method.dataset_time_column(job_request=job_request)
+    history_target_column = training_method.dataset_target_column(
+        job_request=job_request
+    )
+
+    time_series_identifier_column = constants.FORECAST_TIME_SERIES_IDENTIFIER_COLUMN
+    time_column = constants.FORECAST_TIME_COLUMN
+    target_column = constants.FORECAST_TARGET_COLUMN
+
+    df_prediction = df_prediction.fillna("")
+    # TODO Move the next line to a better place :D
+    df_prediction[time_column] = pd.to_datetime(df_prediction[time_column])
+
+    if output_type == OUTPUT_TYPE_DATAGRID:
+        df_prediction["id"] = df_prediction.index
+
+        return {
+            "columns": df_prediction.columns.tolist(),
+            "rows": df_prediction.to_dict(orient="records"),
+        }
+    elif output_type == OUTPUT_TYPE_CHARTJS:
+
+        prediction_grouped = df_prediction.groupby(time_series_identifier_column)
+
+        group_time_value_map = {
+            k: dict(zip(v[time_column].tolist(), v[target_column].tolist()))
+            for k, v in prediction_grouped
+        }
+
+        unique_times = sorted(list(df_prediction[time_column].unique()))
+
+        datasets = [
+            {
+                "label": group,
+                "data": [time_values_map[time] for time in unique_times],
+            }
+            for group, time_values_map in group_time_value_map.items()
+        ]
+
+        return {
+            "timeLabels": unique_times,
+            "datasets": datasets,
+        }
+    elif output_type == OUTPUT_TYPE_RECHARTS:
+        history_formatted, _, history_max_date = format_for_rechart(
+            time_series_identifier_column=history_time_series_identifier_column,
+            time_column=history_time_column,
+            target_column=history_target_column,
+            data=df_history,
+        )
+
+        (predictions_formatted, _, _,) = format_for_rechart(
+            time_series_identifier_column=time_series_identifier_column,
+            time_column=time_column,
+            target_column=target_column,
+            data=df_prediction,
+        )
+
+        return {
+            "groups": df_prediction[time_series_identifier_column]
+            .unique()
+            .tolist(),
+            "data": history_formatted + predictions_formatted,
+            "historyMaxDate": history_max_date,  # The date separating history and prediction
+        }
+    elif output_type == OUTPUT_TYPE_PLOTLY:
+        column_map = {
+            job_request.model_parameters[
+                "timeSeriesIdentifierColumn"
+            ]: time_series_identifier_column,
+            job_request.model_parameters["timeColumn"]: time_column,
+            job_request.model_parameters["targetColumn"]: target_column,
+        }
+
+        df_history = df_history.rename(columns=column_map)
+
+        historical_time_values = df_history[time_column]
+        history_min_date = (
+            historical_time_values.min().isoformat()
+            if len(historical_time_values) > 0
+            else None
+        )
+        history_max_date = (
+            historical_time_values.max().isoformat()
+            if len(historical_time_values) > 0
+            else None
+        )
+
+        historicalBounds = None
+        if history_min_date is not None and history_max_date is not None:
+            historicalBounds = {"min": history_min_date, "max": history_max_date}
+
+        df_history = df_history.filter(column_map.values())
+        df_prediction = df_prediction.filter(column_map.values())
+
+        lines = format_for_plotly(
+            time_series_identifier_column=time_series_identifier_column,
+            time_column=time_column,
+            target_column=target_column,
+            data=pd.concat([df_history, df_prediction]),
+        )
+
+        return {
+            "lines": lines,
+            "historicalBounds": historicalBounds,
+        }
+    else:
+        raise ValueError(f"Unsupported output type: {output_type}")
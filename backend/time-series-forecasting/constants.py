@@ -12,9 +12,42 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import tempfile
+
 # Each forecast prediction must output a BigQuery destination table with the following columns
 FORECAST_TIME_SERIES_IDENTIFIER_COLUMN = "time_series_identifier"
 FORECAST_TIME_COLUMN = "time"
 FORECAST_TARGET_COLUMN = "target"
 FORECAST_TARGET_COLUMN_LOWER_BOUND = "target_column_lower_bound"
 FORECAST_TARGET_COLUMN_UPPER_BOUND = "target_column_upper_bound"
+
+# Local directory where result tables of completed jobs are stored
+RESULT_STORE_DIR = os.environ.get(
+    "RESULT_STORE_DIR", os.path.join(tempfile.gettempdir(), "forecast_results")
+)
+
+# Local directory where models trained in-process and their results are stored
+LOCAL_MODEL_DIR = os.environ.get(
+    "LOCAL_MODEL_DIR", os.path.join(tempfile.gettempdir(), "forecast_models")
+)
+
+# Local manifest of the datasets uploaded to BigQuery, and how long they are kept
+UPLOAD_CACHE_MANIFEST_PATH = os.environ.get(
+    "UPLOAD_CACHE_MANIFEST_PATH",
+    os.path.join(tempfile.gettempdir(), "bigquery_uploads.json"),
+)
+UPLOAD_CACHE_MAX_AGE_SECONDS = int(
+    os.environ.get("UPLOAD_CACHE_MAX_AGE_SECONDS", 7 * 24 * 60 * 60)
+)
+
+# Local directory where CSV datasets are cached as Arrow files
+DATASET_CACHE_DIR = os.environ.get(
+    "DATASET_CACHE_DIR", os.path.join(tempfile.gettempdir(), "forecast_datasets")
+)
+
+# Memory budget for the loaded data of all datasets, beyond which the least
+# recently used are released
+DATASET_MEMORY_BUDGET_BYTES = int(
+    os.environ.get("DATASET_MEMORY_BUDGET_BYTES", 1024 * 1024 * 1024)
+)
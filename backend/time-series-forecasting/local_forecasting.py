@@ -0,0 +1,655 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Forecasts many time series in-process, with one model fitted per series.
+
+Rows are aggregated to one value per series and period with DuckDB. The series
+are then fitted in parallel by a pool of worker processes, a chunk of series
+at a time, and the forecasts are returned as Arrow tables with the
+constants.FORECAST_* columns.
+
+The aggregated series are copied once into shared memory, and workers are only
+sent the bounds of the series of their chunk, so the cost of handing out work
+doesn't grow with the size of the dataset.
+"""
+
+import dataclasses
+import math
+import multiprocessing
+import os
+import statistics
+import threading
+import warnings
+from concurrent import futures
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import duckdb
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+import constants
+
+AUTO_FREQUENCY = "AUTO_FREQUENCY"
+DEFAULT_CONFIDENCE_LEVEL = 0.8
+
+MODEL_SEASONAL_NAIVE = "seasonal_naive"
+MODEL_ETS = "ets"
+MODEL_THETA = "theta"
+MODEL_ARIMA = "arima"
+
+# Shorter series repeat their last value rather than fitting ETS or Theta
+MIN_FIT_LENGTH = 3
+
+# Orders tried for each series, the one with the lowest AIC is kept
+ARIMA_ORDERS = [(0, 1, 1), (1, 1, 0), (1, 1, 1), (2, 1, 2), (1, 0, 0)]
+
+# Chunks per worker, so that slow series don't leave other workers idle
+CHUNKS_PER_WORKER = 4
+
+
+@dataclasses.dataclass(frozen=True)
+class DataFrequency:
+    # The unit passed to DuckDB's date_trunc and date_diff
+    unit: str
+    pandas_frequency: str
+    seasonal_period: int
+    # Used to infer the frequency from the spacing of the data
+    nominal_length: pd.Timedelta
+
+
+# The DATA_FREQUENCY values of BQML ARIMA_PLUS, from the shortest
+DATA_FREQUENCIES: Dict[str, DataFrequency] = {
+    "PER_MINUTE": DataFrequency("minute", "min", 60, pd.Timedelta(minutes=1)),
+    "HOURLY": DataFrequency("hour", "h", 24, pd.Timedelta(hours=1)),
+    "DAILY": DataFrequency("day", "D", 7, pd.Timedelta(days=1)),
+    "WEEKLY": DataFrequency("week", "W-MON", 52, pd.Timedelta(days=7)),
+    "MONTHLY": DataFrequency("month", "MS", 12, pd.Timedelta(days=28)),
+    "QUARTERLY": DataFrequency("quarter", "QS", 4, pd.Timedelta(days=89)),
+    "YEARLY": DataFrequency("year", "YS", 1, pd.Timedelta(days=365)),
+}
+
+# Fits a series and forecasts it, given the horizon, the confidence level and
+# the seasonal period. Returns the forecast, its lower and upper bounds, and the
+# evaluation of the model.
+Forecaster = Callable[
+    [np.ndarray, int, float, int],
+    Tuple[np.ndarray, np.ndarray, np.ndarray, Dict[str, Any]],
+]
+
+
+@dataclasses.dataclass(frozen=True)
+class SharedArray:
+    """A 1-D array in shared memory, passed to worker processes by name."""
+
+    name: str
+    dtype: str
+    length: int
+
+
+@dataclasses.dataclass
+class ForecastResult:
+    prediction: pa.Table
+    evaluation: pa.Table
+
+
+def infer_data_frequency(times: pd.Series) -> str:
+    """Infer the data frequency from the median spacing of distinct times."""
+    # Times may be strings, as in dataframes read without types
+    times = pd.to_datetime(times, utc=True)
+    steps = pd.Series(times.dropna().unique()).sort_values().diff().dropna()
+
+    if len(steps) == 0:
+        return "DAILY"
+
+    median_step = steps.median()
+    data_frequency = "PER_MINUTE"
+    for name, frequency in DATA_FREQUENCIES.items():
+        if frequency.nominal_length <= median_step:
+            data_frequency = name
+
+    return data_frequency
+
+
+def aggregate_series(
+    df: pd.DataFrame,
+    time_series_identifier_column: str,
+    time_column: str,
+    target_column: str,
+    data_frequency: str,
+) -> pd.DataFrame:
+    """Sum the target of each series per period.
+
+    Args:
+        df (pd.DataFrame): The dataset.
+        time_series_identifier_column (str): The column identifying the series.
+        time_column (str): The time column.
+        target_column (str): The target column.
+        data_frequency (str): One of DATA_FREQUENCIES.
+
+    Returns:
+        pd.DataFrame: The columns series_id, period (naive UTC), step (the
+            number of periods since a fixed origin) and value, sorted by series
+            and period.
+    """
+    frequency = DATA_FREQUENCIES[data_frequency]
+
+    data = pd.DataFrame(
+        {
+            "series_id": df[time_series_identifier_column],
+            "time": pd.to_datetime(df[time_column], utc=True).dt.tz_localize(None),
+            "value": df[target_column],
+        }
+    )
+
+    connection = duckdb.connect()
+    try:
+        connection.register("dataset", data)
+        # 2000-01-03 is a Monday, so weekly periods are whole steps from it
+        return connection.execute(
+            f"""
+            SELECT
+                CAST(series_id AS VARCHAR) AS series_id,
+                date_trunc('{frequency.unit}', time) AS period,
+                date_diff(
+                    '{frequency.unit}',
+                    TIMESTAMP '2000-01-03',
+                    date_trunc('{frequency.unit}', time)
+                ) AS step,
+                SUM(CAST(value AS DOUBLE)) AS value
+            FROM dataset
+            WHERE series_id IS NOT NULL AND time IS NOT NULL AND value IS NOT NULL
+            GROUP BY 1, 2, 3
+            ORDER BY 1, 2
+            """
+        ).df()
+    finally:
+        connection.close()
+
+
+def _fill_gaps(steps: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Interpolate the values of periods missing from a series."""
+    all_steps = np.arange(steps[0], steps[-1] + 1)
+    if len(all_steps) == len(steps):
+        return values
+
+    return np.interp(all_steps, steps, values)
+
+
+def _is_seasonal(values: np.ndarray, seasonal_period: int) -> bool:
+    """Whether a series is long enough to fit a season of the given period."""
+    return seasonal_period > 1 and len(values) >= 2 * seasonal_period
+
+
+def forecast_seasonal_naive(
+    values: np.ndarray, horizon: int, confidence_level: float, seasonal_period: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, Dict[str, Any]]:
+    """Repeat the last season, with bounds from the spread of seasonal changes.
+
+    Series shorter than two seasons repeat their last value instead.
+    """
+    period = seasonal_period if _is_seasonal(values, seasonal_period) else 1
+
+    forecast = values[-period:][np.arange(horizon) % period].astype(np.float64)
+    changes = values[period:] - values[:-period]
+    std = float(changes.std()) if len(changes) > 1 else 0.0
+    # The error grows with the square root of the number of seasons ahead
+    z = statistics.NormalDist().inv_cdf(0.5 + confidence_level / 2)
+    width = z * std * np.sqrt(np.arange(horizon) // period + 1)
+
+    return (
+        forecast,
+        forecast - width,
+        forecast + width,
+        {"seasonal_period": period, "variance": std**2, "error_message": None},
+    )
+
+
+def _forecast_fallback(
+    values: np.ndarray, horizon: int, confidence_level: float, error_message: str
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, Dict[str, Any]]:
+    """Repeat the last value of a series that a model couldn't be fitted to."""
+    forecast, lower, upper, _ = forecast_seasonal_naive(
+        values, horizon, confidence_level, seasonal_period=1
+    )
+
+    return forecast, lower, upper, {"error_message": error_message}
+
+
+def forecast_ets(
+    values: np.ndarray, horizon: int, confidence_level: float, seasonal_period: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, Dict[str, Any]]:
+    """Fit an additive ETS model with a damped trend.
+
+    The model is seasonal if the series covers at least two seasons.
+    """
+    from statsmodels.tsa.exponential_smoothing.ets import ETSModel
+
+    if len(values) < MIN_FIT_LENGTH:
+        return _forecast_fallback(
+            values, horizon, confidence_level, "Series too short for an ETS model"
+        )
+
+    is_seasonal = _is_seasonal(values, seasonal_period)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+
+        try:
+            # Predictions of ETSModel need an indexed series
+            result = ETSModel(
+                pd.Series(values),
+                error="add",
+                trend="add",
+                damped_trend=True,
+                seasonal="add" if is_seasonal else None,
+                seasonal_periods=seasonal_period if is_seasonal else None,
+            ).fit(disp=False)
+            frame = result.get_prediction(
+                start=len(values), end=len(values) + horizon - 1
+            ).summary_frame(alpha=1 - confidence_level)
+        except Exception as exception:
+            return _forecast_fallback(
+                values, horizon, confidence_level, f"ETS model not fitted: {exception}"
+            )
+
+    return (
+        frame["mean"].to_numpy(dtype=np.float64),
+        frame["pi_lower"].to_numpy(dtype=np.float64),
+        frame["pi_upper"].to_numpy(dtype=np.float64),
+        {
+            "seasonal_period": seasonal_period if is_seasonal else None,
+            "log_likelihood": float(result.llf),
+            "AIC": float(result.aic),
+            "variance": float(result.mse),
+            "error_message": None,
+        },
+    )
+
+
+def forecast_theta(
+    values: np.ndarray, horizon: int, confidence_level: float, seasonal_period: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, Dict[str, Any]]:
+    """Fit a Theta model, deseasonalized if the series covers two seasons."""
+    from statsmodels.tsa.forecasting.theta import ThetaModel
+
+    if len(values) < MIN_FIT_LENGTH:
+        return _forecast_fallback(
+            values, horizon, confidence_level, "Series too short for a Theta model"
+        )
+
+    is_seasonal = _is_seasonal(values, seasonal_period)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+
+        try:
+            result = ThetaModel(
+                values,
+                period=seasonal_period if is_seasonal else 1,
+                deseasonalize=is_seasonal,
+            ).fit()
+            forecast = np.asarray(result.forecast(horizon), dtype=np.float64)
+            bounds = np.asarray(
+                result.prediction_intervals(horizon, alpha=1 - confidence_level),
+                dtype=np.float64,
+            )
+        except Exception as exception:
+            return _forecast_fallback(
+                values,
+                horizon,
+                confidence_level,
+                f"Theta model not fitted: {exception}",
+            )
+
+    return (
+        forecast,
+        bounds[:, 0],
+        bounds[:, 1],
+        {
+            "seasonal_period": seasonal_period if is_seasonal else None,
+            "alpha": float(result.params["alpha"]),
+            "drift": float(result.params["b0"]),
+            "variance": float(result.sigma2),
+            "error_message": None,
+        },
+    )
+
+
+def forecast_arima(
+    values: np.ndarray, horizon: int, confidence_level: float, seasonal_period: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, Dict[str, Any]]:
+    """Fit the non-seasonal ARIMA model with the lowest AIC among ARIMA_ORDERS."""
+    from statsmodels.tsa.arima.model import ARIMA
+
+    best_order = None
+    best_result = None
+    with warnings.catch_warnings():
+        # Convergence warnings are expected for some of the orders tried
+        warnings.simplefilter("ignore")
+
+        for order in ARIMA_ORDERS:
+            if len(values) <= sum(order) + 2:
+                continue
+
+            try:
+                result = ARIMA(
+                    values, order=order, trend="c" if order[1] == 0 else "n"
+                ).fit()
+            except Exception:
+                continue
+
+            if np.isfinite(result.aic) and (
+                best_result is None or result.aic < best_result.aic
+            ):
+                best_order, best_result = order, result
+
+        if best_result is None:
+            return _forecast_fallback(
+                values,
+                horizon,
+                confidence_level,
+                "Series too short or no ARIMA model converged",
+            )
+
+        prediction = best_result.get_forecast(horizon)
+        bounds = prediction.conf_int(alpha=1 - confidence_level)
+
+    return (
+        np.asarray(prediction.predicted_mean, dtype=np.float64),
+        np.asarray(bounds[:, 0], dtype=np.float64),
+        np.asarray(bounds[:, 1], dtype=np.float64),
+        {
+            "non_seasonal_p": best_order[0],
+            "non_seasonal_d": best_order[1],
+            "non_seasonal_q": best_order[2],
+            "has_drift": False,
+            "log_likelihood": float(best_result.llf),
+            "AIC": float(best_result.aic),
+            "variance": float(best_result.params[-1]),
+            "error_message": None,
+        },
+    )
+
+
+FORECASTERS: Dict[str, Forecaster] = {
+    MODEL_SEASONAL_NAIVE: forecast_seasonal_naive,
+    MODEL_ETS: forecast_ets,
+    MODEL_THETA: forecast_theta,
+    MODEL_ARIMA: forecast_arima,
+}
+
+
+def _share_array(array: np.ndarray) -> Tuple[shared_memory.SharedMemory, SharedArray]:
+    """Copy an array into a new block of shared memory."""
+    memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=memory.buf)[:] = array
+
+    return memory, SharedArray(
+        name=memory.name, dtype=array.dtype.str, length=len(array)
+    )
+
+
+def _read_shared_slices(
+    shared_array: SharedArray, bounds: List[Tuple[int, int]]
+) -> List[np.ndarray]:
+    """Copy slices out of a shared array, leaving it free to be closed."""
+    memory = shared_memory.SharedMemory(name=shared_array.name)
+    try:
+        array = np.ndarray(
+            (shared_array.length,), dtype=shared_array.dtype, buffer=memory.buf
+        )
+        slices = [array[start:end].copy() for start, end in bounds]
+        del array
+    finally:
+        memory.close()
+
+    return slices
+
+
+def _forecast_chunk(
+    model: str,
+    shared_steps: SharedArray,
+    shared_values: SharedArray,
+    bounds: List[Tuple[int, int]],
+    horizon: int,
+    confidence_level: float,
+    seasonal_period: int,
+) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray, Dict[str, Any]]]:
+    """Forecast the series within the given bounds. Runs in a worker process."""
+    forecaster = FORECASTERS[model]
+
+    return [
+        forecaster(
+            _fill_gaps(steps, values), horizon, confidence_level, seasonal_period
+        )
+        for steps, values in zip(
+            _read_shared_slices(shared_steps, bounds),
+            _read_shared_slices(shared_values, bounds),
+        )
+    ]
+
+
+_process_pool: Optional[futures.ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+
+
+def _get_process_pool() -> futures.ProcessPoolExecutor:
+    """Get the process pool shared by all jobs, started on first use."""
+    global _process_pool
+
+    with _process_pool_lock:
+        if _process_pool is None:
+            # Forking a threaded server is unsafe, so workers are spawned
+            _process_pool = futures.ProcessPoolExecutor(
+                max_workers=os.cpu_count(),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+        return _process_pool
+
+
+def _reset_process_pool() -> None:
+    global _process_pool
+
+    with _process_pool_lock:
+        _process_pool = None
+
+
+def _forecast_series(
+    process_pool: futures.ProcessPoolExecutor,
+    workers: int,
+    df_series: pd.DataFrame,
+    bounds: List[Tuple[int, int]],
+    model: str,
+    horizon: int,
+    confidence_level: float,
+    seasonal_period: int,
+) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray, Dict[str, Any]]]:
+    """Forecast each series, given by its bounds, in chunks across the pool."""
+    steps_memory, shared_steps = _share_array(
+        df_series["step"].to_numpy(dtype=np.int64)
+    )
+    values_memory, shared_values = _share_array(
+        df_series["value"].to_numpy(dtype=np.float64)
+    )
+
+    chunk_size = max(1, math.ceil(len(bounds) / (workers * CHUNKS_PER_WORKER)))
+    chunks = [bounds[i : i + chunk_size] for i in range(0, len(bounds), chunk_size)]
+
+    try:
+        return [
+            result
+            for chunk_results in process_pool.map(
+                _forecast_chunk,
+                [model] * len(chunks),
+                [shared_steps] * len(chunks),
+                [shared_values] * len(chunks),
+                chunks,
+                [horizon] * len(chunks),
+                [confidence_level] * len(chunks),
+                [seasonal_period] * len(chunks),
+            )
+            for result in chunk_results
+        ]
+    except futures.process.BrokenProcessPool:
+        # A worker died, e.g. out of memory, so start a new pool next time
+        _reset_process_pool()
+        raise
+    finally:
+        for memory in (steps_memory, values_memory):
+            memory.close()
+            memory.unlink()
+
+
+def _get_forecast_times(
+    last_periods: pd.Series, horizon: int, frequency: DataFrequency
+) -> np.ndarray:
+    """Get the next `horizon` periods after the last period of each series."""
+    times_by_last_period = {
+        last_period: pd.date_range(
+            last_period, periods=horizon + 1, freq=frequency.pandas_frequency
+        )[1:]
+        for last_period in last_periods.unique()
+    }
+
+    return np.concatenate(
+        [times_by_last_period[last_period] for last_period in last_periods]
+    )
+
+
+def forecast(
+    df: pd.DataFrame,
+    time_series_identifier_column: str,
+    time_column: str,
+    target_column: str,
+    data_frequency: str,
+    horizon: int,
+    model: str = MODEL_ARIMA,
+    confidence_level: float = DEFAULT_CONFIDENCE_LEVEL,
+    seasonal_period: Optional[int] = None,
+    max_workers: Optional[int] = None,
+) -> ForecastResult:
+    """Fit a model per series and forecast each series.
+
+    Args:
+        df (pd.DataFrame): The dataset.
+        time_series_identifier_column (str): The column identifying the series.
+        time_column (str): The time column.
+        target_column (str): The target column.
+        data_frequency (str): One of DATA_FREQUENCIES, or AUTO_FREQUENCY.
+        horizon (int): The number of periods to forecast.
+        model (str): One of FORECASTERS.
+        confidence_level (float): The confidence level of the bounds.
+        seasonal_period (Optional[int]): The number of periods per season.
+            Defaults to that of the data frequency.
+        max_workers (Optional[int]): The number of worker processes. Defaults
+            to the process pool shared by all jobs, with one worker per core.
+
+    Raises:
+        ValueError: If the model or the data frequency is not supported.
+
+    Returns:
+        ForecastResult: The prediction, with the constants.FORECAST_* columns,
+            and the evaluation, with one row per series.
+    """
+    if model not in FORECASTERS:
+        raise ValueError(f"Unsupported model: {model}")
+
+    # BQML accepts frequencies in any case, e.g. "daily"
+    data_frequency = data_frequency.upper()
+    if data_frequency == AUTO_FREQUENCY:
+        data_frequency = infer_data_frequency(df[time_column])
+
+    if data_frequency not in DATA_FREQUENCIES:
+        raise ValueError(f"Unsupported data frequency: {data_frequency}")
+
+    frequency = DATA_FREQUENCIES[data_frequency]
+
+    df_series = aggregate_series(
+        df=df,
+        time_series_identifier_column=time_series_identifier_column,
+        time_column=time_column,
+        target_column=target_column,
+        data_frequency=data_frequency,
+    )
+
+    if len(df_series) == 0:
+        raise ValueError("The dataset has no rows to forecast")
+
+    # Rows are sorted by series, so each series is a contiguous slice
+    series_ids = df_series["series_id"].to_numpy()
+    starts = np.flatnonzero(np.r_[True, series_ids[1:] != series_ids[:-1]])
+    ends = np.r_[starts[1:], len(series_ids)]
+    bounds = list(zip(starts.tolist(), ends.tolist()))
+
+    if seasonal_period is None:
+        seasonal_period = frequency.seasonal_period
+
+    if max_workers is None:
+        results = _forecast_series(
+            _get_process_pool(),
+            os.cpu_count() or 1,
+            df_series,
+            bounds,
+            model=model,
+            horizon=horizon,
+            confidence_level=confidence_level,
+            seasonal_period=seasonal_period,
+        )
+    else:
+        with futures.ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+        ) as process_pool:
+            results = _forecast_series(
+                process_pool,
+                max_workers,
+                df_series,
+                bounds,
+                model=model,
+                horizon=horizon,
+                confidence_level=confidence_level,
+                seasonal_period=seasonal_period,
+            )
+
+    ids = series_ids[starts]
+    last_periods = df_series["period"].iloc[ends - 1]
+
+    prediction = pd.DataFrame(
+        {
+            constants.FORECAST_TIME_SERIES_IDENTIFIER_COLUMN: np.repeat(ids, horizon),
+            constants.FORECAST_TIME_COLUMN: pd.DatetimeIndex(
+                _get_forecast_times(last_periods, horizon, frequency)
+            ).tz_localize("UTC"),
+            constants.FORECAST_TARGET_COLUMN: np.concatenate(
+                [result[0] for result in results]
+            ),
+            constants.FORECAST_TARGET_COLUMN_LOWER_BOUND: np.concatenate(
+                [result[1] for result in results]
+            ),
+            constants.FORECAST_TARGET_COLUMN_UPPER_BOUND: np.concatenate(
+                [result[2] for result in results]
+            ),
+        }
+    )
+
+    evaluation = pd.DataFrame([result[3] for result in results])
+    evaluation.insert(0, time_series_identifier_column, ids)
+    evaluation.insert(1, "model", model)
+
+    return ForecastResult(
+        prediction=pa.Table.from_pandas(prediction, preserve_index=False),
+        evaluation=pa.Table.from_pandas(evaluation, preserve_index=False),
+    )
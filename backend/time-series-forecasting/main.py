@@ -14,24 +14,29 @@
 
 import logging
 import datetime
-import numpy as np
-import pandas as pd
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 
-import constants
-from services import dataset_service, forecast_job_coordinator, forecast_job_service
+import chart_formatters
+from services import (
+    dataset_service,
+    forecast_job_coordinator,
+    forecast_job_service,
+    payload_cache,
+)
 from training_methods import (
     automl_training_method,
     bqml_training_method,
     debug_training_method,
+    local_arima_training_method,
+    local_statistical_training_method,
     training_method,
 )
 
 logger = logging.getLogger(__name__)
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional
 
 from pydantic import BaseModel
 
@@ -40,13 +45,23 @@ from services import dataset_service
 
 app = FastAPI()
 
+
+def _get_training_method_classes(
+    base_class: type = training_method.TrainingMethod,
+) -> List[type]:
+    """Get the subclasses of a class, including those of its subclasses."""
+    method_classes = []
+    for method_class in base_class.__subclasses__():
+        method_classes.append(method_class)
+        method_classes.extend(_get_training_method_classes(method_class))
+
+    return method_classes
+
+
 # Auto-detect all imported training methods
 training_registry: Dict[str, training_method.TrainingMethod] = {
     method.id: method
-    for method in [
-        method_class()
-        for method_class in training_method.TrainingMethod.__subclasses__()
-    ]
+    for method in [method_class() for method_class in _get_training_method_classes()]
 }
 
 
@@ -185,231 +200,58 @@ def submitForecastJob(
     return {"jobId": job_id}
 
 
+def payload_response(request: Request, payload: payload_cache.Payload) -> Response:
+    """Send a pre-serialized payload, pre-gzipped if the client accepts it."""
+    if payload.gzipped_body is not None and "gzip" in request.headers.get(
+        "Accept-Encoding", ""
+    ):
+        # The GZip middleware leaves responses that are already encoded alone
+        return Response(
+            content=payload.gzipped_body,
+            media_type="application/json",
+            headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"},
+        )
+
+    return Response(content=payload.body, media_type="application/json")
+
+
 # Get evaluation
 @app.get("/evaluation/{job_id}")
-async def evaluation(job_id: str):
-    evaluation = training_jobs_manager_instance.get_evaluation(job_id=job_id)
+async def evaluation(job_id: str, request: Request):
+    payload = training_jobs_manager_instance.get_evaluation_payload(job_id=job_id)
 
-    if evaluation is None:
+    if payload is None:
         raise HTTPException(status_code=404, detail=f"Evaluation not found: {job_id}")
     else:
-        evaluation = evaluation.fillna("")
-        evaluation["id"] = evaluation.index
-
-        columns = evaluation.columns.tolist()
-        for column in columns:
-            evaluation[column] = evaluation[column].apply(
-                lambda x: x.tolist() if isinstance(x, np.ndarray) else x
-            )
-
-        output = {
-            "columns": columns,
-            "rows": evaluation.astype(str).to_dict(orient="records"),
-        }
-
-        return output
-
-
-def format_for_plotly(
-    time_series_identifier_column: str,
-    time_column: str,
-    target_column: str,
-    data: pd.DataFrame,
-) -> List[Dict[str, Any]]:
-    data_grouped = data.sort_values([time_column]).groupby(
-        time_series_identifier_column
-    )
-
-    return [
-        {
-            "name": group,
-            "mode": "lines",
-            "x": data_for_group[time_column].tolist(),
-            "y": data_for_group[target_column].tolist(),
-        }
-        for (group, data_for_group) in data_grouped
-    ]
-
-
-def format_for_rechart(
-    time_series_identifier_column: str,
-    time_column: str,
-    target_column: str,
-    data: pd.DataFrame,
-) -> Tuple[
-    List[Dict[str, Any]], Optional[datetime.datetime], Optional[datetime.datetime]
-]:
-
-    data_grouped = data.groupby(time_series_identifier_column)
-
-    # Create a map of group to map of time-to-values
-    # i.e. group_time_value_map[group_id][time_id] = target_value
-    group_time_value_map = {
-        k: dict(zip(v[time_column].tolist(), v[target_column].tolist()))
-        for k, v in data_grouped
-    }
-
-    unique_times = sorted(list(set(data[time_column].tolist())))
-
-    data = [
-        {
-            "name": time.isoformat(),
-            **{
-                group: time_values_map.get(time)
-                for group, time_values_map in group_time_value_map.items()
-            },
-        }
-        for time in unique_times
-    ]
-
-    return (
-        data,
-        unique_times[0].isoformat() if len(unique_times) > 0 else None,
-        unique_times[-1].isoformat() if len(unique_times) > 0 else None,
-    )
+        return payload_response(request, payload)
 
 
 # Get prediction
 @app.get("/prediction/{job_id}/{output_type}")
-async def prediction(job_id: str, output_type: str):
+async def prediction(job_id: str, output_type: str, request: Request):
     job_request = training_jobs_manager_instance.get_request(job_id=job_id)
 
     if job_request is None:
         raise HTTPException(status_code=404, detail=f"Prediction not found: {job_id}")
 
-    # Fetch dataframes
+    if output_type not in chart_formatters.OUTPUT_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported output type: {output_type}",
+        )
+
+    # Built once per job and output type, then served from the cache
     try:
-        df_history = job_request.dataset.df
-        df_prediction = training_jobs_manager_instance.get_prediction(job_id=job_id)
+        payload = training_jobs_manager_instance.get_prediction_payload(
+            job_id=job_id, output_type=output_type
+        )
     except Exception as exception:
         logger.error(str(exception))
         raise HTTPException(
             status_code=400, detail=f"There was a problem getting prediction: {job_id}"
         )
 
-    # Fetch training methods
-    training_method = training_registry.get(job_request.training_method_id)
-    if training_method is None:
-        raise HTTPException(
-            status_code=404,
-            detail=f"Training method not found: {job_request.training_method_id}",
-        )
-
-    # Format historical dataframe to match prediction dataframes, according to training method
-    history_time_series_identifier_column = (
-        training_method.dataset_time_series_identifier_column(job_request=job_request)
-    )
-    history_time_column = training_method.dataset_time_column(job_request=job_request)
-    history_target_column = training_method.dataset_target_column(
-        job_request=job_request
-    )
-
-    time_series_identifier_column = constants.FORECAST_TIME_SERIES_IDENTIFIER_COLUMN
-    time_column = constants.FORECAST_TIME_COLUMN
-    target_column = constants.FORECAST_TARGET_COLUMN
-
-    if df_prediction is None:
+    if payload is None:
         raise HTTPException(status_code=404, detail=f"Prediction not found: {job_id}")
     else:
-        df_prediction = df_prediction.fillna("")
-        # TODO Move the next line to a better place :D
-        df_prediction[time_column] = pd.to_datetime(df_prediction[time_column])
-
-        if output_type == "datagrid":
-            df_prediction["id"] = df_prediction.index
-
-            return {
-                "columns": df_prediction.columns.tolist(),
-                "rows": df_prediction.to_dict(orient="records"),
-            }
-        elif output_type == "chartjs":
-
-            prediction_grouped = df_prediction.groupby(time_series_identifier_column)
-
-            group_time_value_map = {
-                k: dict(zip(v[time_column].tolist(), v[target_column].tolist()))
-                for k, v in prediction_grouped
-            }
-
-            unique_times = sorted(list(df_prediction[time_column].unique()))
-
-            datasets = [
-                {
-                    "label": group,
-                    "data": [time_values_map[time] for time in unique_times],
-                }
-                for group, time_values_map in group_time_value_map.items()
-            ]
-
-            return {
-                "timeLabels": unique_times,
-                "datasets": datasets,
-            }
-        elif output_type == "recharts":
-            history_formatted, _, history_max_date = format_for_rechart(
-                time_series_identifier_column=history_time_series_identifier_column,
-                time_column=history_time_column,
-                target_column=history_target_column,
-                data=df_history,
-            )
-
-            (predictions_formatted, _, _,) = format_for_rechart(
-                time_series_identifier_column=time_series_identifier_column,
-                time_column=time_column,
-                target_column=target_column,
-                data=df_prediction,
-            )
-
-            return {
-                "groups": df_prediction[time_series_identifier_column]
-                .unique()
-                .tolist(),
-                "data": history_formatted + predictions_formatted,
-                "historyMaxDate": history_max_date,  # The date separating history and prediction
-            }
-        elif output_type == "plotly":
-            column_map = {
-                job_request.model_parameters[
-                    "timeSeriesIdentifierColumn"
-                ]: time_series_identifier_column,
-                job_request.model_parameters["timeColumn"]: time_column,
-                job_request.model_parameters["targetColumn"]: target_column,
-            }
-
-            df_history = df_history.rename(columns=column_map)
-
-            historical_time_values = df_history[time_column]
-            history_min_date = (
-                historical_time_values.min().isoformat()
-                if len(historical_time_values) > 0
-                else None
-            )
-            history_max_date = (
-                historical_time_values.max().isoformat()
-                if len(historical_time_values) > 0
-                else None
-            )
-
-            historicalBounds = None
-            if history_min_date is not None and history_max_date is not None:
-                historicalBounds = {"min": history_min_date, "max": history_max_date}
-
-            df_history = df_history.filter(column_map.values())
-            df_prediction = df_prediction.filter(column_map.values())
-
-            lines = format_for_plotly(
-                time_series_identifier_column=time_series_identifier_column,
-                time_column=time_column,
-                target_column=target_column,
-                data=pd.concat([df_history, df_prediction]),
-            )
-
-            return {
-                "lines": lines,
-                "historicalBounds": historicalBounds,
-            }
-        else:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Unsupported output type: {output_type}",
-            )
+        return payload_response(request, payload)
@@ -14,15 +14,34 @@
 
 import abc
 import dataclasses
+import uuid
 from datetime import datetime
-from functools import cached_property, cache
+from functools import cached_property
 from io import StringIO
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 from google.cloud import bigquery
 
+import constants
 import utils
+from models import dataset_format
+from services import upload_cache
+
+# How the test portion of a dataset is held out: the same last share of distinct
+# times of all series, the last `holdout_periods` times of all series, or the last
+# periods (or share of periods) of each series
+HOLDOUT_FRACTION = "fraction"
+HOLDOUT_LAST_N_PERIODS = "last_n_periods"
+HOLDOUT_PER_SERIES = "per_series"
+
+# Uploads are shared by all datasets, so identical rows are only uploaded once
+_upload_cache = upload_cache.UploadCache(
+    manifest_path=constants.UPLOAD_CACHE_MANIFEST_PATH,
+    max_age_seconds=constants.UPLOAD_CACHE_MAX_AGE_SECONDS,
+)
 
 
 class Dataset(abc.ABC):
@@ -34,6 +53,24 @@ class Dataset(abc.ABC):
     recommended_model_parameters: Optional[Dict[str, Dict[str, Any]]]
     recommended_prediction_parameters: Optional[Dict[str, Dict[str, Any]]]
     train_percentage: int = 0.8
+    holdout_strategy: str = HOLDOUT_FRACTION
+    # The number of periods held out, see HOLDOUT_LAST_N_PERIODS and
+    # HOLDOUT_PER_SERIES
+    holdout_periods: Optional[int] = None
+    # The column identifying series, for HOLDOUT_PER_SERIES
+    holdout_series_column: Optional[str] = None
+
+    # The cached properties holding loaded data, see release_data
+    _DATA_PROPERTIES = (
+        "df",
+        "unique_dates",
+        "date_cutoff",
+        "_split",
+        "df_train",
+        "df_test",
+        "_df_size",
+        "_split_size",
+    )
 
     @property
     @abc.abstractmethod
@@ -67,34 +104,124 @@ class Dataset(abc.ABC):
 
         return time_values.max()
 
+    @cached_property
+    def unique_dates(self) -> pd.Series:
+        """The distinct times of the dataset, sorted."""
+        return pd.Series(self.df[self.time_column].dropna().unique()).sort_values(
+            ignore_index=True
+        )
+
     @cached_property
     def date_cutoff(self) -> datetime:
         # The cut-off date for dataset train/test split
-        df = self.df
-        dates_unique = df[self.time_column].unique()
-        date_cutoff = sorted(dates_unique)[
-            round(len(dates_unique) * self.train_percentage)
-        ]
+        dates_unique = self.unique_dates
 
-        return date_cutoff
+        if self.holdout_strategy == HOLDOUT_LAST_N_PERIODS:
+            if self.holdout_periods is None or not (
+                0 < self.holdout_periods < len(dates_unique)
+            ):
+                raise ValueError(
+                    f"holdout_periods must be between 1 and {len(dates_unique) - 1}"
+                )
+
+            return dates_unique[len(dates_unique) - 1 - self.holdout_periods]
+
+        return dates_unique[round(len(dates_unique) * self.train_percentage)]
+
+    def _get_per_series_test_mask(self, df: pd.DataFrame) -> pd.Series:
+        """Mark the last periods of each series as test rows."""
+        if self.holdout_series_column is None:
+            raise ValueError(
+                f"holdout_series_column is required by the {HOLDOUT_PER_SERIES} holdout"
+            )
+
+        times = df.groupby(self.holdout_series_column, observed=True, sort=False)[
+            self.time_column
+        ]
+        # 1 for the last time of each series, 2 for the one before, ...
+        ranks_from_last = times.rank(method="dense", ascending=False)
+
+        if self.holdout_periods is not None:
+            return ranks_from_last <= self.holdout_periods
+
+        # Hold out the same share of times as HOLDOUT_FRACTION, within each series
+        time_counts = times.transform("nunique")
+        return ranks_from_last < time_counts - (
+            time_counts * self.train_percentage
+        ).round()
+
+    def _is_split_by_slicing(self) -> bool:
+        # Sorted by time, so the portions are slices sharing the data of df
+        return (
+            self.holdout_strategy != HOLDOUT_PER_SERIES
+            and self.df[self.time_column].is_monotonic_increasing
+        )
 
     @cached_property
-    def df_train(self) -> pd.DataFrame:
+    def _split(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
         df = self.df
 
+        if self.holdout_strategy == HOLDOUT_PER_SERIES:
+            is_test = self._get_per_series_test_mask(df)
+            return df[~is_test], df[is_test]
+        elif self.holdout_strategy not in (HOLDOUT_FRACTION, HOLDOUT_LAST_N_PERIODS):
+            raise ValueError(f"Unknown holdout strategy: {self.holdout_strategy}")
+
+        times = df[self.time_column]
+
+        if self._is_split_by_slicing():
+            position = times.searchsorted(self.date_cutoff, side="right")
+            return df.iloc[:position], df.iloc[position:]
+
         # Split dataset based on date cut-off
-        df_train = df[df[self.time_column] <= self.date_cutoff]
+        return df[times <= self.date_cutoff], df[times > self.date_cutoff]
 
-        return df_train
+    @cached_property
+    def df_train(self) -> pd.DataFrame:
+        return self._split[0]
 
     @cached_property
     def df_test(self) -> pd.DataFrame:
-        df = self.df
+        return self._split[1]
 
-        # Split dataset based on date cut-off
-        df_test = df[df[self.time_column] > self.date_cutoff]
+    @cached_property
+    def _df_size(self) -> int:
+        return int(self.df.memory_usage(deep=True).sum())
 
-        return df_test
+    @cached_property
+    def _split_size(self) -> int:
+        if self._is_split_by_slicing():
+            return 0
+
+        return int(
+            sum(portion.memory_usage(deep=True).sum() for portion in self._split)
+        )
+
+    def get_resident_size(self) -> int:
+        """The bytes held by the loaded dataframes, 0 if none are loaded.
+
+        Dataframes are measured once after they are loaded, so this is cheap
+        to call again.
+
+        Returns:
+            int: The size, counting the data shared by dataframes once.
+        """
+        cached = self.__dict__
+
+        if "df" not in cached:
+            return 0
+
+        size = self._df_size
+
+        if "_split" in cached:
+            size += self._split_size
+
+        return size
+
+    def release_data(self) -> None:
+        """Drop the loaded dataframes, which are loaded again when next used."""
+        for name in self._DATA_PROPERTIES:
+            self.__dict__.pop(name, None)
 
     def as_response(self) -> Dict:
         df_preview = self.df_preview.fillna("").sort_values(self.time_column)
@@ -113,13 +240,15 @@ class Dataset(abc.ABC):
             "recommendedPredictionParameters": self.recommended_prediction_parameters,
         }
 
-    # @cache
     def get_bigquery_table_id(
         self, time_column: str, dataset_portion: Optional[str] = None
     ) -> str:
         """This function saves the dataset on BigQuery and returns the BigQuery
             bigquery distenation table uri.
 
+        The table of a previous upload of the same rows and schema is reused,
+        see services/upload_cache.py.
+
         Args:
             time_column (str): Dataset time column name
             dataset_portion (str): `test` or `train`. This will return the
@@ -129,21 +258,59 @@ class Dataset(abc.ABC):
             str: BigQuery destination table ID.
         """
 
-        dataset_id = utils.generate_uuid()
-        table_id = utils.generate_uuid()
+        df = pd.DataFrame()
+        if dataset_portion == "train":
+            df = self.df_train
+        elif dataset_portion == "test":
+            df = self.df_test
+        elif dataset_portion is None:
+            df = self.df
+        else:
+            raise ValueError(f"Unknown dataset portion: {dataset_portion}")
+
+        schema = [(time_column, bigquery.enums.SqlTypeNames.DATE.value)]
+
+        key = upload_cache.get_key(
+            dataset_id=str(self.id),
+            df=df,
+            dataset_portion=dataset_portion,
+            schema=schema,
+        )
+
+        return _upload_cache.get_or_upload(
+            key, lambda: self._upload_to_bigquery(df=df, schema=schema)
+        )
+
+    def _upload_to_bigquery(
+        self, df: pd.DataFrame, schema: List[Tuple[str, str]]
+    ) -> str:
+        # Uploads are recorded in a manifest that outlives the process, so their
+        # names must be unique across processes and restarts, unlike the seeded
+        # utils.generate_uuid
+        dataset_id = f"upload_{uuid.uuid4().hex}"
+        table_id = "data"
 
         # Write dataset to BigQuery table
-        client = bigquery.Client()
+        client = utils.get_bigquery_client()
         project_id = client.project
 
         bq_dataset = bigquery.Dataset(f"{project_id}.{dataset_id}")
+        # Expired by BigQuery too, in case the upload manifest is lost
+        bq_dataset.default_table_expiration_ms = int(
+            (
+                _upload_cache.max_age_seconds
+                + upload_cache.BIGQUERY_EXPIRATION_MARGIN_SECONDS
+            )
+            * 1000
+        )
         bq_dataset = client.create_dataset(bq_dataset, exists_ok=True)
 
         job_config = bigquery.LoadJobConfig(
             # Specify a (partial) schema. All columns are always written to the
             # table. The schema is used to assist in data type definitions.
             schema=[
-                bigquery.SchemaField(time_column, bigquery.enums.SqlTypeNames.DATE),
+                bigquery.SchemaField(column, field_type)
+                for column, field_type in schema
             ],
             # Optionally, set the write disposition. BigQuery appends loaded rows
             # to an existing table by default, but with WRITE_TRUNCATE write
@@ -152,18 +319,8 @@ class Dataset(abc.ABC):
         )
 
         # Reference: https://cloud.google.com/bigquery/docs/samples/bigquery-load-table-dataframe
-        df = pd.DataFrame()
-        if dataset_portion == "train":
-            df = self.df_train
-        elif dataset_portion == "test":
-            df = self.df_test
-        elif dataset_portion is None:
-            df = self.df
-        else:
-            raise ValueError(f"Unknown dataset portion: {dataset_portion}")
-
         job = client.load_table_from_dataframe(
-            dataframe=df,
+            dataframe=dataset_format.decategorize(df),
             destination=f"{project_id}.{dataset_id}.{table_id}",
             job_config=job_config,
         )  # Make an API request.
@@ -183,12 +340,100 @@ class CSVDataset(Dataset):
     recommended_model_parameters: Optional[Dict[str, Dict[str, Any]]] = None
     recommended_prediction_parameters: Optional[Dict[str, Dict[str, Any]]] = None
     id: str = dataclasses.field(default_factory=utils.generate_uuid)
+    holdout_strategy: str = HOLDOUT_FRACTION
+    holdout_periods: Optional[int] = None
+    holdout_series_column: Optional[str] = None
+
+    # The table of an uploaded CSV is held in memory, so it is released too
+    _DATA_PROPERTIES = Dataset._DATA_PROPERTIES + ("table", "_table_size")
+
+    @cached_property
+    def table(self) -> pa.Table:
+        """The dataset as a typed Arrow table sorted by time, see dataset_format.py.
+
+        CSV files are converted on first use, and memory-mapped afterwards.
+        """
+        if isinstance(self.filepath_or_buffer, str):
+            return dataset_format.read_csv_as_columnar(
+                self.filepath_or_buffer,
+                time_column=self.time_column,
+                cache_dir=constants.DATASET_CACHE_DIR,
+            )
+
+        return dataset_format.convert_csv(
+            self.filepath_or_buffer, time_column=self.time_column
+        )
+
+    @cached_property
+    def catalog(self) -> Dict[str, Any]:
+        """Statistics of the dataset, computed once when it is converted.
+
+        Lets datasets be listed without loading them.
+        """
+        series_columns = sorted(
+            {
+                parameters["timeSeriesIdentifierColumn"]
+                for parameters in (self.recommended_model_parameters or {}).values()
+                if "timeSeriesIdentifierColumn" in parameters
+            }
+        )
+
+        if isinstance(self.filepath_or_buffer, str):
+            return dataset_format.read_catalog(
+                self.filepath_or_buffer,
+                time_column=self.time_column,
+                series_columns=series_columns,
+                cache_dir=constants.DATASET_CACHE_DIR,
+            )
+
+        return dataset_format.build_catalog(
+            self.table, time_column=self.time_column, series_columns=series_columns
+        )
 
     @cached_property
     def df(self) -> pd.DataFrame:
-        df = pd.read_csv(self.filepath_or_buffer)
-        df[self.time_column] = pd.to_datetime(df[self.time_column], utc=True)
-        return df.sort_values(self.time_column)
+        return self.table.to_pandas()
+
+    @cached_property
+    def _table_size(self) -> int:
+        # The tables of CSV files are memory-mapped, and paged in and out by
+        # the OS rather than held in memory
+        if isinstance(self.filepath_or_buffer, str):
+            return 0
+
+        return self.table.nbytes
+
+    def get_resident_size(self) -> int:
+        """The bytes held by the loaded dataframes and in-memory table."""
+        size = super().get_resident_size()
+
+        if "table" in self.__dict__:
+            size += self._table_size
+
+        return size
+
+    @cached_property
+    def columns(self) -> List[str]:
+        return list(self.catalog["dtypes"])
+
+    @cached_property
+    def df_preview(self) -> pd.DataFrame:
+        return dataset_format.get_preview(self.catalog, time_column=self.time_column)
+
+    @cached_property
+    def start_date(self) -> datetime:
+        return pd.Timestamp(self.catalog["min_time"])
+
+    @cached_property
+    def end_date(self) -> datetime:
+        return pd.Timestamp(self.catalog["max_time"])
+
+    @cached_property
+    def unique_dates(self) -> pd.Series:
+        # Rows are sorted by time, so distinct times are already in order
+        return (
+            pc.unique(self.table.column(self.time_column)).drop_null().to_pandas()
+        )
 
 
 @dataclasses.dataclass
@@ -0,0 +1,289 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Converts CSV datasets once to typed Arrow files, memory-mapped on read.
+
+The Arrow file is written next to the other cached datasets, and is converted
+again whenever the CSV file changes. It holds:
+
+- the time column as UTC timestamps, with the rows sorted by time
+- strings with few distinct values dictionary-encoded, with sorted values, so
+  they are read as pandas categoricals
+- float columns narrowed to float32 where no value changes
+
+Arrow IPC files are used rather than Parquet, since they can be memory-mapped
+without decoding. Reading a few columns or rows then only touches those pages.
+
+A catalog of statistics is written next to each Arrow file: the number of rows,
+the time range and number of distinct times, the number of rows per series, the
+column types and the preview rows. Listing datasets only reads the catalogs.
+"""
+
+import hashlib
+import io
+import json
+import os
+import tempfile
+from typing import Any, Dict, List, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import csv
+
+from services import result_store
+
+# Changing the conversion must change the version, so files are converted again
+FORMAT_VERSION = 1
+
+CATALOG_SUFFIX = ".catalog.json"
+PREVIEW_ROW_COUNT = 5
+
+# Strings are dictionary-encoded if they have at most this many distinct values
+# per row
+CATEGORICAL_MAX_DISTINCT_RATIO = 0.5
+
+
+def _to_sorted_dictionary(column: pa.ChunkedArray) -> pa.Array:
+    """Dictionary-encode a column, with the dictionary in sorted order."""
+    unique_values = pc.unique(column).drop_null()
+    dictionary = unique_values.take(pc.array_sort_indices(unique_values))
+    indices = pc.index_in(column, value_set=dictionary).combine_chunks()
+
+    return pa.DictionaryArray.from_arrays(indices, dictionary)
+
+
+def _narrow_float(column: pa.ChunkedArray) -> pa.ChunkedArray:
+    """Cast a float64 column to float32 if no value changes."""
+    values = column.to_numpy()
+    narrowed = values.astype(np.float32)
+
+    if not np.array_equal(narrowed.astype(np.float64), values, equal_nan=True):
+        return column
+
+    return pa.chunked_array([pa.array(narrowed, from_pandas=True)])
+
+
+def convert_csv(
+    filepath_or_buffer: Union[str, io.StringIO], time_column: str
+) -> pa.Table:
+    """Read a CSV file as a typed table, sorted by time.
+
+    Args:
+        filepath_or_buffer (Union[str, io.StringIO]): The CSV file.
+        time_column (str): The time column.
+
+    Returns:
+        pa.Table: The table.
+    """
+    if isinstance(filepath_or_buffer, io.StringIO):
+        filepath_or_buffer = io.BytesIO(filepath_or_buffer.getvalue().encode())
+
+    # Empty strings are missing values, as with pd.read_csv
+    table = csv.read_csv(
+        filepath_or_buffer,
+        convert_options=csv.ConvertOptions(strings_can_be_null=True),
+    )
+
+    columns = []
+    for name, column in zip(table.column_names, table.columns):
+        if name == time_column:
+            column = pa.chunked_array(
+                [pa.array(pd.to_datetime(column.to_pandas(), utc=True))]
+            )
+        elif pa.types.is_string(column.type) or pa.types.is_large_string(
+            column.type
+        ):
+            if len(pc.unique(column)) <= CATEGORICAL_MAX_DISTINCT_RATIO * max(
+                len(column), 1
+            ):
+                column = pa.chunked_array([_to_sorted_dictionary(column)])
+        elif pa.types.is_float64(column.type):
+            column = _narrow_float(column)
+
+        columns.append(column)
+
+    table = pa.table(columns, names=table.column_names)
+
+    return table.take(pc.sort_indices(table, sort_keys=[(time_column, "ascending")]))
+
+
+def get_columnar_path(csv_path: str, time_column: str, cache_dir: str) -> str:
+    """Get the path of the Arrow file of the current version of a CSV file."""
+    stat = os.stat(csv_path)
+    key = hashlib.sha256(
+        json.dumps(
+            [
+                os.path.abspath(csv_path),
+                stat.st_size,
+                stat.st_mtime_ns,
+                time_column,
+                FORMAT_VERSION,
+            ]
+        ).encode()
+    ).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+
+    return os.path.join(cache_dir, f"{name}-{key}{result_store.RESULT_FILE_SUFFIX}")
+
+
+def read_csv_as_columnar(csv_path: str, time_column: str, cache_dir: str) -> pa.Table:
+    """Read a CSV file through its Arrow file, converting it if needed.
+
+    Args:
+        csv_path (str): The CSV file.
+        time_column (str): The time column.
+        cache_dir (str): The directory of the Arrow files.
+
+    Returns:
+        pa.Table: The memory-mapped table.
+    """
+    path = get_columnar_path(csv_path, time_column, cache_dir)
+
+    if not os.path.exists(path):
+        result_store.write_file(path, convert_csv(csv_path, time_column))
+
+    return result_store.read_file(path)
+
+
+def to_plain_pandas(table: pa.Table) -> pd.DataFrame:
+    """Convert a table to a dataframe, with dictionaries decoded to values."""
+    return pa.table(
+        [
+            column.cast(column.type.value_type)
+            if pa.types.is_dictionary(column.type)
+            else column
+            for column in table.columns
+        ],
+        names=table.column_names,
+    ).to_pandas()
+
+
+def decategorize(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert categorical columns to columns of their values."""
+    categorical_columns = {
+        column: dtype.categories.dtype
+        for column, dtype in df.dtypes.items()
+        if isinstance(dtype, pd.CategoricalDtype)
+    }
+
+    return df.astype(categorical_columns) if categorical_columns else df
+
+
+def _to_json_value(value: Any) -> Any:
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    elif isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    elif isinstance(value, np.generic):
+        return value.item()
+
+    return value
+
+
+def build_catalog(
+    table: pa.Table, time_column: str, series_columns: List[str]
+) -> Dict[str, Any]:
+    """Compute the statistics of a table sorted by time.
+
+    Args:
+        table (pa.Table): The table.
+        time_column (str): The time column.
+        series_columns (List[str]): The columns identifying series, whose rows
+            are counted per value.
+
+    Returns:
+        Dict[str, Any]: The catalog, as JSON-serializable values.
+    """
+    times = table.column(time_column)
+    min_max = pc.min_max(times)
+
+    series_counts = {}
+    for column in series_columns:
+        if column not in table.column_names:
+            continue
+
+        counts = pc.value_counts(table.column(column)).to_pylist()
+        series_counts[column] = {
+            str(entry["values"]): entry["counts"]
+            for entry in counts
+            if entry["values"] is not None
+        }
+
+    preview = to_plain_pandas(table.slice(0, PREVIEW_ROW_COUNT))
+
+    return {
+        "version": FORMAT_VERSION,
+        "row_count": table.num_rows,
+        "min_time": _to_json_value(pd.Timestamp(min_max["min"].as_py())),
+        "max_time": _to_json_value(pd.Timestamp(min_max["max"].as_py())),
+        "distinct_time_count": len(pc.unique(times).drop_null()),
+        "series_columns": series_columns,
+        "series_counts": series_counts,
+        "dtypes": {
+            column: str(dtype)
+            for column, dtype in table.schema.empty_table().to_pandas().dtypes.items()
+        },
+        "preview": [
+            {column: _to_json_value(value) for column, value in row.items()}
+            for row in preview.to_dict(orient="records")
+        ],
+    }
+
+
+def read_catalog(
+    csv_path: str, time_column: str, series_columns: List[str], cache_dir: str
+) -> Dict[str, Any]:
+    """Read the catalog of a CSV file, converting the file if needed.
+
+    Args:
+        csv_path (str): The CSV file.
+        time_column (str): The time column.
+        series_columns (List[str]): The columns identifying series.
+        cache_dir (str): The directory of the Arrow files.
+
+    Returns:
+        Dict[str, Any]: The catalog, see build_catalog.
+    """
+    path = get_columnar_path(csv_path, time_column, cache_dir)
+    catalog_path = path[: -len(result_store.RESULT_FILE_SUFFIX)] + CATALOG_SUFFIX
+
+    if os.path.exists(catalog_path):
+        with open(catalog_path, "r") as f:
+            catalog = json.load(f)
+
+        if catalog["series_columns"] == series_columns:
+            return catalog
+
+    catalog = build_catalog(
+        read_csv_as_columnar(csv_path, time_column, cache_dir),
+        time_column=time_column,
+        series_columns=series_columns,
+    )
+
+    fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(catalog, f)
+    os.replace(temp_path, catalog_path)
+
+    return catalog
+
+
+def get_preview(catalog: Dict[str, Any], time_column: str) -> pd.DataFrame:
+    """Get the preview rows of a catalog as a dataframe."""
+    df_preview = pd.DataFrame(catalog["preview"], columns=list(catalog["dtypes"]))
+    df_preview[time_column] = pd.to_datetime(df_preview[time_column], utc=True)
+
+    return df_preview
@@ -13,10 +13,114 @@
 # limitations under the License.
 
 import logging
-from typing import List, Optional
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
 
+import constants
 from models import dataset
 
+logger = logging.getLogger(__name__)
+
+
+class DatasetRegistry:
+    """Datasets by id, with their loaded data kept within a memory budget.
+
+    Looking up a dataset marks it as the most recently used. When the data loaded
+    by all datasets exceeds the budget, the data of the least recently used ones
+    is released, and loaded again from the dataset cache when next used.
+    """
+
+    def __init__(
+        self, datasets: List[dataset.Dataset], memory_budget_bytes: int
+    ) -> None:
+        """Initializes the registry.
+
+        Args:
+            datasets (List[dataset.Dataset]): The datasets, in listing order.
+            memory_budget_bytes (int): The memory budget of the loaded data.
+        """
+        self.memory_budget_bytes = memory_budget_bytes
+        self._lock = threading.Lock()
+        self._datasets: Dict[str, dataset.Dataset] = {}
+        # Dataset ids, least recently used first
+        self._recently_used: "OrderedDict[str, None]" = OrderedDict()
+        # The resident sizes when the budget was last checked
+        self._sizes: Dict[str, int] = {}
+
+        for target_dataset in datasets:
+            self.add(target_dataset)
+
+    def add(self, target_dataset: dataset.Dataset) -> None:
+        dataset_id = str(target_dataset.id)
+
+        with self._lock:
+            self._datasets[dataset_id] = target_dataset
+            self._recently_used[dataset_id] = None
+            self._recently_used.move_to_end(dataset_id)
+
+    def list(self) -> List[dataset.Dataset]:
+        with self._lock:
+            return list(self._datasets.values())
+
+    def get(self, dataset_id: str) -> Optional[dataset.Dataset]:
+        """Get a dataset, marking it as the most recently used.
+
+        Args:
+            dataset_id (str): Dataset id.
+
+        Returns:
+            Optional[dataset.Dataset]: The dataset, None if it doesn't exist.
+        """
+        with self._lock:
+            target_dataset = self._datasets.get(dataset_id)
+
+            if target_dataset is None:
+                return None
+
+            self._recently_used.move_to_end(dataset_id)
+
+            sizes = {
+                dataset_id: self._datasets[dataset_id].get_resident_size()
+                for dataset_id in self._recently_used
+            }
+            # Unless data was loaded since the last check, the budget can only
+            # be exceeded by a dataset kept as the most recently used
+            if sizes != self._sizes or sum(sizes.values()) > self.memory_budget_bytes:
+                self._release_cold_data(sizes)
+                self._sizes = {
+                    dataset_id: self._datasets[dataset_id].get_resident_size()
+                    for dataset_id in self._recently_used
+                }
+
+        return target_dataset
+
+    def _release_cold_data(self, sizes: Dict[str, int]) -> None:
+        """Release data, least recently used first, until within the budget.
+
+        Called with the lock held.
+
+        Args:
+            sizes (Dict[str, int]): The resident size of each dataset.
+        """
+        total_size = sum(sizes.values())
+
+        # The most recently used dataset is about to be used, so it is kept
+        for dataset_id in list(self._recently_used)[:-1]:
+            if total_size <= self.memory_budget_bytes:
+                break
+
+            if sizes[dataset_id] == 0:
+                continue
+
+            self._datasets[dataset_id].release_data()
+            total_size -= sizes[dataset_id]
+            logger.info(
+                f"Released {sizes[dataset_id]} bytes of dataset {dataset_id}, "
+                f"{total_size} bytes remain loaded"
+            )
+
+
 DATASETS = [
     dataset.CSVDataset(
         "sample_data/sales_forecasting.csv",
@@ -84,8 +188,13 @@ DATASETS = [
 ]
 
 
+_registry = DatasetRegistry(
+    DATASETS, memory_budget_bytes=constants.DATASET_MEMORY_BUDGET_BYTES
+)
+
+
 def get_datasets() -> List[dataset.Dataset]:
-    return DATASETS
+    return _registry.list()
 
 
 def get_dataset(dataset_id: str) -> Optional[dataset.Dataset]:
@@ -98,15 +207,9 @@ def get_dataset(dataset_id: str) -> Optional[dataset.Dataset]:
         Optional[dataset.Dataset]: The dataset.
     """
 
-    target_dataset = None
-
-    for dataset in get_datasets():
-        if str(dataset.id) == dataset_id:
-            target_dataset = dataset
-            break
+    target_dataset = _registry.get(dataset_id)
 
-    if target_dataset is not None:
-        return target_dataset
-    else:
+    if target_dataset is None:
         logging.error(f"Dataset id {dataset_id} does not exist!")
-        return None
+
+    return target_dataset
@@ -14,15 +14,46 @@
 
 import abc
 import dataclasses
+import functools
+import logging
 from concurrent import futures
 from datetime import datetime
-from typing import Any, Awaitable, Dict, List, Optional, Tuple, Union
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
 
 import pandas as pd
-from google.cloud import bigquery
+import pyarrow as pa
 
+import chart_formatters
+import constants
+import utils
 from models import completed_forecast_job, forecast_job_request
-from services import forecast_job_service
+from services import forecast_job_service, payload_cache, result_store
+
+logger = logging.getLogger(__name__)
+
+EVALUATION_PAYLOAD = "evaluation"
+EVALUATION_RESULT = "evaluation"
+PREDICTION_RESULT = "prediction"
+
+
+def _read_bigquery_table(table_id: str) -> pa.Table:
+    """Read a BigQuery table or view into an Arrow table.
+
+    Tables are read directly, through the BigQuery Storage Read API if it is
+    installed, instead of running a query. Views, e.g. the predictions of
+    AutoML models, can't be read directly, so they are queried.
+    """
+    client = utils.get_bigquery_client()
+
+    if client.get_table(table_id).table_type != "VIEW":
+        try:
+            return client.list_rows(table_id).to_arrow(create_bqstorage_client=True)
+        except Exception as ex:
+            logger.warning(f"Could not read table {table_id}, querying it: {ex}")
+
+    return client.query(f"SELECT * FROM `{table_id}`").to_arrow(
+        create_bqstorage_client=True
+    )
 
 
 class ForecastJobCoordinator(abc.ABC):
@@ -110,6 +141,33 @@ class ForecastJobCoordinator(abc.ABC):
         """
         pass
 
+    @abc.abstractmethod
+    def get_evaluation_payload(self, job_id: str) -> Optional[payload_cache.Payload]:
+        """Get the serialized evaluation response for a given job_id.
+
+        Args:
+            job_id (str): Job id.
+
+        Returns:
+            Optional[payload_cache.Payload]: The response payload.
+        """
+        pass
+
+    @abc.abstractmethod
+    def get_prediction_payload(
+        self, job_id: str, output_type: str
+    ) -> Optional[payload_cache.Payload]:
+        """Get the serialized prediction response for a given job_id.
+
+        Args:
+            job_id (str): Job id.
+            output_type (str): One of chart_formatters.OUTPUT_TYPES.
+
+        Returns:
+            Optional[payload_cache.Payload]: The response payload.
+        """
+        pass
+
 
 class MemoryTrainingJobCoordinator(ForecastJobCoordinator):
     """
@@ -120,12 +178,17 @@ class MemoryTrainingJobCoordinator(ForecastJobCoordinator):
     """
 
     def __init__(
-        self, forecast_job_service: forecast_job_service.ForecastJobService
+        self,
+        forecast_job_service: forecast_job_service.ForecastJobService,
+        payload_cache_max_bytes: int = payload_cache.DEFAULT_MAX_BYTES,
+        result_store_dir: str = constants.RESULT_STORE_DIR,
     ) -> None:
         """Initializes the manager.
 
         Args:
             training_service (training_service.TrainingJobService): The service used by each worker to run the training job.
+            payload_cache_max_bytes (int): The size of the cache of serialized responses.
+            result_store_dir (str): The directory result tables are stored in.
         """
         super().__init__()
         self._forecast_job_service = forecast_job_service
@@ -136,6 +199,11 @@ class MemoryTrainingJobCoordinator(ForecastJobCoordinator):
         ] = {}
         self._evaluation_uri_map: Dict[str, str] = {}
         self._prediction_uri_map: Dict[str, str] = {}
+        self._result_store = result_store.ResultStore(root_dir=result_store_dir)
+        # Results of completed jobs never change, so responses are built once
+        self._payload_cache = payload_cache.PayloadCache(
+            max_bytes=payload_cache_max_bytes
+        )
 
     def _process_request(
         self, request: forecast_job_request.ForecastJobRequest
@@ -172,6 +240,10 @@ class MemoryTrainingJobCoordinator(ForecastJobCoordinator):
             # Append completed training results
             self._completed_jobs[job_id] = result
 
+            if result.error_message is None:
+                # Downloads the result tables and builds the responses
+                self._thread_pool_executor.submit(self._materialize_payloads, job_id)
+
     def enqueue_job(self, request: forecast_job_request.ForecastJobRequest) -> str:
         """Enqueue the request to a job queue for later processing.
 
@@ -204,19 +276,16 @@ class MemoryTrainingJobCoordinator(ForecastJobCoordinator):
         """
         return list(self._completed_jobs.values())
 
-    def _get_bigquery_table_as_df(self, table_id: str) -> pd.DataFrame:
-        client = bigquery.Client()
-        query = f"""
-            SELECT *
-            FROM `{table_id}`
-        """
+    def _get_result_as_df(self, job_id: str, name: str, table_id: str) -> pd.DataFrame:
+        """Get a result table, downloading it into the result store only once."""
+        if result_store.is_file_uri(table_id):
+            # Computed locally, so there is nothing to download
+            return result_store.read_file(result_store.get_path(table_id)).to_pandas()
 
-        query_job = client.query(
-            query=query,
-        )
+        if not self._result_store.has(job_id, name):
+            self._result_store.write(job_id, name, _read_bigquery_table(table_id))
 
-        df = query_job.to_dataframe()
-        return df
+        return self._result_store.read(job_id, name)
 
     def get_request(
         self, job_id: str
@@ -269,7 +338,11 @@ class MemoryTrainingJobCoordinator(ForecastJobCoordinator):
             return None
 
         table_id = job.evaluation_uri
-        return self._get_bigquery_table_as_df(table_id=table_id) if table_id else None
+        return (
+            self._get_result_as_df(job_id, EVALUATION_RESULT, table_id=table_id)
+            if table_id
+            else None
+        )
 
     def get_prediction(self, job_id: str) -> Optional[pd.DataFrame]:
         """Get the prediction dataframe for a given job_id.
@@ -286,4 +359,109 @@ class MemoryTrainingJobCoordinator(ForecastJobCoordinator):
             return None
 
         table_id = job.prediction_uri
-        return self._get_bigquery_table_as_df(table_id=table_id) if table_id else None
+        return (
+            self._get_result_as_df(job_id, PREDICTION_RESULT, table_id=table_id)
+            if table_id
+            else None
+        )
+
+    def _build_evaluation_payload(self, job_id: str) -> Optional[payload_cache.Payload]:
+        evaluation = self.get_evaluation(job_id=job_id)
+
+        if evaluation is None:
+            return None
+
+        return payload_cache.serialize(chart_formatters.format_evaluation(evaluation))
+
+    def _build_prediction_payload(
+        self,
+        job_id: str,
+        output_type: str,
+        get_df_prediction: Callable[[], Optional[pd.DataFrame]],
+    ) -> Optional[payload_cache.Payload]:
+        job = self._completed_jobs.get(job_id)
+
+        if job is None:
+            return None
+
+        training_method = self._forecast_job_service.get_training_method(
+            job.request.training_method_id
+        )
+        if training_method is None:
+            raise ValueError(
+                f"Training method not found: {job.request.training_method_id}"
+            )
+
+        df_prediction = get_df_prediction()
+        if df_prediction is None:
+            return None
+
+        return payload_cache.serialize(
+            chart_formatters.format_prediction(
+                output_type=output_type,
+                job_request=job.request,
+                training_method=training_method,
+                df_history=job.request.dataset.df,
+                df_prediction=df_prediction,
+            )
+        )
+
+    def _materialize_payloads(self, job_id: str) -> None:
+        """Build all responses of a completed job, downloading its tables once."""
+        get_df_prediction = functools.lru_cache(maxsize=None)(
+            lambda: self.get_prediction(job_id=job_id)
+        )
+
+        try:
+            self._payload_cache.get_or_build(
+                (job_id, EVALUATION_PAYLOAD),
+                lambda: self._build_evaluation_payload(job_id=job_id),
+            )
+
+            for output_type in chart_formatters.OUTPUT_TYPES:
+                self._payload_cache.get_or_build(
+                    (job_id, output_type),
+                    lambda: self._build_prediction_payload(
+                        job_id=job_id,
+                        output_type=output_type,
+                        get_df_prediction=get_df_prediction,
+                    ),
+                )
+        except Exception as exception:
+            # The payloads are built again on request
+            logger.error(f"Could not materialize payloads of job {job_id}: {exception}")
+
+    def get_evaluation_payload(self, job_id: str) -> Optional[payload_cache.Payload]:
+        """Get the serialized evaluation response for a given job_id.
+
+        Args:
+            job_id (str): Job id.
+
+        Returns:
+            Optional[payload_cache.Payload]: The response payload.
+        """
+        return self._payload_cache.get_or_build(
+            (job_id, EVALUATION_PAYLOAD),
+            lambda: self._build_evaluation_payload(job_id=job_id),
+        )
+
+    def get_prediction_payload(
+        self, job_id: str, output_type: str
+    ) -> Optional[payload_cache.Payload]:
+        """Get the serialized prediction response for a given job_id.
+
+        Args:
+            job_id (str): Job id.
+            output_type (str): One of chart_formatters.OUTPUT_TYPES.
+
+        Returns:
+            Optional[payload_cache.Payload]: The response payload.
+        """
+        return self._payload_cache.get_or_build(
+            (job_id, output_type),
+            lambda: self._build_prediction_payload(
+                job_id=job_id,
+                output_type=output_type,
+                get_df_prediction=lambda: self.get_prediction(job_id=job_id),
+            ),
+        )
@@ -14,7 +14,7 @@
 
 import abc
 import datetime
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 import logging
 
 from models import completed_forecast_job, dataset
@@ -42,6 +42,19 @@ class ForecastJobService:
         # TODO: Register training methods
         self._training_registry = training_registry
 
+    def get_training_method(
+        self, training_method_id: str
+    ) -> Optional[training_method.TrainingMethod]:
+        """Get a registered training method by id.
+
+        Args:
+            training_method_id (str): The training method id.
+
+        Returns:
+            Optional[training_method.TrainingMethod]: The training method.
+        """
+        return self._training_registry.get(training_method_id)
+
     def run(
         self, request: ForecastJobRequest
     ) -> completed_forecast_job.CompletedForecastJob:
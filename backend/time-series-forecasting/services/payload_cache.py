@@ -0,0 +1,148 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import dataclasses
+import gzip
+import json
+import threading
+from concurrent import futures
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from fastapi.encoders import jsonable_encoder
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# Smaller payloads are not worth compressing, as in the GZip middleware
+GZIP_MIN_SIZE = 1000
+
+
+@dataclasses.dataclass
+class Payload:
+    """A JSON response body, serialized once and optionally gzipped."""
+
+    body: bytes
+    gzipped_body: Optional[bytes] = None
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + len(self.gzipped_body or b"")
+
+
+def serialize(content: Any, gzip_min_size: Optional[int] = GZIP_MIN_SIZE) -> Payload:
+    """Serialize content the way FastAPI's JSONResponse would.
+
+    Args:
+        content (Any): The content, as returned by an endpoint.
+        gzip_min_size (Optional[int]): Bodies from this size are also gzipped.
+            None disables gzipping.
+
+    Returns:
+        Payload: The serialized content.
+    """
+    body = json.dumps(
+        jsonable_encoder(content),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+    gzipped_body = None
+    if gzip_min_size is not None and len(body) >= gzip_min_size:
+        gzipped_body = gzip.compress(body, compresslevel=9)
+
+    return Payload(body=body, gzipped_body=gzipped_body)
+
+
+class PayloadCache:
+    """A thread-safe LRU cache of payloads, bounded by their total size.
+
+    Payloads are built at most once at a time per key: concurrent requests for
+    a payload that is being built wait for it instead of building it again.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._lock = threading.Lock()
+        self._payloads: "collections.OrderedDict[Hashable, Payload]" = (
+            collections.OrderedDict()
+        )
+        self._building: Dict[Hashable, futures.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._payloads)
+
+    def get(self, key: Hashable) -> Optional[Payload]:
+        with self._lock:
+            payload = self._payloads.get(key)
+            if payload is not None:
+                self._payloads.move_to_end(key)
+            return payload
+
+    def put(self, key: Hashable, payload: Payload) -> None:
+        if payload.size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._payloads:
+                self.size_bytes -= self._payloads.pop(key).size
+
+            self._payloads[key] = payload
+            self.size_bytes += payload.size
+
+            while self.size_bytes > self.max_bytes:
+                _, evicted = self._payloads.popitem(last=False)
+                self.size_bytes -= evicted.size
+
+    def get_or_build(
+        self, key: Hashable, build: Callable[[], Optional[Payload]]
+    ) -> Optional[Payload]:
+        """Get a payload, building and caching it if it is missing.
+
+        Args:
+            key (Hashable): The payload key.
+            build (Callable[[], Optional[Payload]]): Builds the payload, or
+                returns None if there is none, which is not cached.
+
+        Returns:
+            Optional[Payload]: The payload.
+        """
+        with self._lock:
+            payload = self._payloads.get(key)
+            if payload is not None:
+                self._payloads.move_to_end(key)
+                return payload
+
+            future = self._building.get(key)
+            is_builder = future is None
+            if is_builder:
+                future = futures.Future()
+                self._building[key] = future
+
+        if not is_builder:
+            return future.result()
+
+        try:
+            payload = build()
+            if payload is not None:
+                self.put(key, payload)
+            future.set_result(payload)
+            return payload
+        except BaseException as exception:
+            future.set_exception(exception)
+            raise
+        finally:
+            with self._lock:
+                del self._building[key]
@@ -0,0 +1,126 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import atexit
+import os
+import shutil
+import tempfile
+import uuid
+from typing import Optional
+
+import pandas as pd
+import pyarrow as pa
+from pyarrow import ipc
+
+RESULT_FILE_SUFFIX = ".arrow"
+# Results computed locally are referred to by file URIs instead of table ids
+FILE_URI_PREFIX = "file://"
+
+
+def is_file_uri(uri: str) -> bool:
+    return uri.startswith(FILE_URI_PREFIX)
+
+
+def get_file_uri(path: str) -> str:
+    return FILE_URI_PREFIX + os.path.abspath(path)
+
+
+def get_path(file_uri: str) -> str:
+    return file_uri[len(FILE_URI_PREFIX) :]
+
+
+def write_file(path: str, table: pa.Table) -> None:
+    """Write a table to an Arrow IPC file, atomically.
+
+    Args:
+        path (str): The file path.
+        table (pa.Table): The table.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            with ipc.new_file(f, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def read_file(path: str) -> pa.Table:
+    """Read an Arrow IPC file, memory-mapped rather than copied."""
+    with pa.memory_map(path, "r") as source:
+        return ipc.open_file(source).read_all()
+
+
+class ResultStore:
+    """Stores result tables of jobs as local Arrow IPC files.
+
+    Tables are written once, atomically, and memory-mapped when read, so
+    reading a result doesn't go back to BigQuery and doesn't copy the file.
+
+    Job ids are only unique within a process, so each store keeps its files in
+    a directory of its own. Stores of other worker processes, or of earlier
+    runs, then never serve each other's results. The directory is deleted when
+    the process exits.
+    """
+
+    def __init__(self, root_dir: str) -> None:
+        """Initializes the store.
+
+        Args:
+            root_dir (str): The directory the store's own directory is created
+                in. Results are stored there, one subdirectory per job.
+        """
+        self.root_dir = os.path.join(root_dir, uuid.uuid4().hex)
+        atexit.register(self.close)
+
+    def close(self) -> None:
+        """Delete the store's directory, along with all results."""
+        shutil.rmtree(self.root_dir, ignore_errors=True)
+
+    def _get_path(self, job_id: str, name: str) -> str:
+        return os.path.join(self.root_dir, job_id, name + RESULT_FILE_SUFFIX)
+
+    def has(self, job_id: str, name: str) -> bool:
+        return os.path.exists(self._get_path(job_id, name))
+
+    def write(self, job_id: str, name: str, table: pa.Table) -> None:
+        """Write a result table.
+
+        Args:
+            job_id (str): Job id.
+            name (str): The result name, e.g. "prediction".
+            table (pa.Table): The result.
+        """
+        write_file(self._get_path(job_id, name), table)
+
+    def read(self, job_id: str, name: str) -> Optional[pd.DataFrame]:
+        """Read a result table.
+
+        Args:
+            job_id (str): Job id.
+            name (str): The result name, e.g. "prediction".
+
+        Returns:
+            Optional[pd.DataFrame]: The result, or None if it is not stored.
+        """
+        path = self._get_path(job_id, name)
+
+        if not os.path.exists(path):
+            return None
+
+        return read_file(path).to_pandas()
@@ -0,0 +1,243 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Reuses BigQuery tables of datasets that were already uploaded.
+
+Uploads are keyed by the dataset id, a hash of the uploaded rows, the dataset
+portion and the schema, so a table is only reused if it holds exactly the same
+data. The keys and their tables are recorded in a local JSON manifest, which
+lets the cache survive restarts.
+
+Tables older than the maximum age are deleted, and are expired by BigQuery as
+well in case the manifest is lost. Tables are only reused while they are
+younger than the maximum age minus the reuse margin, so a job that gets a
+table has at least that long to use it before it is deleted. With several worker processes, the last one
+to write the manifest wins. The tables missing from it, like those replaced
+once they stopped being reused, are left for BigQuery to expire.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+from google.api_core import exceptions
+
+import utils
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_AGE_SECONDS = 7 * 24 * 60 * 60
+# How often expired tables are looked for
+GARBAGE_COLLECTION_INTERVAL_SECONDS = 60 * 60
+# How long a job may still use a table after getting it from the cache
+REUSE_MARGIN_SECONDS = 24 * 60 * 60
+# BigQuery expires tables later than the cache deletes them, so it only
+# deletes the tables the cache lost track of
+BIGQUERY_EXPIRATION_MARGIN_SECONDS = 24 * 60 * 60
+
+
+def get_content_hash(df: pd.DataFrame) -> str:
+    """Hash the rows of a dataframe, including their order."""
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+    return hashlib.sha256(row_hashes.tobytes()).hexdigest()
+
+
+def get_key(
+    dataset_id: str,
+    df: pd.DataFrame,
+    dataset_portion: Optional[str],
+    schema: List[Tuple[str, str]],
+) -> str:
+    """Get the key of an upload.
+
+    Args:
+        dataset_id (str): The dataset id.
+        df (pd.DataFrame): The uploaded rows.
+        dataset_portion (Optional[str]): `train`, `test` or None.
+        schema (List[Tuple[str, str]]): The (column, type) pairs of the schema
+            given to BigQuery.
+
+    Returns:
+        str: The key.
+    """
+    key = {
+        "dataset_id": dataset_id,
+        "content_hash": get_content_hash(df),
+        "dataset_portion": dataset_portion,
+        "columns": [[column, str(dtype)] for column, dtype in df.dtypes.items()],
+        "schema": [list(field) for field in schema],
+    }
+
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+class UploadCache:
+    """Maps upload keys to BigQuery table ids, persisted in a manifest file."""
+
+    def __init__(
+        self,
+        manifest_path: str,
+        max_age_seconds: float = DEFAULT_MAX_AGE_SECONDS,
+        reuse_margin_seconds: float = REUSE_MARGIN_SECONDS,
+        table_exists: Optional[Callable[[str], bool]] = None,
+        delete_table: Optional[Callable[[str], None]] = None,
+    ) -> None:
+        """Initializes the cache.
+
+        Args:
+            manifest_path (str): The JSON file recording the uploads.
+            max_age_seconds (float): The age after which tables are deleted.
+            reuse_margin_seconds (float): How long before their deletion
+                tables stop being reused.
+            table_exists (Optional[Callable[[str], bool]]): Checks that a table
+                wasn't deleted outside of the cache. Defaults to BigQuery.
+            delete_table (Optional[Callable[[str], None]]): Deletes a table and
+                its BigQuery dataset. Defaults to BigQuery.
+        """
+        self.manifest_path = manifest_path
+        self.max_age_seconds = max_age_seconds
+        self.reuse_margin_seconds = reuse_margin_seconds
+        self._table_exists = table_exists or _bigquery_table_exists
+        self._delete_table = delete_table or _delete_bigquery_table
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self._entries: Dict[str, Dict[str, Any]] = self._read_manifest()
+        self._last_garbage_collection = 0.0
+
+    def _read_manifest(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self.manifest_path):
+            return {}
+
+        try:
+            with open(self.manifest_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError) as exception:
+            logger.error(f"Could not read upload manifest, starting over: {exception}")
+            return {}
+
+    def _write_manifest(self) -> None:
+        """Write the manifest atomically. Called with the lock held."""
+        directory = os.path.dirname(os.path.abspath(self.manifest_path))
+        os.makedirs(directory, exist_ok=True)
+
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self._entries, f)
+        os.replace(temp_path, self.manifest_path)
+
+    def _is_expired(self, entry: Dict[str, Any], now: float) -> bool:
+        return now - entry["created_at"] > self.max_age_seconds
+
+    def _is_reusable(self, entry: Dict[str, Any], now: float) -> bool:
+        return (
+            now - entry["created_at"]
+            <= self.max_age_seconds - self.reuse_margin_seconds
+        )
+
+    def get_or_upload(self, key: str, upload: Callable[[], str]) -> str:
+        """Get the table of an upload, uploading it if it isn't cached.
+
+        Concurrent calls with the same key wait for a single upload.
+
+        Args:
+            key (str): The key, see get_key.
+            upload (Callable[[], str]): Uploads the data and returns the table id.
+
+        Returns:
+            str: The BigQuery table id.
+        """
+        self.collect_garbage()
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+
+            if entry is not None and self._is_reusable(entry, time.time()):
+                if self._table_exists(entry["table_id"]):
+                    return entry["table_id"]
+
+                logger.warning(f"Cached table {entry['table_id']} no longer exists")
+
+            table_id = upload()
+
+            with self._lock:
+                self._entries[key] = {"table_id": table_id, "created_at": time.time()}
+                self._write_manifest()
+
+            return table_id
+
+    def collect_garbage(self, force: bool = False) -> None:
+        """Delete tables older than the maximum age.
+
+        Args:
+            force (bool): Look for expired tables even if it was done recently.
+        """
+        now = time.time()
+
+        with self._lock:
+            if (
+                not force
+                and now - self._last_garbage_collection
+                < GARBAGE_COLLECTION_INTERVAL_SECONDS
+            ):
+                return
+
+            self._last_garbage_collection = now
+            expired = {
+                key: entry
+                for key, entry in self._entries.items()
+                if self._is_expired(entry, now)
+            }
+
+        for key, entry in expired.items():
+            try:
+                self._delete_table(entry["table_id"])
+            except Exception as exception:
+                # Tried again at the next collection
+                logger.error(f"Could not delete table {entry['table_id']}: {exception}")
+                continue
+
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+
+        if expired:
+            with self._lock:
+                self._write_manifest()
+
+
+def _bigquery_table_exists(table_id: str) -> bool:
+    try:
+        utils.get_bigquery_client().get_table(table_id)
+        return True
+    except exceptions.NotFound:
+        return False
+
+
+def _delete_bigquery_table(table_id: str) -> None:
+    """Delete a table along with the BigQuery dataset created for it."""
+    dataset_id = table_id.rsplit(".", 1)[0]
+    utils.get_bigquery_client().delete_dataset(
+        dataset_id, delete_contents=True, not_found_ok=True
+    )
@@ -0,0 +1,69 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("google.cloud.bigquery")
+
+import chart_formatters
+
+
+def format_for_rechart(df: pd.DataFrame):
+    return chart_formatters.format_for_rechart(
+        time_series_identifier_column="series",
+        time_column="date",
+        target_column="sales",
+        data=df,
+    )
+
+
+def test_rechart_rows_have_a_column_per_series():
+    df = pd.DataFrame(
+        {
+            "series": ["b", "a", "a", None],
+            "date": pd.to_datetime(
+                ["2020-01-02", "2020-01-01", "2020-01-02", "2020-01-03"]
+            ),
+            "sales": [3, 1, 2, 4],
+        }
+    )
+
+    rows, first_time, last_time = format_for_rechart(df)
+
+    assert rows == [
+        {"name": "2020-01-01T00:00:00", "a": 1, "b": None},
+        {"name": "2020-01-02T00:00:00", "a": 2, "b": 3},
+        # The time of a row without a series is still charted
+        {"name": "2020-01-03T00:00:00", "a": None, "b": None},
+    ]
+    assert (first_time, last_time) == ("2020-01-01T00:00:00", "2020-01-03T00:00:00")
+
+
+def test_rechart_leaves_out_rows_without_a_time():
+    df = pd.DataFrame(
+        {
+            "series": ["a", "a", "a"],
+            "date": pd.to_datetime(["2020-01-01", "2020-01-02", None]),
+            "sales": [1.0, 2.0, 99.0],
+        }
+    )
+
+    rows, first_time, last_time = format_for_rechart(df)
+
+    assert rows == [
+        {"name": "2020-01-01T00:00:00", "a": 1.0},
+        {"name": "2020-01-02T00:00:00", "a": 2.0},
+    ]
+    assert last_time == "2020-01-02T00:00:00"
@@ -0,0 +1,173 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("google.cloud.bigquery")
+
+from models import dataset
+
+
+class DataFrameDataset(dataset.Dataset):
+    """A dataset of an in-memory dataframe, in the given row order."""
+
+    def __init__(self, df: pd.DataFrame, **attributes) -> None:
+        self._df = df
+        self.time_column = "date"
+        self.__dict__.update(attributes)
+
+    @cached_property
+    def df(self) -> pd.DataFrame:
+        return self._df
+
+
+def make_df(lengths, shuffle: bool = False) -> pd.DataFrame:
+    """Daily rows of series "a", "b", ..., all ending on the same day."""
+    end = pd.Timestamp("2021-01-31")
+    df = pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "series": chr(ord("a") + i),
+                    "date": pd.date_range(end=end, periods=length, freq="D"),
+                    "sales": np.arange(length, dtype=np.float64),
+                }
+            )
+            for i, length in enumerate(lengths)
+        ]
+    )
+
+    if shuffle:
+        return df.sample(frac=1, random_state=0).reset_index(drop=True)
+
+    return df.sort_values("date", kind="stable").reset_index(drop=True)
+
+
+def get_times(df: pd.DataFrame):
+    return sorted(df["date"].unique())
+
+
+@pytest.mark.parametrize("shuffle", [False, True])
+def test_fraction_holdout_trains_on_one_more_than_the_share_of_times(shuffle):
+    df = make_df([10, 10], shuffle=shuffle)
+    ds = DataFrameDataset(df, train_percentage=0.8)
+
+    # Kept from the original split: round(10 * 0.8) + 1 times for training
+    assert ds.date_cutoff == pd.Timestamp("2021-01-30")
+    assert len(get_times(ds.df_train)) == 9
+    assert len(get_times(ds.df_test)) == 1
+    assert len(ds.df_train) + len(ds.df_test) == len(df)
+
+
+@pytest.mark.parametrize("holdout_periods", [1, 3, 9])
+def test_last_n_periods_holdout(holdout_periods):
+    ds = DataFrameDataset(
+        make_df([10]),
+        holdout_strategy=dataset.HOLDOUT_LAST_N_PERIODS,
+        holdout_periods=holdout_periods,
+    )
+
+    assert len(get_times(ds.df_test)) == holdout_periods
+    assert len(get_times(ds.df_train)) == 10 - holdout_periods
+
+
+@pytest.mark.parametrize("holdout_periods", [None, 0, 10])
+def test_last_n_periods_holdout_must_leave_times_for_training(holdout_periods):
+    ds = DataFrameDataset(
+        make_df([10]),
+        holdout_strategy=dataset.HOLDOUT_LAST_N_PERIODS,
+        holdout_periods=holdout_periods,
+    )
+
+    with pytest.raises(ValueError, match="between 1 and 9"):
+        ds.df_train
+
+
+def test_per_series_holdout_of_last_periods():
+    ds = DataFrameDataset(
+        make_df([10, 4], shuffle=True),
+        holdout_strategy=dataset.HOLDOUT_PER_SERIES,
+        holdout_periods=2,
+        holdout_series_column="series",
+    )
+
+    for series, length in [("a", 10), ("b", 4)]:
+        df_test = ds.df_test[ds.df_test["series"] == series]
+        df_train = ds.df_train[ds.df_train["series"] == series]
+        assert get_times(df_test) == list(
+            pd.date_range(end="2021-01-31", periods=2, freq="D")
+        )
+        assert len(df_train) == length - 2
+
+
+def test_per_series_holdout_mirrors_fraction_within_each_series():
+    ds = DataFrameDataset(
+        make_df([10, 5], shuffle=True),
+        train_percentage=0.8,
+        holdout_strategy=dataset.HOLDOUT_PER_SERIES,
+        holdout_series_column="series",
+    )
+
+    for series, length in [("a", 10), ("b", 5)]:
+        series_ds = DataFrameDataset(make_df([length]), train_percentage=0.8)
+        df_train = ds.df_train[ds.df_train["series"] == series]
+        assert len(get_times(df_train)) == len(get_times(series_ds.df_train))
+        assert len(df_train) + (ds.df_test["series"] == series).sum() == length
+
+
+def test_per_series_holdout_requires_series_column():
+    ds = DataFrameDataset(make_df([10]), holdout_strategy=dataset.HOLDOUT_PER_SERIES)
+
+    with pytest.raises(ValueError, match="holdout_series_column"):
+        ds.df_train
+
+
+def test_unknown_holdout_strategy():
+    ds = DataFrameDataset(make_df([10]), holdout_strategy="random")
+
+    with pytest.raises(ValueError, match="Unknown holdout strategy"):
+        ds.df_train
+
+
+def test_sorted_datasets_are_split_into_slices_of_df():
+    df = make_df([10, 10])
+    ds = dataset.CSVDataset(
+        io.StringIO(df.to_csv(index=False)),
+        display_name="Sales",
+        time_column="date",
+        description="",
+    )
+
+    sales = ds.df["sales"].to_numpy()
+    assert np.shares_memory(ds.df_train["sales"].to_numpy(), sales)
+    assert np.shares_memory(ds.df_test["sales"].to_numpy(), sales)
+    assert ds._split_size == 0
+
+    # Same split as by masking the rows of an unsorted dataset
+    unsorted_ds = DataFrameDataset(make_df([10, 10], shuffle=True))
+    assert not unsorted_ds._is_split_by_slicing()
+    for portion, unsorted_portion in [
+        (ds.df_train, unsorted_ds.df_train),
+        (ds.df_test, unsorted_ds.df_test),
+    ]:
+        assert len(portion) == len(unsorted_portion)
+        # CSV times are read as UTC
+        assert portion["date"].max().tz_localize(None) == (
+            unsorted_portion["date"].max()
+        )
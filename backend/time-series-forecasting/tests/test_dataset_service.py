@@ -0,0 +1,129 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+
+import pytest
+
+pytest.importorskip("google.cloud.bigquery")
+
+from models import dataset
+from services import dataset_service
+
+
+class FakeDataset:
+    """A dataset whose data has a fixed size once loaded."""
+
+    def __init__(self, id: str, size: int) -> None:
+        self.id = id
+        self.size = size
+        self.is_loaded = False
+
+    def load(self) -> None:
+        self.is_loaded = True
+
+    def get_resident_size(self) -> int:
+        return self.size if self.is_loaded else 0
+
+    def release_data(self) -> None:
+        self.is_loaded = False
+
+
+def make_csv_dataset(id: str) -> dataset.CSVDataset:
+    lines = [f"2021-01-{day:02},{day}" for day in range(1, 29)]
+
+    return dataset.CSVDataset(
+        io.StringIO("date,sales\n" + "\n".join(lines)),
+        display_name=id,
+        time_column="date",
+        description="",
+        id=id,
+    )
+
+
+def test_least_recently_used_data_is_released():
+    datasets = [FakeDataset(id, size=100) for id in ["a", "b", "c"]]
+    registry = dataset_service.DatasetRegistry(datasets, memory_budget_bytes=250)
+
+    for target_dataset in datasets:
+        registry.get(target_dataset.id).load()
+    registry.get("c")
+
+    assert [target_dataset.is_loaded for target_dataset in datasets] == [
+        False,
+        True,
+        True,
+    ]
+
+    # Using a dataset makes it the most recently used
+    registry.get("b")
+    registry.get("a").load()
+    registry.get("a")
+    assert [target_dataset.is_loaded for target_dataset in datasets] == [
+        True,
+        True,
+        False,
+    ]
+
+
+def test_most_recently_used_data_is_kept_over_budget():
+    target_dataset = FakeDataset("a", size=100)
+    registry = dataset_service.DatasetRegistry(
+        [target_dataset], memory_budget_bytes=50
+    )
+
+    registry.get("a").load()
+    registry.get("a")
+
+    assert target_dataset.is_loaded
+    assert registry.get("missing") is None
+
+
+def test_budget_is_only_checked_when_sizes_change(monkeypatch):
+    target_dataset = FakeDataset("a", size=100)
+    registry = dataset_service.DatasetRegistry(
+        [target_dataset], memory_budget_bytes=250
+    )
+    checks = []
+    release_cold_data = registry._release_cold_data
+    monkeypatch.setattr(
+        registry,
+        "_release_cold_data",
+        lambda sizes: checks.append(sizes) or release_cold_data(sizes),
+    )
+
+    registry.get("a")
+    registry.get("a")
+    assert checks == [{"a": 0}]
+
+    target_dataset.load()
+    registry.get("a")
+    registry.get("a")
+    assert checks == [{"a": 0}, {"a": 100}]
+
+
+def test_released_datasets_are_loaded_again():
+    first, second = make_csv_dataset("first"), make_csv_dataset("second")
+    registry = dataset_service.DatasetRegistry([first, second], memory_budget_bytes=1)
+
+    df_train = registry.get("first").df_train.copy()
+    # The in-memory table of an uploaded CSV is counted
+    assert first.get_resident_size() > first._df_size
+
+    registry.get("second").df
+    registry.get("second")
+
+    assert first.get_resident_size() == 0
+    assert "table" not in first.__dict__
+    assert registry.get("first").df_train.equals(df_train)
@@ -0,0 +1,80 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from types import SimpleNamespace
+
+import pyarrow as pa
+import pytest
+
+pytest.importorskip("google.cloud.bigquery")
+
+import utils
+from services import forecast_job_coordinator
+
+RESULT = pa.table({"value": [1.0, 2.0]})
+
+
+class FakeBigQueryClient:
+    """Serves one table or view, failing the reads BigQuery fails."""
+
+    def __init__(self, table_type: str, can_list_rows: bool = True) -> None:
+        self.table_type = table_type
+        self.can_list_rows = can_list_rows
+        self.queries = []
+
+    def get_table(self, table_id: str):
+        return SimpleNamespace(table_type=self.table_type)
+
+    def list_rows(self, table_id: str):
+        if self.table_type == "VIEW" or not self.can_list_rows:
+            raise RuntimeError(f"Cannot list rows of {table_id}")
+        return SimpleNamespace(to_arrow=lambda create_bqstorage_client: RESULT)
+
+    def query(self, query: str):
+        self.queries.append(query)
+        return SimpleNamespace(to_arrow=lambda create_bqstorage_client: RESULT)
+
+
+@pytest.fixture
+def coordinator(tmp_path):
+    return forecast_job_coordinator.MemoryTrainingJobCoordinator(
+        forecast_job_service=None, result_store_dir=str(tmp_path)
+    )
+
+
+@pytest.mark.parametrize(
+    "client,expected_queries",
+    [
+        (FakeBigQueryClient("TABLE"), []),
+        # e.g. the predictions of AutoML models
+        (FakeBigQueryClient("VIEW"), ["SELECT * FROM `project.dataset.result`"]),
+        (
+            FakeBigQueryClient("TABLE", can_list_rows=False),
+            ["SELECT * FROM `project.dataset.result`"],
+        ),
+    ],
+)
+def test_result_tables_and_views_are_downloaded(
+    monkeypatch, coordinator, client, expected_queries
+):
+    monkeypatch.setattr(utils, "get_bigquery_client", lambda: client)
+
+    for _ in range(2):
+        df = coordinator._get_result_as_df(
+            "job", "prediction", "project.dataset.result"
+        )
+        assert df["value"].tolist() == [1.0, 2.0]
+
+    # The second read comes from the result store
+    assert client.queries == expected_queries
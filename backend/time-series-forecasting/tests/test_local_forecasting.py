@@ -0,0 +1,239 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import constants
+import local_forecasting
+
+
+def make_daily_series(series: int, length: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    times = pd.date_range("2021-01-04", periods=length, freq="D")
+    season = 10 * np.sin(np.arange(length) * 2 * np.pi / 7)
+    values = 100 + season + rng.normal(size=(series, length))
+
+    return pd.DataFrame(
+        {
+            "series": np.repeat([f"series_{i}" for i in range(series)], length),
+            "date": np.tile(times.strftime("%Y-%m-%d"), series),
+            "sales": values.ravel(),
+        }
+    )
+
+
+def test_aggregate_series_sums_each_period():
+    df = pd.DataFrame(
+        {
+            "series": ["b", "a", "a", "a", "a", None],
+            "date": [
+                "2021-01-01 00:00",
+                "2021-01-02 10:00",
+                "2021-01-01 08:00",
+                "2021-01-01 20:00",
+                "2021-01-03 00:00",
+                "2021-01-01 00:00",
+            ],
+            "sales": [5.0, 2.0, 1.0, 3.0, np.nan, 7.0],
+        }
+    )
+
+    df_series = local_forecasting.aggregate_series(
+        df,
+        time_series_identifier_column="series",
+        time_column="date",
+        target_column="sales",
+        data_frequency="DAILY",
+    )
+
+    assert df_series["series_id"].tolist() == ["a", "a", "b"]
+    assert df_series["period"].tolist() == [
+        pd.Timestamp("2021-01-01"),
+        pd.Timestamp("2021-01-02"),
+        pd.Timestamp("2021-01-01"),
+    ]
+    assert df_series["value"].tolist() == [4.0, 2.0, 5.0]
+    # Steps count periods, so consecutive days are one step apart
+    assert np.diff(df_series["step"].iloc[:2]).tolist() == [1]
+
+
+def test_weekly_periods_start_on_monday():
+    df = pd.DataFrame(
+        {
+            "series": ["a"] * 3,
+            # A Wednesday and a Sunday of the same week, then the next Monday
+            "date": ["2021-01-06", "2021-01-10", "2021-01-11"],
+            "sales": [1.0, 2.0, 4.0],
+        }
+    )
+
+    df_series = local_forecasting.aggregate_series(
+        df,
+        time_series_identifier_column="series",
+        time_column="date",
+        target_column="sales",
+        data_frequency="WEEKLY",
+    )
+
+    assert df_series["period"].tolist() == [
+        pd.Timestamp("2021-01-04"),
+        pd.Timestamp("2021-01-11"),
+    ]
+    assert df_series["value"].tolist() == [3.0, 4.0]
+    assert np.diff(df_series["step"]).tolist() == [1]
+
+    forecast_times = local_forecasting._get_forecast_times(
+        df_series["period"].iloc[-1:],
+        horizon=2,
+        frequency=local_forecasting.DATA_FREQUENCIES["WEEKLY"],
+    )
+    assert pd.DatetimeIndex(forecast_times).tolist() == [
+        pd.Timestamp("2021-01-18"),
+        pd.Timestamp("2021-01-25"),
+    ]
+
+
+@pytest.mark.parametrize(
+    "data_frequency,dates,expected_periods,expected_forecast_times",
+    [
+        (
+            "MONTHLY",
+            ["2021-01-15", "2021-02-28", "2021-04-03"],
+            ["2021-01-01", "2021-02-01", "2021-04-01"],
+            ["2021-05-01", "2021-06-01"],
+        ),
+        (
+            "QUARTERLY",
+            ["2021-02-15", "2021-06-30", "2021-12-31"],
+            ["2021-01-01", "2021-04-01", "2021-10-01"],
+            ["2022-01-01", "2022-04-01"],
+        ),
+    ],
+)
+def test_periods_and_forecast_times_follow_calendar(
+    data_frequency, dates, expected_periods, expected_forecast_times
+):
+    df = pd.DataFrame({"series": ["a"] * 3, "date": dates, "sales": [1.0, 2.0, 3.0]})
+
+    df_series = local_forecasting.aggregate_series(
+        df,
+        time_series_identifier_column="series",
+        time_column="date",
+        target_column="sales",
+        data_frequency=data_frequency,
+    )
+
+    assert df_series["period"].tolist() == [pd.Timestamp(p) for p in expected_periods]
+    # The skipped period is a gap of two steps, filled in before fitting
+    assert np.diff(df_series["step"]).tolist() == [1, 2]
+
+    forecast_times = local_forecasting._get_forecast_times(
+        df_series["period"].iloc[-1:],
+        horizon=2,
+        frequency=local_forecasting.DATA_FREQUENCIES[data_frequency],
+    )
+    assert pd.DatetimeIndex(forecast_times).tolist() == [
+        pd.Timestamp(t) for t in expected_forecast_times
+    ]
+
+
+def test_fill_gaps_interpolates_missing_periods():
+    values = local_forecasting._fill_gaps(
+        np.array([10, 11, 14]), np.array([1.0, 2.0, 8.0])
+    )
+
+    assert values.tolist() == [1.0, 2.0, 4.0, 6.0, 8.0]
+
+
+@pytest.mark.parametrize(
+    "times,expected",
+    [
+        (["2021-01-01 00:00", "2021-01-01 01:00", "2021-01-01 02:00"], "HOURLY"),
+        (["2021-01-01", "2021-01-08", "2021-01-15"], "WEEKLY"),
+        (["2021-01-01", "2021-02-01", "2021-03-01", "2021-04-01"], "MONTHLY"),
+    ],
+)
+def test_infer_data_frequency_of_string_times(times, expected):
+    assert local_forecasting.infer_data_frequency(pd.Series(times)) == expected
+
+
+@pytest.mark.parametrize("model", list(local_forecasting.FORECASTERS))
+def test_forecasters_return_horizon_with_bounds(model):
+    values = 100 + 10 * np.sin(np.arange(60) * 2 * np.pi / 7) + np.arange(60) * 0.1
+
+    forecast, lower, upper, evaluation = local_forecasting.FORECASTERS[model](
+        values, 14, 0.8, 7
+    )
+
+    for array in (forecast, lower, upper):
+        assert array.shape == (14,)
+        assert np.isfinite(array).all()
+    assert (lower <= forecast + 1e-9).all() and (forecast <= upper + 1e-9).all()
+    assert evaluation["error_message"] is None
+
+
+@pytest.mark.parametrize(
+    "model",
+    [
+        local_forecasting.MODEL_ETS,
+        local_forecasting.MODEL_THETA,
+        local_forecasting.MODEL_ARIMA,
+    ],
+)
+@pytest.mark.parametrize("length", [1, 2])
+def test_forecasters_fall_back_on_short_series(model, length):
+    values = np.arange(length, dtype=np.float64) + 5
+
+    forecast, lower, upper, evaluation = local_forecasting.FORECASTERS[model](
+        values, 3, 0.8, 7
+    )
+
+    assert forecast.tolist() == [values[-1]] * 3
+    assert lower.shape == upper.shape == (3,)
+    assert evaluation["error_message"]
+
+
+def test_forecast_returns_prediction_and_evaluation_per_series():
+    df = make_daily_series(series=3, length=42)
+
+    result = local_forecasting.forecast(
+        df,
+        time_series_identifier_column="series",
+        time_column="date",
+        target_column="sales",
+        data_frequency=local_forecasting.AUTO_FREQUENCY,
+        horizon=7,
+        model=local_forecasting.MODEL_SEASONAL_NAIVE,
+        max_workers=1,
+    )
+
+    prediction = result.prediction.to_pandas()
+    assert prediction.columns.tolist() == [
+        constants.FORECAST_TIME_SERIES_IDENTIFIER_COLUMN,
+        constants.FORECAST_TIME_COLUMN,
+        constants.FORECAST_TARGET_COLUMN,
+        constants.FORECAST_TARGET_COLUMN_LOWER_BOUND,
+        constants.FORECAST_TARGET_COLUMN_UPPER_BOUND,
+    ]
+    assert len(prediction) == 3 * 7
+    times = prediction[constants.FORECAST_TIME_COLUMN]
+    assert str(times.dt.tz) == "UTC"
+    assert times.min() == pd.Timestamp("2021-02-15", tz="UTC")
+    assert times.max() == pd.Timestamp("2021-02-21", tz="UTC")
+
+    evaluation = result.evaluation.to_pandas()
+    assert evaluation["series"].tolist() == ["series_0", "series_1", "series_2"]
+    assert (evaluation["model"] == local_forecasting.MODEL_SEASONAL_NAIVE).all()
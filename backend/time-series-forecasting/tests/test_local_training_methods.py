@@ -0,0 +1,110 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("google.cloud.bigquery")
+
+import constants
+import local_forecasting
+from models import dataset
+from services import result_store
+from training_methods import (
+    local_arima_training_method,
+    local_statistical_training_method,
+)
+
+MODEL_PARAMETERS = {
+    "timeColumn": "date",
+    "targetColumn": "sales",
+    "timeSeriesIdentifierColumn": "store",
+}
+
+
+@pytest.fixture
+def csv_dataset(monkeypatch, tmp_path):
+    monkeypatch.setattr(constants, "LOCAL_MODEL_DIR", str(tmp_path))
+
+    rng = np.random.default_rng(0)
+    times = pd.date_range("2021-01-01", periods=60, freq="D")
+    lines = [
+        f"{time.date()},{store},{100 + rng.normal()}"
+        for store in ["north", "south"]
+        for time in times
+    ]
+
+    return dataset.CSVDataset(
+        io.StringIO("date,store,sales\n" + "\n".join(lines)),
+        display_name="Sales",
+        time_column="date",
+        description="",
+    )
+
+
+def read_result(uri: str) -> pd.DataFrame:
+    return result_store.read_file(result_store.get_path(uri)).to_pandas()
+
+
+def test_local_arima_requires_data_frequency(csv_dataset):
+    method = local_arima_training_method.LocalARIMATrainingMethod()
+
+    with pytest.raises(ValueError, match="dataFrequency"):
+        method.train(csv_dataset, MODEL_PARAMETERS, {"forecastHorizon": 7})
+
+
+def test_local_arima_always_fits_arima(csv_dataset):
+    method = local_arima_training_method.LocalARIMATrainingMethod()
+
+    model = method.train(
+        csv_dataset,
+        {**MODEL_PARAMETERS, "dataFrequency": "daily", "model": "ets"},
+        {"forecastHorizon": 7},
+    )
+
+    evaluation = read_result(method.evaluate(model))
+    assert (evaluation["model"] == local_forecasting.MODEL_ARIMA).all()
+    prediction = read_result(method.predict(csv_dataset, model, {}, {}))
+    assert len(prediction) == 2 * 7
+
+
+def test_local_statistical_writes_results_per_model(csv_dataset):
+    method = local_statistical_training_method.LocalStatisticalTrainingMethod()
+
+    first_model = method.train(csv_dataset, MODEL_PARAMETERS, {"forecastHorizon": 7})
+    second_model = method.train(
+        csv_dataset,
+        {**MODEL_PARAMETERS, "model": local_forecasting.MODEL_SEASONAL_NAIVE},
+        {"forecastHorizon": 7},
+    )
+
+    assert first_model != second_model
+    evaluation = read_result(method.evaluate(first_model))
+    assert (evaluation["model"] == local_forecasting.MODEL_ETS).all()
+    evaluation = read_result(method.evaluate(second_model))
+    assert (evaluation["model"] == local_forecasting.MODEL_SEASONAL_NAIVE).all()
+
+
+def test_local_statistical_rejects_unknown_model(csv_dataset):
+    method = local_statistical_training_method.LocalStatisticalTrainingMethod()
+
+    with pytest.raises(ValueError, match="Unsupported model"):
+        method.train(
+            csv_dataset,
+            {**MODEL_PARAMETERS, "model": "prophet"},
+            {"forecastHorizon": 7},
+        )
@@ -0,0 +1,96 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+from concurrent import futures
+
+import pytest
+
+from services import payload_cache
+
+
+def make_payload(size: int) -> payload_cache.Payload:
+    return payload_cache.Payload(body=b"x" * size)
+
+
+def test_concurrent_requests_build_payload_once():
+    cache = payload_cache.PayloadCache()
+    started = threading.Event()
+    release = threading.Event()
+    builds = []
+
+    def build():
+        builds.append(1)
+        started.set()
+        release.wait(timeout=5)
+        return payload_cache.serialize({"rows": [1, 2, 3]})
+
+    with futures.ThreadPoolExecutor(max_workers=4) as executor:
+        first = executor.submit(cache.get_or_build, "job", build)
+        started.wait(timeout=5)
+        others = [executor.submit(cache.get_or_build, "job", build) for _ in range(3)]
+        release.set()
+
+        payloads = [first.result()] + [other.result() for other in others]
+
+    assert len(builds) == 1
+    assert all(payload is payloads[0] for payload in payloads)
+    assert payloads[0].body == b'{"rows":[1,2,3]}'
+
+
+def test_least_recently_used_payloads_are_evicted_by_size():
+    cache = payload_cache.PayloadCache(max_bytes=250)
+
+    cache.put("a", make_payload(100))
+    cache.put("b", make_payload(100))
+    assert cache.get("a") is not None
+    cache.put("c", make_payload(100))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.size_bytes == 200
+
+    # A payload larger than the whole cache is not stored
+    cache.put("d", make_payload(300))
+    assert cache.get("d") is None
+    assert len(cache) == 2
+
+
+def test_missing_payloads_are_not_cached():
+    cache = payload_cache.PayloadCache()
+    results = iter([None, make_payload(10)])
+
+    assert cache.get_or_build("job", lambda: next(results)) is None
+    assert cache.get_or_build("job", lambda: next(results)).body == b"x" * 10
+    assert cache.get("job") is not None
+
+
+def test_failed_build_is_not_cached():
+    cache = payload_cache.PayloadCache()
+
+    def fail():
+        raise RuntimeError("Result table not found")
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_build("job", fail)
+
+    assert cache.get_or_build("job", lambda: make_payload(10)) is not None
+
+
+def test_large_bodies_are_gzipped():
+    payload = payload_cache.serialize(["value"] * 1000)
+
+    assert payload.gzipped_body is not None
+    assert payload.size == len(payload.body) + len(payload.gzipped_body)
+    assert payload_cache.serialize(["value"]).gzipped_body is None
@@ -0,0 +1,34 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+import pyarrow as pa
+
+from services import result_store
+
+
+def test_stores_keep_their_results_apart_and_delete_them(tmp_path):
+    first = result_store.ResultStore(root_dir=str(tmp_path))
+    second = result_store.ResultStore(root_dir=str(tmp_path))
+
+    first.write("1", "prediction", pa.table({"value": [1.0, 2.0]}))
+
+    assert first.read("1", "prediction")["value"].tolist() == [1.0, 2.0]
+    assert not second.has("1", "prediction")
+    assert second.read("1", "prediction") is None
+
+    first.close()
+    assert not first.has("1", "prediction")
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,122 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+
+import pytest
+
+pytest.importorskip("google.cloud.bigquery")
+
+from services import upload_cache
+
+DAY_SECONDS = 24 * 60 * 60
+
+
+class FakeTables:
+    """Tables uploaded, deleted and checked by an upload cache."""
+
+    def __init__(self) -> None:
+        self.existing = set()
+        self.deleted = []
+        self._ids = itertools.count()
+
+    def upload(self) -> str:
+        table_id = f"project.upload_{next(self._ids)}.data"
+        self.existing.add(table_id)
+        return table_id
+
+    def exists(self, table_id: str) -> bool:
+        return table_id in self.existing
+
+    def delete(self, table_id: str) -> None:
+        self.existing.discard(table_id)
+        self.deleted.append(table_id)
+
+
+@pytest.fixture
+def tables():
+    return FakeTables()
+
+
+@pytest.fixture
+def make_cache(tmp_path, tables):
+    def make_cache() -> upload_cache.UploadCache:
+        return upload_cache.UploadCache(
+            manifest_path=str(tmp_path / "manifest.json"),
+            max_age_seconds=7 * DAY_SECONDS,
+            reuse_margin_seconds=DAY_SECONDS,
+            table_exists=tables.exists,
+            delete_table=tables.delete,
+        )
+
+    return make_cache
+
+
+def age(cache: upload_cache.UploadCache, key: str, seconds: float) -> None:
+    cache._entries[key]["created_at"] -= seconds
+
+
+def test_identical_uploads_are_reused(make_cache, tables):
+    cache = make_cache()
+
+    table_id = cache.get_or_upload("key", tables.upload)
+
+    assert cache.get_or_upload("key", tables.upload) == table_id
+    assert cache.get_or_upload("other key", tables.upload) != table_id
+
+
+def test_manifest_is_reloaded_after_restart(make_cache, tables):
+    table_id = make_cache().get_or_upload("key", tables.upload)
+
+    assert make_cache().get_or_upload("key", tables.upload) == table_id
+
+
+def test_deleted_table_is_uploaded_again(make_cache, tables):
+    cache = make_cache()
+    table_id = cache.get_or_upload("key", tables.upload)
+    tables.existing.remove(table_id)
+
+    new_table_id = cache.get_or_upload("key", tables.upload)
+
+    assert new_table_id != table_id
+    assert make_cache().get_or_upload("key", tables.upload) == new_table_id
+
+
+def test_tables_stop_being_reused_before_they_are_deleted(make_cache, tables):
+    cache = make_cache()
+    table_id = cache.get_or_upload("key", tables.upload)
+
+    # Within the reuse margin of the maximum age, a new table is uploaded and
+    # the old one is left to BigQuery, for the jobs still using it
+    age(cache, "key", 6.5 * DAY_SECONDS)
+    new_table_id = cache.get_or_upload("key", tables.upload)
+    cache.collect_garbage(force=True)
+
+    assert new_table_id != table_id
+    assert tables.deleted == []
+    assert cache.get_or_upload("key", tables.upload) == new_table_id
+
+
+def test_expired_tables_are_deleted(make_cache, tables):
+    cache = make_cache()
+    table_id = cache.get_or_upload("key", tables.upload)
+
+    age(cache, "key", 6.5 * DAY_SECONDS)
+    cache.collect_garbage(force=True)
+    assert tables.deleted == []
+
+    age(cache, "key", DAY_SECONDS)
+    cache.collect_garbage(force=True)
+    assert tables.deleted == [table_id]
+    assert make_cache().get_or_upload("key", tables.upload) != table_id
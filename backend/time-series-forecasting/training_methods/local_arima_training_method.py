@@ -0,0 +1,82 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Any, Dict
+
+import local_forecasting
+from models import dataset
+from training_methods import local_statistical_training_method
+
+
+class LocalARIMATrainingMethod(
+    local_statistical_training_method.LocalStatisticalTrainingMethod
+):
+    """Used to run an ARIMA training job in-process, without BigQuery.
+
+    Takes the same parameters as BQML ARIMA+, including the required
+    dataFrequency, and always fits ARIMA.
+    """
+
+    @property
+    def id(self) -> str:
+        """A unique id representing this training method.
+
+        Returns:
+            str: The id
+        """
+        return "local_arima"
+
+    @property
+    def display_name(self) -> str:
+        """A display_name representing this training method.
+
+        Returns:
+            str: The name
+        """
+        return "Local ARIMA"
+
+    def train(
+        self,
+        dataset: dataset.Dataset,
+        model_parameters: Dict[str, Any],
+        prediction_parameters: Dict[str, Any],
+    ) -> str:
+        """Train a job and return the model URI.
+
+        The forecast is made along with training, as with the HORIZON of BQML
+        ARIMA+, and stored with the model.
+
+        Args:
+            dataset (dataset.Dataset): Input dataset.
+            model_parameters (Dict[str, Any]): The model training parameters.
+            prediction_parameters (Dict[str, Any]): The prediction parameters.
+
+        Returns:
+            str: The model URI
+        """
+        data_frequency_parameter = (
+            local_statistical_training_method.DATA_FREQUENCY_COLUMN_PARAMETER
+        )
+
+        if model_parameters.get(data_frequency_parameter) is None:
+            raise ValueError(f"Missing argument: {data_frequency_parameter}")
+
+        return super().train(
+            dataset=dataset,
+            model_parameters={
+                **model_parameters,
+                local_statistical_training_method.MODEL_PARAMETER: local_forecasting.MODEL_ARIMA,
+            },
+            prediction_parameters=prediction_parameters,
+        )
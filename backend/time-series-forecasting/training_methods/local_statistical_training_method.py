@@ -0,0 +1,196 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import uuid
+from typing import Any, Dict
+
+import constants
+import local_forecasting
+from models import dataset, forecast_job_request
+from services import result_store
+from training_methods import training_method
+
+TIME_COLUMN_PARAMETER = "timeColumn"
+TARGET_COLUMN_PARAMETER = "targetColumn"
+TIME_SERIES_IDENTIFIER_COLUMN_PARAMETER = "timeSeriesIdentifierColumn"
+DATA_FREQUENCY_COLUMN_PARAMETER = "dataFrequency"
+MODEL_PARAMETER = "model"
+SEASONAL_PERIOD_PARAMETER = "seasonalPeriod"
+FORECAST_HORIZON_PARAMETER = "forecastHorizon"
+
+EVALUATION_FILE = "evaluation.arrow"
+PREDICTION_FILE = "prediction.arrow"
+
+
+class LocalStatisticalTrainingMethod(training_method.TrainingMethod):
+    """Used to fit a statistical model per series in-process.
+
+    The model is one of local_forecasting.FORECASTERS: seasonal naive, ETS,
+    Theta or ARIMA. Series are fitted in parallel across cores, and the
+    evaluation and prediction are written as local files.
+    """
+
+    @property
+    def id(self) -> str:
+        """A unique id representing this training method.
+
+        Returns:
+            str: The id
+        """
+        return "local_statistical"
+
+    @property
+    def display_name(self) -> str:
+        """A display_name representing this training method.
+
+        Returns:
+            str: The name
+        """
+        return "Local statistical"
+
+    def dataset_time_series_identifier_column(
+        self, job_request: forecast_job_request.ForecastJobRequest
+    ) -> str:
+        """The column representing the time series identifier variable in the dataset dataframe.
+
+        Returns:
+            str: The column name
+        """
+        return job_request.model_parameters[TIME_SERIES_IDENTIFIER_COLUMN_PARAMETER]
+
+    def dataset_time_column(
+        self, job_request: forecast_job_request.ForecastJobRequest
+    ) -> str:
+        """The column representing the time variable in the dataset dataframe.
+
+        Returns:
+            str: The column name
+        """
+        return job_request.model_parameters[TIME_COLUMN_PARAMETER]
+
+    def dataset_target_column(
+        self, job_request: forecast_job_request.ForecastJobRequest
+    ) -> str:
+        """The column representing the target variable in the dataset dataframe.
+
+        Returns:
+            str: The column name
+        """
+        return job_request.model_parameters[TARGET_COLUMN_PARAMETER]
+
+    def train(
+        self,
+        dataset: dataset.Dataset,
+        model_parameters: Dict[str, Any],
+        prediction_parameters: Dict[str, Any],
+    ) -> str:
+        """Train a job and return the model URI.
+
+        The forecast is made along with training and stored with the model.
+
+        Args:
+            dataset (dataset.Dataset): Input dataset.
+            model_parameters (Dict[str, Any]): The model training parameters.
+            prediction_parameters (Dict[str, Any]): The prediction parameters.
+
+        Returns:
+            str: The model URI
+        """
+
+        time_column = model_parameters.get(TIME_COLUMN_PARAMETER)
+        target_column = model_parameters.get(TARGET_COLUMN_PARAMETER)
+        time_series_id_column = model_parameters.get(
+            TIME_SERIES_IDENTIFIER_COLUMN_PARAMETER
+        )
+        dataFrequency = model_parameters.get(
+            DATA_FREQUENCY_COLUMN_PARAMETER, local_forecasting.AUTO_FREQUENCY
+        )
+        model = model_parameters.get(MODEL_PARAMETER, local_forecasting.MODEL_ETS)
+        seasonal_period = model_parameters.get(SEASONAL_PERIOD_PARAMETER)
+        forecast_horizon = prediction_parameters.get(FORECAST_HORIZON_PARAMETER)
+
+        if time_column is None:
+            raise ValueError(f"Missing argument: {TIME_COLUMN_PARAMETER}")
+
+        if target_column is None:
+            raise ValueError(f"Missing argument: {TARGET_COLUMN_PARAMETER}")
+
+        if time_series_id_column is None:
+            raise ValueError(
+                f"Missing argument: {TIME_SERIES_IDENTIFIER_COLUMN_PARAMETER}"
+            )
+
+        if model not in local_forecasting.FORECASTERS:
+            raise ValueError(
+                f"Unsupported {MODEL_PARAMETER}: {model}. "
+                f"Expected one of {list(local_forecasting.FORECASTERS)}"
+            )
+
+        if forecast_horizon is None:
+            raise ValueError(f"Missing argument: {FORECAST_HORIZON_PARAMETER}")
+
+        result = local_forecasting.forecast(
+            df=dataset.df,
+            time_series_identifier_column=time_series_id_column,
+            time_column=time_column,
+            target_column=target_column,
+            data_frequency=dataFrequency,
+            horizon=int(forecast_horizon),
+            model=model,
+            seasonal_period=int(seasonal_period) if seasonal_period else None,
+        )
+
+        # Unique across worker processes sharing the directory, unlike the
+        # seeded utils.generate_uuid
+        model_dir = os.path.join(constants.LOCAL_MODEL_DIR, uuid.uuid4().hex)
+        result_store.write_file(
+            os.path.join(model_dir, EVALUATION_FILE), result.evaluation
+        )
+        result_store.write_file(
+            os.path.join(model_dir, PREDICTION_FILE), result.prediction
+        )
+
+        return result_store.get_file_uri(model_dir)
+
+    def evaluate(self, model: str) -> str:
+        """Evaluate a model and return the URI to its evaluation table.
+
+        Args:
+            model (str): Model to evaluate.
+
+        Returns:
+            str: The local evaluation table URI.
+        """
+        return os.path.join(model, EVALUATION_FILE)
+
+    def predict(
+        self,
+        dataset: dataset.Dataset,
+        model: str,
+        model_parameters: Dict[str, Any],
+        prediction_parameters: Dict[str, Any],
+    ) -> str:
+        """Predict using a model and return the URI to its prediction table.
+
+        Args:
+            dataset (dataset.Dataset): Input dataset.
+            model (str): Model to evaluate.
+            model_parameters (Dict[str, Any]): The model training parameters.
+            prediction_parameters (Dict[str, Any]): The prediction parameters.
+
+        Returns:
+            str: The local prediction table URI.
+        """
+        return os.path.join(model, PREDICTION_FILE)
@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
 import random
 import string
 import pandas as pd
@@ -19,6 +20,13 @@ from google.cloud import bigquery
 
 random.seed(1236)
 
+
+@functools.lru_cache(maxsize=None)
+def get_bigquery_client() -> bigquery.Client:
+    """Get a BigQuery client shared by the process, rather than one per call."""
+    return bigquery.Client()
+
+
 # Generate a uuid of a specifed length(default=8)
 def generate_uuid(length: int = 8) -> str:
     return "".join(random.choices(string.ascii_lowercase + string.digits, k=length))
@@ -0,0 +1,187 @@
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compact, memory-mapped storage for line-based corpus files.
+
+A text file with one entry per line is compiled once into a binary file laid
+out as:
+
+    magic (8 bytes) | count (uint64) | offsets (count + 1 uint64) | UTF-8 blob
+
+All integers are little-endian. The compiled file is opened with mmap, so every
+worker process on a host shares the same page cache instead of holding its own
+list of strings, and startup does not need to parse the text file.
+
+Usage:
+
+    python corpus_helper.py data/stackoverflow_questions.txt
+"""
+
+import array
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from typing import Iterable, List, Sequence, overload
+
+logger = logging.getLogger(__name__)
+
+CORPUS_MAGIC = b"CORPUS01"
+CORPUS_SUFFIX = ".corpus"
+
+_HEADER = struct.Struct("<8sQ")
+
+
+def get_corpus_path(text_file: str) -> str:
+    """Get the path of the compiled corpus for a given text file."""
+    return text_file + CORPUS_SUFFIX
+
+
+def write_corpus(entries: Iterable[str], corpus_file: str) -> int:
+    """Write entries to a compiled corpus file.
+
+    The file is written to a temporary file first and then atomically moved
+    into place, so concurrent readers never observe a partial file.
+
+    Args:
+        entries (Iterable[str]): The entries to write.
+        corpus_file (str): The destination path.
+
+    Returns:
+        int: The number of entries written.
+    """
+    offsets = array.array("Q", [0])
+    blob = bytearray()
+
+    for entry in entries:
+        blob += entry.encode("utf-8")
+        offsets.append(len(blob))
+
+    if sys.byteorder != "little":
+        offsets.byteswap()
+
+    directory = os.path.dirname(os.path.abspath(corpus_file))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_HEADER.pack(CORPUS_MAGIC, len(offsets) - 1))
+            f.write(offsets.tobytes())
+            f.write(blob)
+        os.replace(temp_path, corpus_file)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+    return len(offsets) - 1
+
+
+def compile_text_file(text_file: str) -> str:
+    """Compile a text file with one entry per line into a corpus file.
+
+    Lines are stripped of surrounding whitespace, matching how the text files
+    were previously read.
+
+    Returns:
+        str: The path of the compiled corpus file.
+    """
+    corpus_file = get_corpus_path(text_file)
+
+    with open(text_file, "r", encoding="utf-8") as f:
+        count = write_corpus((line.strip() for line in f), corpus_file)
+
+    logger.info(f"Compiled {count} entries from {text_file} to {corpus_file}")
+
+    return corpus_file
+
+
+class CorpusFile(Sequence[str]):
+    """A read-only sequence of strings backed by a memory-mapped corpus file."""
+
+    def __init__(self, corpus_file: str) -> None:
+        with open(corpus_file, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, count = _HEADER.unpack_from(self._mmap, 0)
+
+        if magic != CORPUS_MAGIC:
+            raise ValueError(f"Not a corpus file: {corpus_file}")
+
+        self._count = count
+        self._blob_start = _HEADER.size + 8 * (count + 1)
+
+        offsets_view = memoryview(self._mmap)[_HEADER.size : self._blob_start]
+        if sys.byteorder == "little":
+            # Zero-copy view over the mapped offsets
+            self._offsets: Sequence[int] = offsets_view.cast("Q")
+        else:
+            offsets = array.array("Q", offsets_view)
+            offsets.byteswap()
+            self._offsets = offsets
+
+    def __len__(self) -> int:
+        return self._count
+
+    @overload
+    def __getitem__(self, index: int) -> str:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[str]:
+        ...
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+
+        if index < 0:
+            index += self._count
+        if index < 0 or index >= self._count:
+            raise IndexError("corpus index out of range")
+
+        start = self._blob_start + self._offsets[index]
+        end = self._blob_start + self._offsets[index + 1]
+
+        return self._mmap[start:end].decode("utf-8")
+
+
+def load_corpus(text_file: str) -> CorpusFile:
+    """Open the compiled corpus for a text file, compiling it if needed.
+
+    The corpus is (re)compiled when it is missing or older than the text file.
+    Corpora are normally compiled at build time, see the Dockerfile.
+
+    Args:
+        text_file (str): Path to a text file with one entry per line.
+
+    Returns:
+        CorpusFile: The memory-mapped entries.
+    """
+    corpus_file = get_corpus_path(text_file)
+
+    if not os.path.exists(corpus_file) or os.path.getmtime(
+        corpus_file
+    ) < os.path.getmtime(text_file):
+        compile_text_file(text_file)
+
+    return CorpusFile(corpus_file)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    for path in sys.argv[1:]:
+        compile_text_file(path)
@@ -16,7 +16,7 @@ import dataclasses
 import logging
 from typing import Dict, List
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
@@ -65,12 +65,15 @@ async def get_search_registry():
     ]
 
 
-@app.get("/suggestions/{search_service_id}")
+@app.get("/suggestions/{search_service_id}", response_model=GetSuggestionsResponse)
 async def get_suggestions(search_service_id: str):
     with tracer.start_as_current_span(f"/suggestions/{search_service_id}"):
         service = search_service_registry.get(search_service_id)
         if service:
-            return GetSuggestionsResponse(items=service.get_suggestions())
+            return Response(
+                content=service.get_serialized_suggestions(),
+                media_type="application/json",
+            )
         else:
             raise HTTPException(
                 status_code=400,
@@ -18,6 +18,7 @@ import logging
 from typing import Any, Dict, Generic, List, Optional, Tuple, TypeVar
 
 import tracer_helper
+from services.suggestion_pool import SuggestionPool
 
 T = TypeVar("T")
 
@@ -34,7 +35,7 @@ class SearchResult:
     image: Optional[str] = None
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(frozen=True)
 class Item:
     text: str
     id: Optional[str]
@@ -48,6 +49,8 @@ class CodeInfo:
 
 
 class SearchService(abc.ABC, Generic[T]):
+    suggestion_pool: SuggestionPool[Item]
+
     @abc.abstractproperty
     def id(self) -> str:
         """Unique identifier for this service."""
@@ -73,10 +76,15 @@ class SearchService(abc.ABC, Generic[T]):
         """Info about code used to generate index."""
         return None
 
-    @abc.abstractmethod
+    @tracer.start_as_current_span("get_suggestions")
     def get_suggestions(self, num_items: int = 60) -> List[Item]:
-        """Get all existing ids and items."""
-        pass
+        """Get a sample of existing ids and items."""
+        return self.suggestion_pool.sample(num_items)
+
+    @tracer.start_as_current_span("get_serialized_suggestions")
+    def get_serialized_suggestions(self, num_items: int = 60) -> bytes:
+        """Get suggestions as a pre-serialized JSON response body."""
+        return self.suggestion_pool.get_serialized_sample(num_items)
 
     @abc.abstractmethod
     def get_by_id(self, id: str) -> Optional[T]:
@@ -16,14 +16,15 @@ import abc
 import dataclasses
 import functools
 import logging
-import random
 import subprocess
 from typing import Any, Dict, List, Optional
 
 import requests
 
+import corpus_helper
 import tracer_helper
 from services.search_service import CodeInfo, Item, SearchResult, SearchService
+from services.suggestion_pool import SuggestionPool
 
 logger = logging.getLogger(__name__)
 tracer = tracer_helper.get_tracer(__name__)
@@ -83,23 +84,18 @@ class UnifiedCloudSearchService(SearchService[str]):
         self._description = description
         self._code_info = code_info
 
-        with open(words_file, "r") as f:
-            words = f.readlines()
-            self.words = [word.strip() for word in words]
+        self.suggestion_pool = SuggestionPool(
+            (
+                corpus_helper.load_corpus(words_file),
+                lambda word: Item(id=word, text=word, image=None),
+            )
+        )
 
         self.project_id = project_id
         self.location = location
         self.datastore_id = datastore_id
         self.is_staging = is_staging
 
-    @tracer.start_as_current_span("get_all")
-    def get_suggestions(self, num_items: int = 60) -> List[Item]:
-        """Get all existing ids and items."""
-        return random.sample(
-            [Item(id=word, text=word, image=None) for word in self.words],
-            min(num_items, len(self.words)),
-        )
-
     @tracer.start_as_current_span("get_by_id")
     def get_by_id(self, id: str) -> Optional[str]:
         """Get an item by id."""